@@ -17,7 +17,32 @@ class Config:
 
     # Database configuration
     SQLALCHEMY_DATABASE_URI = environ.get('SQLALCHEMY_DATABASE_URI')
-    SQLALCHEMY_ECHO = True
+    SQLALCHEMY_ECHO = environ.get('SQLALCHEMY_ECHO') == 'True'
     SQLALCHEMY_TRACK_MODIFICATIONS = False
 
-    REPOSITORY = environ.get('REPOSITORY')
\ No newline at end of file
+    # Connection pool configuration (file-based databases only)
+    SQLALCHEMY_POOL_SIZE = int(environ.get('SQLALCHEMY_POOL_SIZE', 5))
+    SQLALCHEMY_MAX_OVERFLOW = int(environ.get('SQLALCHEMY_MAX_OVERFLOW', 10))
+    SQLALCHEMY_POOL_RECYCLE = int(environ.get('SQLALCHEMY_POOL_RECYCLE', 3600))
+
+    # PRAGMAs applied to every new SQLite connection
+    SQLITE_PRAGMAS = {
+        'journal_mode': environ.get('SQLITE_JOURNAL_MODE', 'WAL'),
+        'synchronous': environ.get('SQLITE_SYNCHRONOUS', 'NORMAL'),
+        'mmap_size': int(environ.get('SQLITE_MMAP_SIZE', 268435456)),
+        'cache_size': int(environ.get('SQLITE_CACHE_SIZE', -65536))
+    }
+
+    REPOSITORY = environ.get('REPOSITORY')
+
+    # Snapshot file the memory repository is loaded from and saved to (unset loads the data files on every start)
+    MEMORY_SNAPSHOT_PATH = environ.get('MEMORY_SNAPSHOT_PATH') or None
+
+    # Cache of seed users' password hashes, so only new or changed users are hashed (unset hashes them all every time)
+    CREDENTIALS_CACHE_PATH = environ.get('CREDENTIALS_CACHE_PATH') or None
+
+    # Number of random movies sampled at once for the sidebar (0 samples on every request)
+    SELECTED_MOVIES_POOL_SIZE = int(environ.get('SELECTED_MOVIES_POOL_SIZE', 0))
+
+    # Total size of rendered template fragments kept between requests (0 renders them every time)
+    FRAGMENT_CACHE_BYTES = int(environ.get('FRAGMENT_CACHE_BYTES', 0))
@@ -1,16 +1,16 @@
 """Initialize Flask app."""
 
 import os
+import time
 
+import click
 from flask import Flask
 
-from sqlalchemy import create_engine
 from sqlalchemy.orm import sessionmaker, clear_mappers
-from sqlalchemy.pool import NullPool
 
 import movies.adapters.repository as repo
 from movies.adapters import memory_repository, database_repository
-from movies.adapters.orm import metadata, map_model_to_tables
+from movies.adapters.orm import map_model_to_tables, create_missing_indexes, create_search_index, migrate_tables
 
 
 def create_app(test_config=None):
@@ -32,44 +32,72 @@ def create_app(test_config=None):
     # persistent database data storage for our application.
 
     if app.config['REPOSITORY'] == 'memory':
-        # Create the MemoryRepository instance for a memory-based repository.
+        # Create the MemoryRepository instance for a memory-based repository. It's loaded from a snapshot of the data
+        # files where there's one saved from them as they are, and otherwise from the files, saving a new snapshot.
         repo.repo_instance = memory_repository.MemoryRepository()
-        memory_repository.populate(data_path, repo.repo_instance)
+        memory_repository.populate(
+            data_path, repo.repo_instance, snapshot_path=app.config.get('MEMORY_SNAPSHOT_PATH'),
+            credentials_cache_path=app.config.get('CREDENTIALS_CACHE_PATH')
+        )
 
     elif app.config['REPOSITORY'] == 'database':
         # Configure database.
-        database_uri = app.config['SQLALCHEMY_DATABASE_URI']
-
         # We create a comparatively simple SQLite database, which is based on a single file (see .env for URI).
         # For example the file database could be located locally and relative to the application in movies-19.db,
-        # leading to a URI of "sqlite:///movies-19.db".
+        # leading to a URI of "sqlite:///movies-19.db". Connections are pooled, and each new connection is tuned with
+        # the PRAGMAs in SQLITE_PRAGMAS (see config.py).
         # Note that create_engine does not establish any actual DB connection directly!
-        database_echo = app.config['SQLALCHEMY_ECHO']
-        database_engine = create_engine(database_uri, connect_args={"check_same_thread": False}, poolclass=NullPool,
-                                        echo=database_echo)
+        database_engine = database_repository.create_database_engine(app.config)
 
         if app.config['TESTING'] == 'True' or len(database_engine.table_names()) == 0:
             print("REPOPULATING DATABASE")
-            # For testing, or first-time use of the web application, reinitialise the database.
+            # For testing or first-time use of the web application, build the tables and bulk-load them (see
+            # bulk_populate).
             clear_mappers()
-            metadata.create_all(database_engine)  # Conditionally create database tables.
-            for table in reversed(metadata.sorted_tables):  # Remove any data from the tables.
-                database_engine.execute(table.delete())
 
             # Generate mappings that map domain model classes to the database tables.
             map_model_to_tables()
 
-            database_repository.populate(database_engine, data_path)
+            start = time.perf_counter()
+            number_of_rows = database_repository.bulk_populate(
+                database_engine, data_path, credentials_cache_path=app.config.get('CREDENTIALS_CACHE_PATH')
+            )
+            seconds = time.perf_counter() - start
+            print(f"LOADED {number_of_rows} ROWS IN {seconds:.2f}s ({number_of_rows / seconds:.0f} ROWS/S)")
 
         else:
+            # Bring an existing database up to date with the declared schema, keeping its rows, users and reviews
+            # written through the site among them: rebuild tables from an older schema (SQLite can't change the
+            # columns of an existing table), and add any indexes declared since it was created.
+            migrated_tables = migrate_tables(database_engine)
+            if len(migrated_tables) > 0:
+                print(f"MIGRATED TABLES: {', '.join(migrated_tables)}")
+                # Migration leaves the columns it adds NULL, such as movies' votes, revenue and metascore; sync-data
+                # fills them in from the data files.
+                print("COLUMNS ADDED BY THE MIGRATION ARE EMPTY: RUN `flask sync-data` TO FILL THEM IN")
+            create_missing_indexes(database_engine)
+
             # Solely generate mappings that map domain model classes to the database tables.
             map_model_to_tables()
 
+        # Build the full-text search index if it's missing, or resynchronise it after the tables were rebuilt.
+        create_search_index(database_engine)
+
         # Create the database session factory using sessionmaker (this has to be done once, in a global manner)
         session_factory = sessionmaker(autocommit=False, autoflush=True, bind=database_engine)
         # Create the SQLAlchemy DatabaseRepository instance for an sqlite3-based repository.
         repo.repo_instance = database_repository.SqlAlchemyRepository(session_factory)
 
+        @app.cli.command('sync-data')
+        def sync_data():
+            """Apply changes to the data files to the database, while the site keeps running."""
+            counts = database_repository.sync(
+                database_engine, data_path, credentials_cache_path=app.config.get('CREDENTIALS_CACHE_PATH')
+            )
+            for table, table_counts in counts.items():
+                click.echo(f"{table}: {table_counts.inserted} inserted, {table_counts.updated} updated, "
+                           f"{table_counts.unchanged} unchanged, {table_counts.skipped} skipped")
+
 
     # Build the application - these steps require an application context.
     with app.app_context():
@@ -87,6 +115,9 @@ def create_app(test_config=None):
         from .utilities import utilities
         app.register_blueprint(utilities.utilities_blueprint)
 
+        from .api import api
+        app.register_blueprint(api.api_blueprint)
+
         # Register a callback the makes sure that database sessions are associated with http requests
         # We reset the session inside the database repository before a new flask request is generated
         @app.before_request
@@ -100,4 +131,9 @@ def create_app(test_config=None):
             if isinstance(repo.repo_instance, database_repository.SqlAlchemyRepository):
                 repo.repo_instance.close_session()
 
+        # Precompute the similar-movies recommender and the search box's completion index, rather than leaving them to
+        # the first request that needs them.
+        news.get_recommender()
+        repo.repo_instance.build_completion_index()
+
     return app
\ No newline at end of file
@@ -0,0 +1,76 @@
+import threading
+from typing import Hashable, List
+
+
+# Number of neighbours kept for each movie. Lookups return at most this many.
+TOP_K = 10
+
+# Number of co-review counters kept for each movie. Once a movie has counters for twice this many movies, only the
+# counters of the COUNTERS_PER_MOVIE most co-reviewed are kept. Counts are exact until a movie's first trim; after
+# it, a movie that comes back starts counting again from one. Trimming in bulk costs one sort per COUNTERS_PER_MOVIE
+# new neighbours, and bounds memory by the number of movies rather than the number of co-reviewed pairs.
+COUNTERS_PER_MOVIE = 4 * TOP_K
+
+
+class CoReviewIndex:
+    # Counts, for each pair of movies, the users who reviewed both. The user x movie interactions are kept as the
+    # list of movies each user has reviewed; a review of a movie new to the user adds one to its count with each of
+    # the user's earlier movies, in both directions. Repeat reviews of a movie by the same user don't count.
+    #
+    # Each movie's top TOP_K neighbours, by count and then id, are worked out from its counters when first asked for
+    # and kept until a review changes them, so a lookup is a dictionary access whatever the number of reviews.
+
+    def __init__(self):
+        self._movies_of_user = dict()
+        self._counters = dict()
+        self._top = dict()
+        self._lock = threading.Lock()
+
+    @property
+    def number_of_interactions(self) -> int:
+        return sum(len(movie_ids) for movie_ids in self._movies_of_user.values())
+
+    def add_review(self, user: Hashable, movie_id: int):
+        with self._lock:
+            movie_ids = self._movies_of_user.get(user)
+            if movie_ids is None:
+                movie_ids = self._movies_of_user[user] = list()
+            elif movie_id in movie_ids:
+                return
+
+            if len(movie_ids) > 0:
+                # This runs for every earlier movie of every reviewer, so it's kept to plain dict operations.
+                all_counters = self._counters
+                top = self._top
+                counters = all_counters.get(movie_id)
+                if counters is None:
+                    counters = all_counters[movie_id] = dict()
+                for other_id in movie_ids:
+                    counters[other_id] = counters.get(other_id, 0) + 1
+                    other_counters = all_counters.get(other_id)
+                    if other_counters is None:
+                        other_counters = all_counters[other_id] = dict()
+                    other_counters[movie_id] = other_counters.get(movie_id, 0) + 1
+                    if len(other_counters) >= 2 * COUNTERS_PER_MOVIE:
+                        self._trim(other_id)
+                    top.pop(other_id, None)
+                if len(counters) >= 2 * COUNTERS_PER_MOVIE:
+                    self._trim(movie_id)
+                top.pop(movie_id, None)
+
+            movie_ids.append(movie_id)
+
+    def _trim(self, movie_id: int):
+        counters = self._counters[movie_id]
+        kept = sorted(counters, key=lambda id: (-counters[id], id))[:COUNTERS_PER_MOVIE]
+        self._counters[movie_id] = {id: counters[id] for id in kept}
+
+    def get_co_reviewed_movie_ids(self, movie_id: int, quantity: int) -> List[int]:
+        # Returns up to quantity (at most TOP_K) ids of the movies most often reviewed by reviewers of movie_id.
+        top = self._top.get(movie_id)
+        if top is None:
+            with self._lock:
+                counters = self._counters.get(movie_id, dict())
+                top = sorted(counters, key=lambda other_id: (-counters[other_id], other_id))[:TOP_K]
+                self._top[movie_id] = top
+        return top[:max(quantity, 0)]
@@ -0,0 +1,222 @@
+import heapq
+import threading
+from bisect import bisect_left, insort_left
+from collections import namedtuple
+from typing import Iterable, List
+
+from movies.adapters.search_index import STOP_WORDS, tokenize
+
+
+# A suggestion for a typed prefix. kind is one of COMPLETION_KINDS; movie_id is only set for titles.
+Completion = namedtuple('Completion', ['kind', 'text', 'movie_id'])
+
+COMPLETION_KINDS = ('title', 'director', 'actor')
+
+# Prefixes matching more entries than this have their completions cached until the index next changes. Only short
+# prefixes match so many, and ranking all their matches on every keystroke would be the slowest part of a lookup.
+CACHE_THRESHOLD = 256
+
+
+def normalize(text: str) -> str:
+    # Case-folds, strips diacritics and collapses punctuation and spacing, as the search index does.
+    return ' '.join(tokenize(text))
+
+
+def split_people(names) -> List[str]:
+    # Movie.actors is a comma-joined string of names.
+    if not names:
+        return list()
+    return [name.strip() for name in names.split(',') if name.strip() != '']
+
+
+def word_starts(key: str, skip_stop_words: bool) -> List[str]:
+    # Returns the key from the start of each of its words, so that a prefix can match any word and what follows it.
+    words = key.split(' ')
+    return [
+        ' '.join(words[position:]) for position in range(len(words))
+        if position == 0 or not (skip_stop_words and words[position] in STOP_WORDS)
+    ]
+
+
+def remove_entry(sorted_entries: list, entry):
+    position = bisect_left(sorted_entries, entry)
+    if position < len(sorted_entries) and sorted_entries[position] == entry:
+        del sorted_entries[position]
+
+
+class CompletionIndex:
+    # A sorted array of (key, kind, value) entries, where key is a normalized title or name from one of its words
+    # onwards, and value is a movie id for titles or a normalized name for people. A prefix's matches form one
+    # contiguous run of the array, found by binary search. Matches are ranked within their kind: titles by number of
+    # votes, and people by the number of movies they acted in or directed.
+    #
+    # Completions of short prefixes, which match many entries, are cached. Adding a movie only adds entries and
+    # raises weights, so the cached completions of the prefixes it touches are brought up to date by ranking them
+    # together with the movie's title and people, rather than being thrown away.
+    #
+    # Writers hold a lock; readers don't. Writers change a copy of the array and then swap it in, so a reader's binary
+    # search and slice always see one consistent array. Names and weights are recorded before entries are inserted,
+    # and entries removed before them, so a reader never finds an entry it can't describe. A reader only caches what
+    # it computed if no write happened in the meantime.
+
+    def __init__(self):
+        self._entries = list()
+        self._titles = dict()
+        self._people = dict()
+        self._indexed_movies = dict()
+        self._cache = dict()
+        self._version = 0
+        self._lock = threading.Lock()
+
+    def add_movie(self, movie_id: int, title: str, actors: str, director: str, votes: int = None):
+        with self._lock:
+            replaced = movie_id in self._indexed_movies
+            sorted_entries = list(self._entries)
+            entries, touched = self._index_movie(sorted_entries, movie_id, title, actors, director, votes)
+            for entry in entries:
+                insort_left(sorted_entries, entry)
+            self._entries = sorted_entries
+
+            self._version += 1
+            if replaced:
+                # Replacing a movie can lower weights, which cached completions can't account for.
+                self._cache = dict()
+            else:
+                self._refresh_cache(touched)
+
+    def add_movies(self, movies: Iterable[tuple]):
+        # Bulk version of add_movie for (movie_id, title, actors, director, votes) tuples. Sorting once is far cheaper
+        # than inserting each entry into its place.
+        with self._lock:
+            sorted_entries = list(self._entries)
+            new_entries = list()
+            for movie in movies:
+                new_entries += self._index_movie(sorted_entries, *movie)[0]
+            self._entries = sorted(sorted_entries + new_entries)
+            self._version += 1
+            self._cache = dict()
+
+    def _index_movie(self, sorted_entries: list, movie_id, title, actors, director, votes):
+        # Records the movie's title and people, removing any entries it had from sorted_entries. Returns the entries
+        # to add to the array, and the (kind, value, keys) of the title and every person, whose weights may have
+        # changed.
+        if movie_id in self._indexed_movies:
+            self._remove_movie(sorted_entries, movie_id)
+
+        entries = list()
+        touched = list()
+        people = list()
+
+        title_key = normalize(title)
+        if title_key != '':
+            self._titles[movie_id] = (title, votes or 0)
+            keys = word_starts(title_key, skip_stop_words=True)
+            entries += [(key, 'title', movie_id) for key in keys]
+            touched.append(('title', movie_id, keys))
+
+        roles = [('actor', name) for name in split_people(actors)]
+        if director:
+            roles.append(('director', director.strip()))
+        for kind, name in roles:
+            name_key = normalize(name)
+            if name_key == '' or (kind, name_key) in people:
+                continue
+            people.append((kind, name_key))
+            person = self._people.setdefault((kind, name_key), [name, set()])
+            person[1].add(movie_id)
+            keys = word_starts(name_key, skip_stop_words=False)
+            if len(person[1]) == 1:
+                # The person's first movie; later ones only add weight.
+                entries += [(key, kind, name_key) for key in keys]
+            touched.append((kind, name_key, keys))
+
+        self._indexed_movies[movie_id] = (entries, people)
+        return entries, touched
+
+    def _remove_movie(self, sorted_entries: list, movie_id: int):
+        entries, people = self._indexed_movies.pop(movie_id)
+        for entry in entries:
+            if entry[1] == 'title':
+                remove_entry(sorted_entries, entry)
+        for kind, name_key in people:
+            movie_ids = self._people[(kind, name_key)][1]
+            movie_ids.discard(movie_id)
+            if len(movie_ids) == 0:
+                for key in word_starts(name_key, skip_stop_words=False):
+                    remove_entry(sorted_entries, (key, kind, name_key))
+                del self._people[(kind, name_key)]
+        self._titles.pop(movie_id, None)
+
+    def _refresh_cache(self, touched):
+        # Everything outside a cached top-N keeps its weight, so the new top-N is the best of the old one and the
+        # touched title and people.
+        prefixes = {key[:length] for kind, value, keys in touched for key in keys for length in range(1, len(key) + 1)}
+        for prefix in prefixes:
+            cached = self._cache.get(prefix)
+            if cached is None:
+                continue
+
+            additions = [(kind, value) for kind, value, keys in touched if any(key.startswith(prefix) for key in keys)]
+            refreshed = dict()
+            for quantity, completions in cached.items():
+                candidates = {kind: set() for kind in COMPLETION_KINDS}
+                for completion in completions:
+                    value = completion.movie_id if completion.kind == 'title' else normalize(completion.text)
+                    candidates[completion.kind].add(value)
+                for kind, value in additions:
+                    candidates[kind].add(value)
+                refreshed[quantity] = self._rank(candidates, quantity)
+            self._cache[prefix] = refreshed
+
+    def complete(self, prefix: str, quantity: int) -> List[Completion]:
+        # Returns up to quantity completions of each kind, grouped in the order of COMPLETION_KINDS.
+        prefix = normalize(prefix)
+        if prefix == '' or quantity <= 0:
+            return list()
+
+        version = self._version
+        cached = self._cache.get(prefix)
+        if cached is not None and quantity in cached:
+            return cached[quantity]
+
+        # Every key starting with prefix sorts at or after prefix itself, and before prefix with its last character
+        # incremented.
+        entries = self._entries
+        start = bisect_left(entries, (prefix,))
+        end = bisect_left(entries, (prefix[:-1] + chr(ord(prefix[-1]) + 1),), start)
+
+        # A title or person may match through several of its words; rank each once.
+        candidates = {kind: set() for kind in COMPLETION_KINDS}
+        for key, kind, value in entries[start:end]:
+            candidates[kind].add(value)
+        completions = self._rank(candidates, quantity)
+
+        if end - start > CACHE_THRESHOLD:
+            with self._lock:
+                if self._version == version:
+                    self._cache[prefix] = {**self._cache.get(prefix, dict()), quantity: completions}
+        return completions
+
+    def _rank(self, candidates, quantity: int) -> List[Completion]:
+        completions = list()
+        for kind in COMPLETION_KINDS:
+            described = (self._describe(kind, value) for value in candidates[kind])
+            best = heapq.nsmallest(quantity, (item for item in described if item is not None))
+            completions += [completion for sort_key, completion in best]
+        return completions
+
+    def _describe(self, kind, value):
+        # Returns (sort key, Completion), where the sort key puts heavier entries first and then orders by text, or
+        # None if a concurrent write has just removed the entry.
+        if kind == 'title':
+            title = self._titles.get(value)
+            if title is None:
+                return None
+            text, votes = title
+            return (-votes, text, value), Completion(kind, text, value)
+
+        person = self._people.get((kind, value))
+        if person is None:
+            return None
+        name, movie_ids = person
+        return (-len(movie_ids), name, value), Completion(kind, name, None)
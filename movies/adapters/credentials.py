@@ -0,0 +1,152 @@
+import csv
+import hashlib
+import logging
+import os
+import re
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Tuple
+
+from werkzeug.security import check_password_hash, generate_password_hash
+
+
+# A seed user's password may be given in the clear, or already hashed by werkzeug's generate_password_hash, as in a
+# users file written by write_hashed_users_file. Hashes are taken as they are. Plain passwords are hashed, and given a
+# cache file, a user's hash is kept there against a fingerprint of their username and password, so the next load only
+# hashes users that are new or whose password changed. The fingerprint is a plain SHA-256, which reveals nothing the
+# seed file it's taken from doesn't already hold in the clear.
+#
+# Hashing is deliberately slow, so when there are at least PARALLEL_THRESHOLD passwords to hash they're shared out
+# among a pool of processes, one per core unless told otherwise.
+
+PARALLEL_THRESHOLD = 16
+
+logger = logging.getLogger(__name__)
+
+_PASSWORD_HASH = re.compile(r'^(pbkdf2:[a-z0-9]+(:\d+)?|scrypt:\d+:\d+:\d+)\$[^$]+\$[0-9a-f]+$')
+
+
+def is_password_hash(password: str) -> bool:
+    return _PASSWORD_HASH.match(password) is not None
+
+
+def fingerprint(username: str, password: str) -> str:
+    return hashlib.sha256(f'{username}\x00{password}'.encode('utf-8')).hexdigest()
+
+
+def hash_passwords(credentials: List[Tuple[str, str]], cache_path: str = None, processes: int = None) -> List[str]:
+    # Returns the hash of each (username, password) pair's password, in order, reusing and then updating any hashes
+    # cached at cache_path. processes limits the number of processes hashing passwords.
+    cache = read_cache(cache_path) if cache_path is not None else dict()
+    hashes, changed = _hash_with_cache(credentials, cache, processes)
+    if changed and cache_path is not None:
+        _save_cache(cache_path, cache)
+    return hashes
+
+
+def hash_password_batches(batches: Iterable[list], credentials: Callable[[Any], Tuple[str, str]],
+                          cache_path: str = None, processes: int = None) -> Iterator[Tuple[list, List[str]]]:
+    # As hash_passwords, for items that come in batches, such as the records of a large users file. Yields each batch
+    # with the hashes of its items' passwords; credentials returns an item's (username, password). The cache is read
+    # once, before the first batch, and written once, after the last.
+    cache = read_cache(cache_path) if cache_path is not None else dict()
+    changed = False
+    for batch in batches:
+        hashes, batch_changed = _hash_with_cache([credentials(item) for item in batch], cache, processes)
+        changed = changed or batch_changed
+        yield batch, hashes
+    if changed and cache_path is not None:
+        _save_cache(cache_path, cache)
+
+
+def _hash_with_cache(credentials: List[Tuple[str, str]], cache: Dict[str, Tuple[str, str]],
+                     processes: int = None) -> Tuple[List[str], bool]:
+    # Returns the hashes, adding any new ones to cache, and whether there were any.
+    hashes = list()
+    unhashed = dict()
+    for position, (username, password) in enumerate(credentials):
+        if is_password_hash(password):
+            hashes.append(password)
+            continue
+        cached = cache.get(username)
+        key = fingerprint(username, password)
+        if cached is not None and cached[0] == key:
+            hashes.append(cached[1])
+        else:
+            hashes.append(None)
+            unhashed[position] = key
+
+    if len(unhashed) > 0:
+        passwords = [credentials[position][1] for position in unhashed]
+        for position, password_hash in zip(unhashed, _generate_password_hashes(passwords, processes)):
+            hashes[position] = password_hash
+            cache[credentials[position][0]] = (unhashed[position], password_hash)
+    return hashes, len(unhashed) > 0
+
+
+def _save_cache(path: str, cache: Dict[str, Tuple[str, str]]):
+    try:
+        write_cache(path, cache)
+    except OSError as error:
+        # The hashes are complete without the cache; the next load just hashes these passwords again.
+        logger.warning('Could not save credentials cache: %s', error)
+
+
+def password_is_current(username: str, password: str, password_hash: str, cache: Dict[str, Tuple[str, str]]) -> bool:
+    # Returns True if password_hash is the hash of a seed user's password, checking the cache (see read_cache) before
+    # falling back to the slow check against the hash itself.
+    if is_password_hash(password):
+        return password == password_hash
+    if cache.get(username) == (fingerprint(username, password), password_hash):
+        return True
+    return check_password_hash(password_hash, password)
+
+
+def read_cache(path: str) -> Dict[str, Tuple[str, str]]:
+    # Returns the fingerprint and hash cached for each username, or nothing if there's no cache at path.
+    try:
+        with open(path, newline='', encoding='utf-8') as infile:
+            return {username: (key, password_hash) for username, key, password_hash in csv.reader(infile)}
+    except (OSError, ValueError):
+        return dict()
+
+
+def write_cache(path: str, cache: Dict[str, Tuple[str, str]]):
+    # Writes to a temporary file that then replaces any cache at path, so a reader never sees a partial cache.
+    temporary_path = f'{path}.{os.getpid()}.tmp'
+    with open(temporary_path, 'w', newline='', encoding='utf-8') as outfile:
+        writer = csv.writer(outfile)
+        for username, (key, password_hash) in cache.items():
+            writer.writerow([username, key, password_hash])
+    os.replace(temporary_path, path)
+
+
+def write_hashed_users_file(source: str, destination: str, processes: int = None):
+    # Copies a users file (id, username, password), hashing any plain passwords, so it can be seeded from directly.
+    with open(source, newline='', encoding='utf-8-sig') as infile:
+        rows = list(csv.reader(infile))
+    header, rows = rows[0], [[item.strip() for item in row] for row in rows[1:]]
+
+    hashes = hash_passwords([(row[1], row[2]) for row in rows], processes=processes)
+    with open(destination, 'w', newline='', encoding='utf-8') as outfile:
+        writer = csv.writer(outfile)
+        writer.writerow(header)
+        for row, password_hash in zip(rows, hashes):
+            writer.writerow([row[0], row[1], password_hash] + row[3:])
+
+
+def _generate_password_hashes(passwords: List[str], processes: int = None) -> List[str]:
+    processes = min(processes or os.cpu_count() or 1, len(passwords))
+    if processes < 2 or len(passwords) < PARALLEL_THRESHOLD:
+        return [generate_password_hash(password) for password in passwords]
+
+    with ProcessPoolExecutor(max_workers=processes) as executor:
+        chunksize = max(1, len(passwords) // (processes * 4))
+        return list(executor.map(generate_password_hash, passwords, chunksize=chunksize))
+
+
+if __name__ == '__main__':
+    import sys
+
+    if len(sys.argv) != 3:
+        sys.exit('usage: python -m movies.adapters.credentials USERS_CSV HASHED_USERS_CSV')
+    write_hashed_users_file(sys.argv[1], sys.argv[2])
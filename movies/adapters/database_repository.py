@@ -1,21 +1,45 @@
-import csv
+import hashlib
+import json
 import os
+import random
+import threading
+from collections import namedtuple
 
-from datetime import date
-from typing import List
+from datetime import date, datetime
+from itertools import islice
+from typing import Dict, List
 
-from sqlalchemy import desc, asc
+from sqlalchemy import desc, asc, func, select, bindparam, and_, true, Date, create_engine, event, literal_column
 from sqlalchemy.engine import Engine
+from sqlalchemy.engine.url import make_url
+from sqlalchemy.pool import QueuePool
 from sqlalchemy.orm.exc import NoResultFound, MultipleResultsFound
-from werkzeug.security import generate_password_hash
 
-from sqlalchemy.orm import scoped_session
+from sqlalchemy.orm import scoped_session, selectinload
 from flask import _app_ctx_stack
 
 from movies.domain.model import User, Movie, Review, Genre
-from movies.adapters.repository import AbstractRepository
+from movies.adapters.repository import AbstractRepository, MovieIdPage
+from movies.adapters import orm
+from movies.adapters.co_review_index import CoReviewIndex
+from movies.adapters.completion_index import Completion, CompletionIndex
+from movies.adapters.credentials import hash_password_batches, hash_passwords, password_is_current, read_cache
+from movies.adapters.facet_index import MovieFilter, empty_counts, rating_band
+from movies.adapters.ingestion import MovieRecord, parse_movie, parse_review, parse_user, read_records
+from movies.adapters.search_index import FIELD_WEIGHTS, query_terms
 
-genres = None
+# Number of movies inserted at a time by populate.
+INSERT_BATCH_SIZE = 10000
+
+# PRAGMAs bulk_populate loads the data under, before restoring the connection's settings. Journalling and syncing
+# are left as configured, so a failed or interrupted load can always be rolled back.
+BULK_LOAD_PRAGMAS = {
+    'temp_store': 'MEMORY',
+    'cache_size': -262144
+}
+
+# Number of facet queries whose results are kept by each repository.
+FACET_CACHE_SIZE = 64
 
 
 class SessionContextManager:
@@ -54,6 +78,15 @@ class SqlAlchemyRepository(AbstractRepository):
 
     def __init__(self, session_factory):
         self._session_cm = SessionContextManager(session_factory)
+        self._search_index_ready = False
+        self._completion_index = None
+        self._completion_position = None
+        self._co_review_index = None
+        self._co_review_position = None
+        self._index_lock = threading.Lock()
+        self._facet_cache = dict()
+        self._facet_lock = threading.Lock()
+        self._data_version = (None, None)
 
     def close_session(self):
         self._session_cm.close_current_session()
@@ -80,6 +113,7 @@ class SqlAlchemyRepository(AbstractRepository):
         with self._session_cm as scm:
             scm.session.add(movie)
             scm.commit()
+        self._facet_cache = dict()
 
     def get_movie(self, id: int) -> Movie:
         movie = None
@@ -97,13 +131,47 @@ class SqlAlchemyRepository(AbstractRepository):
             return movies
         else:
             # Return movies matching target_date; return an empty list if there are no matches.
-            movies = self._session_cm.session.query(Movie).filter(Movie._date == target_date).all()
+            movies = self._session_cm.session.query(Movie).filter(Movie._date == target_date).options(
+                *movie_loader_options()
+            ).all()
             return movies
 
+    def get_date_page(self, target_date: date = None):
+        # The navigation dates are computed by scalar subqueries in a one-row derived table, which is outer joined to
+        # the movies on the target date. A single statement therefore returns the movies and all four dates, and
+        # still returns the dates when the target date has no movies.
+        movies_table = orm.movies
+        first_date = select([func.min(movies_table.c.date)]).as_scalar()
+        page_date = func.coalesce(bindparam('target_date', target_date, type_=Date), first_date)
+        nav = select([
+            first_date.label('first_date'),
+            page_date.label('page_date'),
+            select([func.max(movies_table.c.date)]).where(movies_table.c.date < page_date).as_scalar().label('previous_date'),
+            select([func.min(movies_table.c.date)]).where(movies_table.c.date > page_date).as_scalar().label('next_date'),
+            select([func.max(movies_table.c.date)]).as_scalar().label('last_date')
+        ]).alias('nav')
+
+        rows = self._session_cm.session.query(
+            nav.c.first_date, nav.c.previous_date, nav.c.next_date, nav.c.last_date, Movie
+        ).select_from(nav).outerjoin(Movie, Movie._date == nav.c.page_date).options(
+            *movie_loader_options()
+        ).order_by(Movie._id).all()
+
+        first, previous_date, next_date, last = rows[0][0:4]
+        movies = [row[4] for row in rows if row[4] is not None]
+        if len(movies) == 0:
+            previous_date = next_date = None
+
+        return movies, first, previous_date, next_date, last
+
     def get_number_of_movies(self):
         number_of_movies = self._session_cm.session.query(Movie).count()
         return number_of_movies
 
+    def get_movie_ids(self) -> List[int]:
+        rows = self._session_cm.session.execute('SELECT id FROM movies ORDER BY id').fetchall()
+        return [row[0] for row in rows]
+
     def get_first_movie(self):
         movie = self._session_cm.session.query(Movie).first()
         return movie
@@ -113,9 +181,50 @@ class SqlAlchemyRepository(AbstractRepository):
         return movie
 
     def get_movies_by_id(self, id_list):
-        movies = self._session_cm.session.query(Movie).filter(Movie._id.in_(id_list)).all()
+        movies = self._session_cm.session.query(Movie).filter(Movie._id.in_(id_list)).options(
+            *movie_loader_options()
+        ).all()
         return movies
 
+    def get_random_movies(self, quantity: int) -> List[Movie]:
+        # Sample ids uniformly from the range of ids in use, then fetch those that exist. MIN and MAX come straight
+        # from the ends of the primary key index, so unlike COUNT(*) they don't visit every row.
+        lowest, highest = self._session_cm.session.execute('SELECT MIN(id), MAX(id) FROM movies').fetchone()
+        if lowest is None or quantity <= 0:
+            return list()
+
+        id_range = range(lowest, highest + 1)
+        chosen = dict()
+        for attempt in range(3):
+            needed = quantity - len(chosen)
+            if needed <= 0:
+                break
+
+            # Over-sample to allow for gaps left by deleted ids; the sample is large enough to hold twice as many
+            # new candidates as are needed, even if it repeats every id already chosen.
+            sample_size = min(len(id_range), 2 * needed + len(chosen))
+            candidate_ids = [id for id in random.sample(id_range, sample_size) if id not in chosen]
+            movies = self._session_cm.session.query(Movie).filter(Movie._id.in_(candidate_ids)).all()
+            movies_by_id = {movie.id: movie for movie in movies}
+            for id in candidate_ids:
+                if id in movies_by_id and len(chosen) < quantity:
+                    chosen[id] = movies_by_id[id]
+
+            if sample_size == len(id_range):
+                # Every id in the range has been tried.
+                return list(chosen.values())
+
+        needed = quantity - len(chosen)
+        if needed > 0:
+            # The ids are too sparse for range sampling to find enough movies; let SQLite pick the rest.
+            movies = self._session_cm.session.query(Movie).filter(~Movie._id.in_(list(chosen))).order_by(
+                func.random()
+            ).limit(needed).all()
+            for movie in movies:
+                chosen[movie.id] = movie
+
+        return list(chosen.values())
+
     def get_movie_ids_for_genre(self, genre_name: str):
         movie_ids = []
 
@@ -137,6 +246,190 @@ class SqlAlchemyRepository(AbstractRepository):
 
         return movie_ids
 
+    def get_movies_sorted_by_rating(self, quantity: int, highest_first: bool = True) -> List[Movie]:
+        # Ordering by id as well lets SQLite walk ix_movies_rating (whose entries end with the rowid) without sorting.
+        order = desc if highest_first else asc
+        movies = self._session_cm.session.query(Movie).order_by(order(Movie._rating), order(Movie._id)).options(
+            *movie_loader_options()
+        ).limit(quantity).all()
+        return movies
+
+    def get_movies_sorted_by_runtime(self, quantity: int, longest_first: bool = False) -> List[Movie]:
+        order = desc if longest_first else asc
+        movies = self._session_cm.session.query(Movie).order_by(order(Movie._time), order(Movie._id)).options(
+            *movie_loader_options()
+        ).limit(quantity).all()
+        return movies
+
+    def get_top_rated_movies_for_genre(self, genre_name: str, quantity: int, decade: int = None) -> List[Movie]:
+        query = self._session_cm.session.query(Movie).join(
+            orm.movie_genres, orm.movie_genres.c.movie_id == Movie._id
+        ).join(
+            orm.genres, orm.genres.c.id == orm.movie_genres.c.genre_id
+        ).filter(orm.genres.c.name == genre_name)
+
+        if decade is not None:
+            # A range on date, rather than a function of it, keeps ix_movies_date usable.
+            query = query.filter(Movie._date >= date(decade, 1, 1), Movie._date < date(decade + 10, 1, 1))
+
+        movies = query.order_by(desc(Movie._rating), desc(Movie._id)).options(
+            *movie_loader_options()
+        ).limit(quantity).all()
+        return movies
+
+    def get_most_reviewed_movies(self, quantity: int, since: date = None) -> List[Movie]:
+        number_of_reviews = func.count().label('number_of_reviews')
+        query = select([orm.reviews.c.movie_id, number_of_reviews])
+        if since is not None:
+            # Answered from ix_reviews_timestamp_movie_id, reading only the reviews written since.
+            query = query.where(orm.reviews.c.timestamp >= datetime.combine(since, datetime.min.time()))
+        query = query.group_by(orm.reviews.c.movie_id).order_by(
+            desc(number_of_reviews), asc(orm.reviews.c.movie_id)
+        ).limit(quantity)
+
+        movie_ids = [row[0] for row in self._session_cm.session.execute(query).fetchall()]
+        movies = {movie.id: movie for movie in self.get_movies_by_id(movie_ids)}
+        return [movies[id] for id in movie_ids if id in movies]
+
+    def get_faceted_movie_ids(self, movie_filter: MovieFilter):
+        # Paging through a listing asks for the same facets again, so results are kept against the data version, and
+        # a write by any process, sync included, moves on to fresh ones.
+        key = (movie_filter, self.get_data_version()[0])
+        cached = self._facet_cache.get(key)
+        if cached is not None:
+            return cached
+
+        movies, movie_genres, genres = orm.movies, orm.movie_genres, orm.genres
+        conditions = movie_filter_conditions(movie_filter)
+
+        # One query returns each matching movie once per genre, and every facet is counted in a single pass over it.
+        query = select([movies.c.id, movies.c.date, movies.c.director, movies.c.rating, genres.c.name]).select_from(
+            movies.outerjoin(movie_genres, movie_genres.c.movie_id == movies.c.id).outerjoin(
+                genres, genres.c.id == movie_genres.c.genre_id
+            )
+        ).order_by(movies.c.id)
+        if len(conditions) > 0:
+            query = query.where(and_(*conditions))
+
+        movie_ids = list()
+        counts = empty_counts()
+        for movie_id, movie_date, director, rating, genre_name in self._session_cm.session.execute(query):
+            if len(movie_ids) == 0 or movie_ids[-1] != movie_id:
+                movie_ids.append(movie_id)
+                movie_genre_names = set()
+                values = (('year', movie_date.year), ('director', director), ('rating', rating_band(rating)))
+                for facet, value in values:
+                    counts[facet][value] = counts[facet].get(value, 0) + 1
+            if genre_name is not None and genre_name not in movie_genre_names:
+                movie_genre_names.add(genre_name)
+                counts['genre'][genre_name] = counts['genre'].get(genre_name, 0) + 1
+
+        # Requests on other threads share the cache, so the oldest entry may already have gone by the time it's evicted.
+        with self._facet_lock:
+            if len(self._facet_cache) >= FACET_CACHE_SIZE:
+                self._facet_cache.pop(next(iter(self._facet_cache), None), None)
+            self._facet_cache[key] = (movie_ids, counts)
+        return movie_ids, counts
+
+    def get_movie_ids_page(self, movie_filter: MovieFilter, limit: int, after_id: int = None,
+                           before_id: int = None) -> MovieIdPage:
+        limit = max(limit, 0)
+        if movie_filter == MovieFilter(genres=movie_filter.genres) and len(set(movie_filter.genres)) == 1:
+            # A genre listing is read from ix_movie_genres_genre_id_movie_id alone.
+            id_column = orm.movie_genres.c.movie_id
+            genre_id = select([orm.genres.c.id]).where(orm.genres.c.name == movie_filter.genres[0]).limit(1)
+            conditions = [orm.movie_genres.c.genre_id == genre_id.as_scalar()]
+        else:
+            id_column = orm.movies.c.id
+            conditions = movie_filter_conditions(movie_filter)
+
+        def select_ids(condition, order, quantity):
+            query = select([id_column]).where(and_(*conditions, condition)).order_by(order(id_column)).limit(quantity)
+            return [row[0] for row in self._session_cm.session.execute(query).fetchall()]
+
+        if before_id is not None:
+            # WHERE movie_id < ? ORDER BY movie_id DESC LIMIT ?, read backwards from before_id.
+            movie_ids = select_ids(id_column < before_id, desc, limit + 1)
+            has_previous = len(movie_ids) > limit
+            movie_ids = movie_ids[:limit][::-1]
+            has_next = len(select_ids(id_column >= before_id, asc, 1)) > 0
+        else:
+            # WHERE movie_id > ? ORDER BY movie_id LIMIT ?, reading one id more than the page to learn if there's a
+            # next page.
+            after = id_column > after_id if after_id is not None else true()
+            movie_ids = select_ids(after, asc, limit + 1)
+            has_next = len(movie_ids) > limit
+            movie_ids = movie_ids[:limit]
+            has_previous = after_id is not None and len(select_ids(id_column <= after_id, desc, 1)) > 0
+
+        total = self._session_cm.session.execute(
+            select([func.count()]).select_from(id_column.table).where(and_(*conditions))
+        ).scalar()
+        return MovieIdPage(movie_ids, has_previous, has_next, total)
+
+    def search_movies(self, query: str, limit: int, offset: int = 0) -> List[Movie]:
+        terms = query_terms(query)
+        if len(terms) == 0 or limit <= 0:
+            return list()
+
+        if not self._search_index_ready:
+            # create_app builds the index at start-up; this covers repositories over databases it hasn't seen.
+            if orm.create_search_index(self._session_cm.session):
+                self._session_cm.commit()
+            self._search_index_ready = True
+
+        # Quote each term so that FTS5 reads it as a plain word rather than query syntax; adjacent terms must all match.
+        # bm25() scores better matches lower, weighting the columns as the memory repository's index does.
+        match = ' '.join('"' + term.replace('"', '""') + '"' for term in terms)
+        weights = ', '.join(str(FIELD_WEIGHTS[column]) for column in orm.SEARCH_INDEX_COLUMNS)
+        rows = self._session_cm.session.execute(
+            f'SELECT rowid FROM movies_fts WHERE movies_fts MATCH :match '
+            f'ORDER BY bm25(movies_fts, {weights}), rowid LIMIT :limit OFFSET :offset',
+            {'match': match, 'limit': limit, 'offset': offset}
+        ).fetchall()
+        movie_ids = [row[0] for row in rows]
+
+        movies_by_id = {movie.id: movie for movie in self.get_movies_by_id(movie_ids)}
+        return [movies_by_id[id] for id in movie_ids if id in movies_by_id]
+
+    def get_completions(self, prefix: str, quantity: int) -> List[Completion]:
+        # The index is brought up to date before each lookup.
+        return self.build_completion_index().complete(prefix, quantity)
+
+    def build_completion_index(self) -> CompletionIndex:
+        # Built from plain rows, without loading Movie objects, and then fed the rows added since (see read_new_rows).
+        with self._index_lock:
+            rows, rebuild, self._completion_position = self.read_new_rows(
+                orm.movies, self._completion_position,
+                'SELECT id, title, actors, director, votes FROM movies WHERE id > :after_id AND id <= :last_id'
+            )
+            if rebuild:
+                self._completion_index = CompletionIndex()
+            if len(rows) > 0:
+                self._completion_index.add_movies(tuple(row) for row in rows)
+            return self._completion_index
+
+    def read_new_rows(self, table, position, statement: str):
+        # The indexes built from a table record the position they've read up to: the database's user_version and the
+        # table's largest id. SQLite commits one write at a time, so rows are added in id order, and the rows added
+        # since, by any process, are those with larger ids. sync increments user_version when it changes rows in
+        # place, after which the table is read again from the start.
+        #
+        # Returns the rows of statement between the position and the table's current end, whether to start a new
+        # index, and the new position.
+        row = self._session_cm.session.execute(select([
+            literal_column('(SELECT user_version FROM pragma_user_version)'),
+            select([func.max(table.c.id)]).as_scalar()
+        ])).fetchone()
+        user_version, last_id = row[0], row[1] or 0
+
+        rebuild = position is None or position[0] != user_version
+        after_id = 0 if rebuild else position[1]
+        rows = list()
+        if last_id > after_id:
+            rows = self._session_cm.session.execute(statement, {'after_id': after_id, 'last_id': last_id}).fetchall()
+        return rows, rebuild, (user_version, last_id)
+
     def get_date_of_previous_movie(self, movie: Movie):
         result = None
         prev = self._session_cm.session.query(Movie).filter(Movie._date < movie.date).order_by(desc(Movie._date)).first()
@@ -159,10 +452,43 @@ class SqlAlchemyRepository(AbstractRepository):
         genres = self._session_cm.session.query(Genre).all()
         return genres
 
+    def get_genre_names(self) -> List[str]:
+        rows = self._session_cm.session.execute('SELECT name FROM genres ORDER BY id').fetchall()
+        return [row[0] for row in rows]
+
+    def get_genres_version(self) -> int:
+        # Genres are added with increasing ids, by any process, and sync increments user_version when it changes
+        # movies' genres.
+        row = self._session_cm.session.execute(select([
+            select([func.max(orm.genres.c.id)]).as_scalar(),
+            literal_column('(SELECT user_version FROM pragma_user_version)')
+        ])).fetchone()
+        return (row[0] or 0) + row[1]
+
+    def get_movies_version(self) -> int:
+        # Only sync changes movies in place, and it increments user_version when it does.
+        return self._session_cm.session.execute('SELECT user_version FROM pragma_user_version').scalar()
+
+    def get_data_version(self):
+        # Rows are added with increasing ids, so the sum of the largest ids increases with every Movie, Genre,
+        # association and Review added by any process. Each maximum is read from the end of a primary key. sync also
+        # updates rows in place, and increments the database's user_version when it does, so that's added in too.
+        tables = (orm.movies, orm.genres, orm.movie_genres, orm.reviews)
+        row = self._session_cm.session.execute(select(
+            [select([func.max(table.c.id)]).as_scalar() for table in tables] +
+            [literal_column('(SELECT user_version FROM pragma_user_version)')]
+        )).fetchone()
+        version = sum(value or 0 for value in row)
+
+        if version != self._data_version[0]:
+            self._data_version = (version, datetime.utcnow().replace(microsecond=0))
+        return self._data_version
+
     def add_genre(self, genre: Genre):
         with self._session_cm as scm:
             scm.session.add(genre)
             scm.commit()
+        self._facet_cache = dict()
 
     def get_reviews(self) -> List[Review]:
         reviews = self._session_cm.session.query(Review).all()
@@ -174,131 +500,476 @@ class SqlAlchemyRepository(AbstractRepository):
             scm.session.add(review)
             scm.commit()
 
-def movie_record_generator(filename: str):
-    with open(filename, mode='r', encoding='utf-8-sig') as infile:
-        reader = csv.reader(infile)
-
-        # Read first line of the CSV file.
-        headers = next(reader)
-
-        # Read remaining rows from the CSV file.
-        for row in reader:
-
-            movie_data = row
-            movie_key = movie_data[0]
-            #
-            # # Strip any leading/trailing white space from data read.
-            # movie_data = [item.strip() for item in movie_data]
-            #
-            # number_of_genres = len(movie_data) - 6
-            movie_genres = movie_data[2].split(',')
-
-            # Add any new genres; associate the current movie with genres.
-            for genre in movie_genres:
-                if genre not in genres.keys():
-                    genres[genre] = list()
-                genres[genre].append(movie_key)
-
-            # del movie_data[-number_of_genres:]
-
-
-            movie_date = date.fromisoformat(movie_data[6]+"-01-01")
-
-            title = movie_data[1],
-            first_para = movie_data[3],
-            hyperlink = "",
-
-            rank = movie_data[0],
-            director = movie_data[4],
-            time = movie_data[7],
-            rating = movie_data[8],
-            actors = movie_data[5],
-            id = movie_data[0],
-            image_hyperlink = "https://image.tmdb.org/t/p/w780" + movie_data[14]
-
-            yield [movie_key, movie_date, title[0], first_para[0], hyperlink[0], rank[0], director[0], time[0], rating[0], actors[0], image_hyperlink]
-
-
-
-def get_genre_records():
-    genre_records = list()
-    genre_key = 0
-
-    for genre in genres.keys():
-        genre_key = genre_key + 1
-        genre_records.append((genre_key, genre))
-    return genre_records
-
-
-def movie_genres_generator():
-    movie_genres_key = 0
-    genre_key = 0
-
-    for genre in genres.keys():
-        genre_key = genre_key + 1
-        for movie_key in genres[genre]:
-            movie_genres_key = movie_genres_key + 1
-            yield movie_genres_key, movie_key, genre_key
-
-
-def generic_generator(filename, post_process=None):
-    with open(filename) as infile:
-        reader = csv.reader(infile)
-
-        # Read first line of the CSV file.
-        next(reader)
-
-        # Read remaining rows from the CSV file.
-        for row in reader:
-            # Strip any leading/trailing white space from data read.
-            row = [item.strip() for item in row]
-
-            if post_process is not None:
-                row = post_process(row)
-            yield row
-
-
-def process_user(user_row):
-    user_row[2] = generate_password_hash(user_row[2])
-    return user_row
-
-
-def populate(engine: Engine, data_path: str):
+    def get_co_reviewed_movies(self, movie_id: int, quantity: int) -> List[Movie]:
+        # Built from the reviews table, in the order the reviews were written, and brought up to date before each
+        # lookup (see read_new_rows).
+        with self._index_lock:
+            rows, rebuild, self._co_review_position = self.read_new_rows(
+                orm.reviews, self._co_review_position,
+                'SELECT users.username, reviews.movie_id FROM reviews JOIN users ON users.id = reviews.user_id '
+                'WHERE reviews.id > :after_id AND reviews.id <= :last_id ORDER BY reviews.id'
+            )
+            if rebuild:
+                self._co_review_index = CoReviewIndex()
+            for username, reviewed_movie_id in rows:
+                self._co_review_index.add_review(username, reviewed_movie_id)
+            co_review_index = self._co_review_index
+
+        movie_ids = co_review_index.get_co_reviewed_movie_ids(movie_id, quantity)
+        movies = {movie.id: movie for movie in self.get_movies_by_id(movie_ids)}
+        return [movies[id] for id in movie_ids if id in movies]
+
+def create_database_engine(config) -> Engine:
+    # config is the Flask app config (or any mapping with the same SQLALCHEMY_* and SQLITE_PRAGMAS keys).
+    database_uri = config['SQLALCHEMY_DATABASE_URI']
+    engine_args = {
+        'connect_args': {'check_same_thread': False},
+        'echo': config.get('SQLALCHEMY_ECHO', False)
+    }
+
+    url = make_url(database_uri)
+    if url.database not in (None, '', ':memory:'):
+        # Reuse connections across requests. An in-memory database keeps SQLAlchemy's default pool, because every new
+        # connection to it would be a separate, empty database.
+        engine_args['poolclass'] = QueuePool
+        engine_args['pool_size'] = config.get('SQLALCHEMY_POOL_SIZE', 5)
+        engine_args['max_overflow'] = config.get('SQLALCHEMY_MAX_OVERFLOW', 10)
+        engine_args['pool_recycle'] = config.get('SQLALCHEMY_POOL_RECYCLE', -1)
+
+    engine = create_engine(database_uri, **engine_args)
+
+    pragmas = config.get('SQLITE_PRAGMAS')
+    if url.get_backend_name() == 'sqlite' and pragmas:
+        set_sqlite_pragmas(engine, pragmas)
+
+    return engine
+
+
+def set_sqlite_pragmas(engine: Engine, pragmas):
+    # Apply the PRAGMAs once per DBAPI connection, as the pool creates it.
+    def on_connect(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for name, value in pragmas.items():
+            cursor.execute(f'PRAGMA {name} = {value}')
+        cursor.close()
+
+    event.listen(engine, 'connect', on_connect)
+
+
+def movie_loader_options():
+    # Eagerly load everything that news.services.movie_to_dict touches: reviews with their users, and genres with the
+    # ids of their movies. Serialising a list of movies then costs a fixed number of queries instead of lazy loads per
+    # movie, review and genre. The options are built on demand because the mapped attributes only exist once
+    # orm.map_model_to_tables has run.
+    return (
+        selectinload(Movie._reviews).joinedload(Review._user),
+        selectinload(Movie._genres).selectinload(Genre._genreged_movies).load_only('_id')
+    )
+
+
+def movie_filter_conditions(movie_filter: MovieFilter) -> list:
+    # Returns the conditions on the movies table selecting the movies that match movie_filter.
+    movies, movie_genres, genres = orm.movies, orm.movie_genres, orm.genres
+
+    conditions = list()
+    genre_names = set(movie_filter.genres)
+    if len(genre_names) > 0:
+        # Movies associated with all of the genres have a movie_genres row for each of them.
+        conditions.append(movies.c.id.in_(
+            select([movie_genres.c.movie_id]).select_from(
+                movie_genres.join(genres, genres.c.id == movie_genres.c.genre_id)
+            ).where(genres.c.name.in_(genre_names)).group_by(
+                movie_genres.c.movie_id
+            ).having(func.count(genres.c.name.distinct()) == len(genre_names))
+        ))
+    if movie_filter.first_year is not None:
+        conditions.append(movies.c.date >= date(movie_filter.first_year, 1, 1))
+    if movie_filter.last_year is not None:
+        conditions.append(movies.c.date < date(movie_filter.last_year + 1, 1, 1))
+    if movie_filter.director is not None:
+        conditions.append(movies.c.director == movie_filter.director)
+    if movie_filter.rating is not None:
+        conditions.append(movies.c.rating >= movie_filter.rating)
+        conditions.append(movies.c.rating < movie_filter.rating + 1)
+    return conditions
+
+
+# The movies table's columns, in the order movie_row gives their values.
+MOVIE_COLUMNS = (
+    'id', 'date', 'title', 'first_para', 'hyperlink', 'rank', 'director', 'time', 'rating', 'actors', 'image_hyperlink',
+    'votes', 'revenue', 'metascore'
+)
+
+# Numbers of rows sync inserted, updated, left as they were, and skipped because they'd clash with rows written
+# through the site: a seed user taking a username already registered there, and that user's reviews.
+SyncCounts = namedtuple('SyncCounts', ['inserted', 'updated', 'unchanged', 'skipped'], defaults=[0])
+
+
+def movie_row(record: MovieRecord):
+    return [
+        record.id, record.date, record.title, record.first_para, "", record.rank, record.director, record.time,
+        record.rating, record.actors, record.image_hyperlink, record.votes, record.revenue, record.metascore
+    ]
+
+
+def user_records(filename: str, credentials_cache_path: str = None):
+    # Hash the passwords a batch at a time, so those not already hashed or cached can be hashed in parallel without
+    # holding every user in memory.
+    records = read_records(filename, parse_user)
+    batches = iter(lambda: list(islice(records, INSERT_BATCH_SIZE)), [])
+    for batch, password_hashes in hash_password_batches(
+            batches, lambda record: (record.username, record.password), credentials_cache_path):
+        for record, password_hash in zip(batch, password_hashes):
+            yield record.id, record.id, record.username, password_hash
+
+
+def populate(engine: Engine, data_path: str, credentials_cache_path: str = None) -> int:
+    # Inserts the data files' rows into the existing tables, and returns the number of rows inserted.
     conn = engine.raw_connection()
     cursor = conn.cursor()
-
-    global genres
-    genres = dict()
+    number_of_rows = insert_data(cursor, data_path, credentials_cache_path)
+    conn.commit()
+    conn.close()
+    return number_of_rows
+
+
+def bulk_populate(engine: Engine, data_path: str, credentials_cache_path: str = None) -> int:
+    # Rebuilds the tables from the data files as quickly as SQLite allows, and returns the number of rows inserted.
+    # The tables are recreated without indexes and the full-text index is dropped, so the rows are loaded without
+    # maintaining either. Dropping, recreating and loading the tables is one transaction, so a load that fails, or is
+    # interrupted, leaves the database as it was: an empty database stays empty, and is loaded again on the next
+    # start. The indexes are then built in one pass each, and ANALYZE gives the query planner statistics on them; a
+    # start that finds an index missing builds it (see create_missing_indexes). Mappers needn't be cleared, as only
+    # tables are dropped.
+    conn = engine.raw_connection()
+    cursor = conn.cursor()
+    settings = {pragma: cursor.execute(f'PRAGMA {pragma}').fetchone()[0] for pragma in BULK_LOAD_PRAGMAS}
+    for pragma, value in BULK_LOAD_PRAGMAS.items():
+        cursor.execute(f'PRAGMA {pragma} = {value}')
+    try:
+        cursor.execute('BEGIN')
+        orm.drop_search_index(cursor)
+        for table in reversed(orm.metadata.sorted_tables):
+            cursor.execute(f'DROP TABLE IF EXISTS {table.name}')
+        orm.create_tables_without_indexes(cursor)
+        number_of_rows = insert_data(cursor, data_path, credentials_cache_path)
+        conn.commit()
+    finally:
+        # Rolls back a failed load; a no-op after the commit.
+        conn.rollback()
+        for pragma, value in settings.items():
+            cursor.execute(f'PRAGMA {pragma} = {value}')
+        conn.close()
+
+    orm.create_missing_indexes(engine)
+    orm.create_search_index(engine)
+    engine.execute('ANALYZE')
+    return number_of_rows
+
+
+def insert_data(cursor, data_path: str, credentials_cache_path: str = None) -> int:
+    number_of_rows = 0
 
     insert_movies = """
         INSERT INTO movies (
-        id, date, title, first_para, hyperlink, rank, director, time, rating, actors, image_hyperlink)
-        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ? )"""
-    cursor.executemany(insert_movies, movie_record_generator(os.path.join(data_path, 'Data1000Movies.csv')))
+        id, date, title, first_para, hyperlink, rank, director, time, rating, actors, image_hyperlink, votes, revenue, metascore)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ? )"""
 
     insert_genres = """
         INSERT INTO genres (
         id, name)
         VALUES (?, ?)"""
-    cursor.executemany(insert_genres, get_genre_records())
 
     insert_movie_genres = """
         INSERT INTO movie_genres (
         id, movie_id, genre_id)
         VALUES (?, ?, ?)"""
-    cursor.executemany(insert_movie_genres, movie_genres_generator())
+
+    # Insert the movies a batch at a time, each followed by any genres new to it and its genre associations, so only
+    # a batch of movies is held at once. Genres are numbered in the order they first appear.
+    genre_ids = dict()
+    movie_genres_key = 0
+    movie_records = read_records(os.path.join(data_path, 'Data1000Movies.csv'), parse_movie)
+    for batch in iter(lambda: list(islice(movie_records, INSERT_BATCH_SIZE)), []):
+        new_genres = list()
+        movie_genres = list()
+        for record in batch:
+            for genre in record.genres:
+                genre_id = genre_ids.get(genre)
+                if genre_id is None:
+                    genre_id = genre_ids[genre] = len(genre_ids) + 1
+                    new_genres.append((genre_id, genre))
+                movie_genres_key = movie_genres_key + 1
+                movie_genres.append((movie_genres_key, record.id, genre_id))
+
+        cursor.executemany(insert_movies, map(movie_row, batch))
+        cursor.executemany(insert_genres, new_genres)
+        cursor.executemany(insert_movie_genres, movie_genres)
+        number_of_rows += len(batch) + len(new_genres) + len(movie_genres)
 
     insert_users = """
         INSERT INTO users (
-        id, username, password)
-        VALUES (?, ?, ?)"""
-    cursor.executemany(insert_users, generic_generator(os.path.join(data_path, 'users.csv'), process_user))
+        id, seed_id, username, password)
+        VALUES (?, ?, ?, ?)"""
+    cursor.executemany(insert_users, user_records(os.path.join(data_path, 'users.csv'), credentials_cache_path))
+    number_of_rows += cursor.rowcount
 
     insert_reviews = """
         INSERT INTO reviews (
-        id, user_id, movie_id, review, timestamp)
-        VALUES (?, ?, ?, ?, ?)"""
-    cursor.executemany(insert_reviews, generic_generator(os.path.join(data_path, 'comments.csv')))
+        id, seed_id, user_id, movie_id, review, timestamp)
+        VALUES (?, ?, ?, ?, ?, ?)"""
+    reviews = read_records(os.path.join(data_path, 'comments.csv'), parse_review)
+    cursor.executemany(insert_reviews, ((record.id, *record[:4], str(record.timestamp)) for record in reviews))
+    number_of_rows += cursor.rowcount
+
+    return number_of_rows
+
+
+def sync(engine: Engine, data_path: str, credentials_cache_path: str = None) -> Dict[str, SyncCounts]:
+    # Brings the tables up to date with the data files without repopulating them, and returns the number of rows of
+    # movies, users and reviews (see SyncCounts). Movies are matched by id, and users and reviews by seed_id, and rows
+    # are compared by content_hash; only new or changed rows are written, and a movie's genre associations are
+    # replaced when its genres change. Rows no longer in the data files are kept, as reviews written through the site
+    # refer to them.
+    #
+    # Each batch of rows is written in its own short transaction, so the site keeps serving, and writing, throughout.
+    # A batch that changes anything also increments the database's user_version, which get_data_version adds in, so
+    # pages built from rows that were updated in place are rebuilt too.
+    conn = engine.raw_connection()
+    try:
+        return {
+            'movies': sync_movies(conn, os.path.join(data_path, 'Data1000Movies.csv')),
+            'users': sync_users(conn, os.path.join(data_path, 'users.csv'), credentials_cache_path),
+            'reviews': sync_reviews(conn, os.path.join(data_path, 'comments.csv'))
+        }
+    finally:
+        conn.close()
+
+
+def content_hash(values) -> str:
+    # Hashes a row's values by their text, so values read back from SQLite hash the same as those written to it.
+    text = '\x1f'.join('\x00' if value is None else str(value) for value in values)
+    return hashlib.sha1(text.encode('utf-8')).hexdigest()
+
 
+def sync_movies(conn, filename: str) -> SyncCounts:
+    cursor = conn.cursor()
+    counts = SyncCounts(0, 0, 0)
+    insert_movies = f"""
+        INSERT INTO movies ({', '.join(MOVIE_COLUMNS)})
+        VALUES ({', '.join('?' for column in MOVIE_COLUMNS)})"""
+    update_movies = f"""
+        UPDATE movies SET {', '.join(column + ' = ?' for column in MOVIE_COLUMNS[1:])}
+        WHERE id = ?"""
+
+    records = read_records(filename, parse_movie)
+    for batch in iter(lambda: list(islice(records, INSERT_BATCH_SIZE)), []):
+        cursor.execute('BEGIN IMMEDIATE')
+        ids = json.dumps([record.id for record in batch])
+        stored_hashes = {
+            row[0]: content_hash(row) for row in cursor.execute(
+                f'SELECT {", ".join(MOVIE_COLUMNS)} FROM movies WHERE id IN (SELECT value FROM json_each(?))', (ids,)
+            )
+        }
+        stored_genres = dict()
+        for movie_id, genre_name in cursor.execute(
+                'SELECT movie_genres.movie_id, genres.name FROM movie_genres '
+                'JOIN genres ON genres.id = movie_genres.genre_id '
+                'WHERE movie_genres.movie_id IN (SELECT value FROM json_each(?)) ORDER BY movie_genres.id', (ids,)):
+            stored_genres.setdefault(movie_id, list()).append(genre_name)
+
+        new_rows = list()
+        changed_rows = list()
+        reassociated_records = list()
+        for record in batch:
+            row = movie_row(record)
+            stored_hash = stored_hashes.get(record.id)
+            if stored_hash is None:
+                new_rows.append(row)
+                reassociated_records.append(record)
+                continue
+            if stored_hash != content_hash(row):
+                changed_rows.append(row[1:] + [record.id])
+            if tuple(stored_genres.get(record.id, ())) != record.genres:
+                reassociated_records.append(record)
+
+        cursor.executemany(insert_movies, new_rows)
+        cursor.executemany(update_movies, changed_rows)
+        replace_movie_genres(cursor, reassociated_records)
+        commit_sync_batch(conn, len(reassociated_records) + len(changed_rows) > 0)
+
+        # A movie whose row and genres both changed counts once.
+        number_updated = len({row[-1] for row in changed_rows} | {record.id for record in reassociated_records}) - \
+            len(new_rows)
+        counts = SyncCounts(
+            counts.inserted + len(new_rows), counts.updated + number_updated,
+            counts.unchanged + len(batch) - len(new_rows) - number_updated
+        )
+    return counts
+
+
+def replace_movie_genres(cursor, records: List[MovieRecord]):
+    # Replaces the movies' genre associations with those of their records, adding any new genres. The new
+    # associations take ids after the largest, so get_data_version sees the change.
+    if len(records) == 0:
+        return
+    cursor.execute(
+        'DELETE FROM movie_genres WHERE movie_id IN (SELECT value FROM json_each(?))',
+        (json.dumps([record.id for record in records]),)
+    )
+    genre_ids = dict(cursor.execute('SELECT name, id FROM genres'))
+    next_genre_id = cursor.execute('SELECT COALESCE(MAX(id), 0) + 1 FROM genres').fetchone()[0]
+    next_movie_genres_key = cursor.execute('SELECT COALESCE(MAX(id), 0) + 1 FROM movie_genres').fetchone()[0]
+
+    new_genres = list()
+    movie_genres = list()
+    for record in records:
+        for genre in record.genres:
+            genre_id = genre_ids.get(genre)
+            if genre_id is None:
+                genre_id = genre_ids[genre] = next_genre_id
+                next_genre_id = next_genre_id + 1
+                new_genres.append((genre_id, genre))
+            movie_genres.append((next_movie_genres_key, record.id, genre_id))
+            next_movie_genres_key = next_movie_genres_key + 1
+    cursor.executemany('INSERT INTO genres (id, name) VALUES (?, ?)', new_genres)
+    cursor.executemany('INSERT INTO movie_genres (id, movie_id, genre_id) VALUES (?, ?, ?)', movie_genres)
+
+
+def sync_users(conn, filename: str, credentials_cache_path: str = None) -> SyncCounts:
+    # Seed users are matched by seed_id, so a user who registered through the site is never changed. A database loaded
+    # before seed ids were recorded has none; a user there with the record's id, username and password is taken to be
+    # its seed user, as matching the password too means nobody gains access they didn't already have.
+    cursor = conn.cursor()
+    counts = SyncCounts(0, 0, 0)
+    cache = read_cache(credentials_cache_path) if credentials_cache_path is not None else dict()
+
+    records = read_records(filename, parse_user)
+    for batch in iter(lambda: list(islice(records, INSERT_BATCH_SIZE)), []):
+        # Passwords are compared and hashed before the transaction starts, as that's slow.
+        ids = json.dumps([record.id for record in batch])
+        stored_users = {
+            row[0]: row[1:] for row in cursor.execute(
+                'SELECT seed_id, username, password FROM users WHERE seed_id IN (SELECT value FROM json_each(?))',
+                (ids,)
+            )
+        }
+        unseeded_users = {
+            row[0]: row[1:] for row in cursor.execute(
+                'SELECT id, username, password FROM users '
+                'WHERE seed_id IS NULL AND id IN (SELECT value FROM json_each(?))', (ids,)
+            )
+        }
+        new_records = list()
+        changed_records = list()
+        seeded_rows = list()
+        for record in batch:
+            stored_user = stored_users.get(record.id)
+            unseeded_user = unseeded_users.get(record.id)
+            if stored_user is None and unseeded_user is not None and unseeded_user[0] == record.username and \
+                    password_is_current(record.username, record.password, unseeded_user[1], cache):
+                seeded_rows.append((record.id, record.id))
+            elif stored_user is None:
+                new_records.append(record)
+            elif stored_user[0] != record.username or \
+                    not password_is_current(record.username, record.password, stored_user[1], cache):
+                changed_records.append(record)
+        password_hashes = hash_passwords(
+            [(record.username, record.password) for record in new_records + changed_records], credentials_cache_path
+        )
+        new_rows = [
+            (record.id, record.username, password_hash)
+            for record, password_hash in zip(new_records, password_hashes)
+        ]
+        changed_rows = [
+            (record.username, password_hash, record.id)
+            for record, password_hash in zip(changed_records, password_hashes[len(new_records):])
+        ]
+
+        # A username already taken through the site isn't given to a seed user.
+        cursor.execute('BEGIN IMMEDIATE')
+        cursor.executemany('UPDATE users SET seed_id = ? WHERE id = ? AND seed_id IS NULL', seeded_rows)
+        cursor.executemany('INSERT OR IGNORE INTO users (seed_id, username, password) VALUES (?, ?, ?)', new_rows)
+        number_inserted = max(cursor.rowcount, 0)
+        cursor.executemany('UPDATE OR IGNORE users SET username = ?, password = ? WHERE seed_id = ?', changed_rows)
+        number_updated = max(cursor.rowcount, 0)
+        commit_sync_batch(conn, number_inserted + number_updated > 0)
+        counts = SyncCounts(
+            counts.inserted + number_inserted, counts.updated + number_updated,
+            counts.unchanged + len(batch) - len(new_rows) - len(changed_rows),
+            counts.skipped + len(new_rows) + len(changed_rows) - number_inserted - number_updated
+        )
+    return counts
+
+
+def sync_reviews(conn, filename: str) -> SyncCounts:
+    # Seed reviews are matched by seed_id, and name their users by seed id too; a review whose user isn't there,
+    # having been skipped, is skipped as well. As with users, a review in a database loaded before seed ids were
+    # recorded is taken to be the seed review if it has the record's id and content.
+    cursor = conn.cursor()
+    counts = SyncCounts(0, 0, 0)
+
+    def review_hash(row):
+        # Reviews written through the site have timestamps with microseconds, so compare them as datetimes.
+        return content_hash(row[:3] + (datetime.fromisoformat(str(row[3])),))
+
+    records = read_records(filename, parse_review)
+    for batch in iter(lambda: list(islice(records, INSERT_BATCH_SIZE)), []):
+        ids = json.dumps([record.id for record in batch])
+        cursor.execute('BEGIN IMMEDIATE')
+        user_ids = dict(cursor.execute(
+            'SELECT seed_id, id FROM users WHERE seed_id IN (SELECT value FROM json_each(?))',
+            (json.dumps(sorted({record.user_id for record in batch})),)
+        ))
+        stored_hashes = {
+            row[0]: review_hash(row[1:]) for row in cursor.execute(
+                'SELECT seed_id, user_id, movie_id, review, timestamp FROM reviews '
+                'WHERE seed_id IN (SELECT value FROM json_each(?))', (ids,)
+            )
+        }
+        unseeded_hashes = {
+            row[0]: review_hash(row[1:]) for row in cursor.execute(
+                'SELECT id, user_id, movie_id, review, timestamp FROM reviews '
+                'WHERE seed_id IS NULL AND id IN (SELECT value FROM json_each(?))', (ids,)
+            )
+        }
+        new_rows = list()
+        changed_rows = list()
+        seeded_rows = list()
+        number_skipped = 0
+        for record in batch:
+            user_id = user_ids.get(record.user_id)
+            if user_id is None:
+                number_skipped += 1
+                continue
+            row = (user_id, record.movie_id, record.review, record.timestamp)
+            stored_hash = stored_hashes.get(record.id)
+            if stored_hash is None and unseeded_hashes.get(record.id) == review_hash(row):
+                seeded_rows.append((record.id, record.id))
+            elif stored_hash is None:
+                new_rows.append((record.id, *row[:3], str(record.timestamp)))
+            elif stored_hash != review_hash(row):
+                changed_rows.append((*row[:3], str(record.timestamp), record.id))
+
+        cursor.executemany('UPDATE reviews SET seed_id = ? WHERE id = ? AND seed_id IS NULL', seeded_rows)
+        cursor.executemany(
+            'INSERT INTO reviews (seed_id, user_id, movie_id, review, timestamp) VALUES (?, ?, ?, ?, ?)', new_rows
+        )
+        cursor.executemany(
+            'UPDATE reviews SET user_id = ?, movie_id = ?, review = ?, timestamp = ? WHERE seed_id = ?', changed_rows
+        )
+        commit_sync_batch(conn, len(new_rows) + len(changed_rows) > 0)
+        counts = SyncCounts(
+            counts.inserted + len(new_rows), counts.updated + len(changed_rows),
+            counts.unchanged + len(batch) - len(new_rows) - len(changed_rows) - number_skipped,
+            counts.skipped + number_skipped
+        )
+    return counts
+
+
+def commit_sync_batch(conn, changed: bool):
+    if changed:
+        cursor = conn.cursor()
+        version = cursor.execute('PRAGMA user_version').fetchone()[0]
+        cursor.execute(f'PRAGMA user_version = {version + 1}')
     conn.commit()
-    conn.close()
\ No newline at end of file
@@ -0,0 +1,154 @@
+import math
+import threading
+from collections import namedtuple
+from typing import Dict, Iterable, List, Tuple
+
+import numpy as np
+
+
+# A combination of facet values to browse by. A movie matches if it's associated with every one of genres, was
+# released between first_year and last_year inclusive, was directed by director and has a rating in the band
+# starting at rating (e.g. 7 for ratings from 7.0 up to 8.0). Facets left as None aren't filtered on.
+MovieFilter = namedtuple(
+    'MovieFilter', ['genres', 'first_year', 'last_year', 'director', 'rating'],
+    defaults=[(), None, None, None, None]
+)
+
+FACETS = ('genre', 'year', 'director', 'rating')
+
+
+def rating_band(rating) -> int:
+    return int(math.floor(rating))
+
+
+def empty_counts() -> Dict[str, dict]:
+    return {facet: dict() for facet in FACETS}
+
+
+class FacetIndex:
+    # Each movie is a row. Genres are bitsets: one boolean array per genre, with a row's element set if the movie is
+    # associated with the genre. Years and rating bands are arrays of each row's value, and directors an array of
+    # codes into the list of directors. A query ANDs together the bitsets of its genres and the comparisons of the
+    # other facets to get the matching rows, and then counts every value of every facet among them, one vectorised
+    # pass per facet.
+    #
+    # Movies and genre associations are recorded in lists as they're added, and the arrays rebuilt from them on the
+    # next query, so a run of additions costs one rebuild.
+
+    def __init__(self):
+        self._movie_ids = list()
+        self._row_of = dict()
+        self._years = list()
+        self._ratings = list()
+        self._director_codes = list()
+        self._directors = list()
+        self._code_of_director = dict()
+        self._genre_members = dict()
+        self._arrays = None
+        self._lock = threading.Lock()
+
+    def add_movie(self, movie_id: int, year: int, director: str, rating: float):
+        with self._lock:
+            self._add_movie(movie_id, year, director, rating)
+
+    def add_movies(self, movies: Iterable[tuple]):
+        # Bulk version of add_movie for (movie_id, year, director, rating) tuples, taking the lock once.
+        with self._lock:
+            for movie in movies:
+                self._add_movie(*movie)
+
+    def _add_movie(self, movie_id: int, year: int, director: str, rating: float):
+        code = self._code_of_director.get(director)
+        if code is None:
+            code = self._code_of_director[director] = len(self._directors)
+            self._directors.append(director)
+        band = rating_band(rating) if rating is not None else -1
+
+        row = self._row_of.get(movie_id)
+        if row is None:
+            self._row_of[movie_id] = len(self._movie_ids)
+            self._movie_ids.append(movie_id)
+            self._years.append(year)
+            self._ratings.append(band)
+            self._director_codes.append(code)
+        else:
+            self._years[row] = year
+            self._ratings[row] = band
+            self._director_codes[row] = code
+        self._arrays = None
+
+    def add_genre_movie(self, genre_name: str, movie_id: int):
+        # The movie needn't have been added yet; associations are matched to rows when the arrays are built.
+        with self._lock:
+            self._genre_members.setdefault(genre_name, set()).add(movie_id)
+            self._arrays = None
+
+    def add_genre_movies(self, genre_name: str, movie_ids: Iterable[int]):
+        with self._lock:
+            self._genre_members.setdefault(genre_name, set()).update(movie_ids)
+            self._arrays = None
+
+    def query(self, movie_filter: MovieFilter) -> Tuple[List[int], Dict[str, dict]]:
+        # Returns the ids of the matching movies in ascending order, and for each facet, the number of matching
+        # movies having each of its values. Values no matching movie has are left out.
+        arrays, matches = self._match(movie_filter)
+        movie_ids, years, ratings, director_codes, genre_names, genre_bitsets = arrays
+
+        counts = empty_counts()
+        genre_counts = np.count_nonzero(genre_bitsets[:, matches], axis=1) if len(genre_names) > 0 else []
+        counts['genre'] = {name: int(count) for name, count in zip(genre_names, genre_counts) if count > 0}
+        for facet, values in (('year', years), ('rating', ratings)):
+            present, value_counts = np.unique(values[matches], return_counts=True)
+            counts[facet] = {int(value): int(count) for value, count in zip(present, value_counts) if value >= 0}
+        director_counts = np.bincount(director_codes[matches], minlength=len(self._directors))
+        counts['director'] = {
+            self._directors[code]: int(director_counts[code]) for code in np.flatnonzero(director_counts)
+        }
+
+        return np.sort(movie_ids[matches]).tolist(), counts
+
+    def matching_ids(self, movie_filter: MovieFilter) -> np.ndarray:
+        # Returns the ids of the matching movies as a sorted array, without counting facets.
+        arrays, matches = self._match(movie_filter)
+        return np.sort(arrays[0][matches])
+
+    def _match(self, movie_filter: MovieFilter):
+        # Returns the arrays, and a boolean array selecting the rows matching movie_filter.
+        arrays = self._current_arrays()
+        movie_ids, years, ratings, director_codes, genre_names, genre_bitsets = arrays
+
+        matches = np.ones(len(movie_ids), dtype=bool)
+        for genre_name in movie_filter.genres:
+            if genre_name in genre_names:
+                matches &= genre_bitsets[genre_names.index(genre_name)]
+            else:
+                matches[:] = False
+        if movie_filter.first_year is not None:
+            matches &= years >= movie_filter.first_year
+        if movie_filter.last_year is not None:
+            matches &= years <= movie_filter.last_year
+        if movie_filter.director is not None:
+            code = self._code_of_director.get(movie_filter.director, -1)
+            matches &= director_codes == code
+        if movie_filter.rating is not None:
+            matches &= ratings == movie_filter.rating
+        return arrays, matches
+
+    def _current_arrays(self):
+        with self._lock:
+            if self._arrays is None:
+                number_of_rows = len(self._movie_ids)
+                genre_names = sorted(self._genre_members)
+                genre_bitsets = np.zeros((len(genre_names), number_of_rows), dtype=bool)
+                for position, genre_name in enumerate(genre_names):
+                    rows = [self._row_of[id] for id in self._genre_members[genre_name] if id in self._row_of]
+                    genre_bitsets[position, rows] = True
+                self._arrays = (
+                    np.array(self._movie_ids, dtype=np.int64),
+                    np.array(self._years, dtype=np.int64),
+                    np.array(self._ratings, dtype=np.int64),
+                    np.array(self._director_codes, dtype=np.int64),
+                    genre_names,
+                    genre_bitsets
+                )
+            return self._arrays
@@ -0,0 +1,130 @@
+import csv
+import io
+import os
+from collections import deque, namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from datetime import date, datetime
+from typing import Callable, Iterator, List, Tuple
+
+
+# Reads the data files into typed records. A file is split into chunks of about CHUNK_BYTES at row boundaries, which
+# are parsed in a pool of processes when there's more than one chunk, and yielded in file order. At most
+# CHUNKS_IN_FLIGHT chunks per process are read ahead, so the memory used doesn't grow with the size of the file.
+#
+# A row ends at a newline outside quotes. CSV doubles a quote within a quoted field, so a newline is outside quotes
+# just when an even number of quotes comes before it; finding row boundaries only counts quotes, which is far quicker
+# than parsing the rows.
+
+CHUNK_BYTES = 1 << 22
+CHUNKS_IN_FLIGHT = 2
+
+IMAGE_URL = "https://image.tmdb.org/t/p/w780"
+
+MovieRecord = namedtuple('MovieRecord', [
+    'id', 'date', 'title', 'first_para', 'genres', 'director', 'actors', 'rank', 'time', 'rating', 'votes',
+    'revenue', 'metascore', 'image_hyperlink'
+])
+UserRecord = namedtuple('UserRecord', ['id', 'username', 'password'])
+ReviewRecord = namedtuple('ReviewRecord', ['id', 'user_id', 'movie_id', 'review', 'timestamp'])
+
+
+class IngestionException(Exception):
+    pass
+
+
+def parse_movie(row: List[str]) -> MovieRecord:
+    # A genre listed twice for a movie is kept once.
+    return MovieRecord(
+        id=int(row[0]),
+        date=date(int(row[6]), 1, 1),
+        title=row[1].strip(),
+        first_para=row[3].strip(),
+        genres=tuple(dict.fromkeys(genre.strip() for genre in row[2].split(','))),
+        director=row[4].strip(),
+        actors=row[5].strip(),
+        rank=int(row[0]),
+        time=int(row[7]),
+        rating=float(row[8]),
+        votes=int(row[9]),
+        revenue=None if row[10].strip() == 'N/A' else float(row[10]),
+        metascore=None if row[11].strip() == 'N/A' else int(row[11]),
+        image_hyperlink=IMAGE_URL + row[14].strip()
+    )
+
+
+def parse_user(row: List[str]) -> UserRecord:
+    return UserRecord(id=int(row[0]), username=row[1].strip(), password=row[2].strip())
+
+
+def parse_review(row: List[str]) -> ReviewRecord:
+    return ReviewRecord(
+        id=int(row[0]),
+        user_id=int(row[1]),
+        movie_id=int(row[2]),
+        review=row[3].strip(),
+        timestamp=datetime.fromisoformat(row[4].strip())
+    )
+
+
+def read_records(filename: str, parse_row: Callable[[List[str]], tuple], processes: int = None,
+                 chunk_bytes: int = CHUNK_BYTES) -> Iterator[tuple]:
+    # Yields parse_row of each row after the header, in order. parse_row must be a module-level function, so it can be
+    # sent to other processes. Raises IngestionException for a row parse_row rejects.
+    chunks = chunk_boundaries(filename, chunk_bytes)
+    processes = processes or os.cpu_count() or 1
+    if processes < 2 or os.path.getsize(filename) <= chunk_bytes:
+        for start, end in chunks:
+            yield from parse_chunk(filename, start, end, parse_row)
+        return
+
+    with ProcessPoolExecutor(max_workers=processes) as executor:
+        pending = deque()
+        for start, end in chunks:
+            pending.append(executor.submit(parse_chunk, filename, start, end, parse_row))
+            if len(pending) >= processes * CHUNKS_IN_FLIGHT:
+                yield from pending.popleft().result()
+        while len(pending) > 0:
+            yield from pending.popleft().result()
+
+
+def chunk_boundaries(filename: str, chunk_bytes: int = CHUNK_BYTES) -> Iterator[Tuple[int, int]]:
+    # Yields the start and end byte offsets of chunks of the file's rows after the header. The header is assumed to
+    # have no quoted newlines.
+    with open(filename, 'rb') as infile:
+        infile.readline()
+        start = infile.tell()
+        quotes = 0
+        while True:
+            block = infile.read(chunk_bytes)
+            if len(block) == 0:
+                break
+            quotes += block.count(b'"')
+            # Carry on to the end of the row the block stops in.
+            while quotes % 2 == 1 or not block.endswith(b'\n'):
+                block = infile.readline()
+                if len(block) == 0:
+                    break
+                quotes += block.count(b'"')
+            end = infile.tell()
+            yield start, end
+            start = end
+
+
+def parse_chunk(filename: str, start: int, end: int, parse_row: Callable[[List[str]], tuple]) -> List[tuple]:
+    with open(filename, 'rb') as infile:
+        infile.seek(start)
+        data = infile.read(end - start)
+
+    records = list()
+    reader = csv.reader(io.StringIO(data.decode('utf-8'), newline=''))
+    row_line = 0
+    for row in reader:
+        if len(row) > 0:
+            try:
+                records.append(parse_row(row))
+            except (ValueError, IndexError) as error:
+                # The reader counts the lines it has read, so the row starts after the lines read before it.
+                row_start = start + sum(len(line) for line in data.splitlines(keepends=True)[:row_line])
+                raise IngestionException(f'{os.path.basename(filename)}: invalid row at byte {row_start}: {error}')
+        row_line = reader.line_num
+    return records
@@ -1,14 +1,42 @@
-import csv
+import heapq
+import logging
+import math
 import os
-from datetime import date, datetime
-from typing import List
+import random
+from datetime import date, datetime, timedelta
+from typing import List, Iterable
 
 from bisect import bisect, bisect_left, insort_left
+from itertools import islice
 
-from werkzeug.security import generate_password_hash
+import numpy as np
 
-from movies.adapters.repository import AbstractRepository, RepositoryException
-from movies.domain.model import Movie, Genre, User, Review, make_genre_association, make_review
+from movies.adapters.repository import AbstractRepository, MovieIdPage, RepositoryException
+from movies.adapters.co_review_index import CoReviewIndex
+from movies.adapters.completion_index import Completion, CompletionIndex
+from movies.adapters.credentials import hash_password_batches
+from movies.adapters.facet_index import FacetIndex, MovieFilter
+from movies.adapters.ingestion import parse_movie, parse_review, parse_user, read_records
+from movies.adapters.search_index import SearchIndex, movie_fields
+from movies.adapters.snapshot import Snapshot, read_snapshot, source_digest, write_snapshot
+from movies.domain.model import Movie, Genre, User, Review, make_review
+
+logger = logging.getLogger(__name__)
+
+# The data files populate loads, in the order they're digested to key a snapshot.
+DATA_FILES = ('Data1000Movies.csv', 'users.csv', 'comments.csv')
+
+# How a snapshot stores each Movie attribute, other than id and date: text as strings, and numbers in integer or
+# float arrays, with None as NULL_INTEGER or NaN.
+MOVIE_TEXT_ATTRIBUTES = ('title', 'first_para', 'hyperlink', 'image_hyperlink', 'actors', 'director')
+MOVIE_INTEGER_ATTRIBUTES = ('rank', 'time', 'votes', 'metascore')
+MOVIE_FLOAT_ATTRIBUTES = ('rating', 'revenue')
+NULL_INTEGER = np.iinfo(np.int64).min
+SEARCH_INDEX_ARRAYS = ('offsets', 'documents', 'frequencies', 'document_ids', 'document_lengths')
+EPOCH = datetime(1970, 1, 1)
+
+# Number of users whose passwords load_users hashes at a time.
+USER_BATCH_SIZE = 10000
 
 
 class MemoryRepository(AbstractRepository):
@@ -17,20 +45,123 @@ class MemoryRepository(AbstractRepository):
     def __init__(self):
         self._movies = list()
         self._movies_index = dict()
+        self._movie_ids = list()
+        self._dates = list()
+        self._movies_by_date = dict()
+        self._rating_index = list()
+        self._runtime_index = list()
         self._genres = list()
+        self._genres_index = dict()
+        self._genres_version = 0
+        self._movies_version = 0
         self._users = list()
+        self._users_index = dict()
         self._reviews = list()
-        self._directors = list()
+        self._co_review_index = CoReviewIndex()
+        self._review_counts = dict()
+        self._review_count_index = list()
+        self._review_days = list()
+        self._review_counts_by_day = dict()
+        self._directors_index = dict()
+        self._facet_index = FacetIndex()
+        self._search_index = SearchIndex()
+        self._completion_index = None
+        self._data_version = 0
+        self._data_modified = datetime.utcnow().replace(microsecond=0)
 
     def add_user(self, user: User):
         self._users.append(user)
+        # Keep the first User registered under a username, as the former linear search did.
+        self._users_index.setdefault(user.username, user)
+
+    def add_users(self, users: Iterable[User]):
+        users = list(users)
+        self._users.extend(users)
+        for user in users:
+            self._users_index.setdefault(user.username, user)
 
     def get_user(self, username) -> User:
-        return next((user for user in self._users if user.username == username), None)
+        return self._users_index.get(username)
 
     def add_movie(self, movie: Movie):
         insort_left(self._movies, movie)
+        if movie.id not in self._movies_index:
+            self._movie_ids.append(movie.id)
+        else:
+            self._movies_version += 1
         self._movies_index[movie.id] = movie
+        if movie.date not in self._movies_by_date:
+            insort_left(self._dates, movie.date)
+            self._movies_by_date[movie.date] = list()
+        self._movies_by_date[movie.date].append(movie)
+        if movie.id is not None:
+            insort_left(self._directors_index.setdefault(movie.director, list()), movie.id)
+            if movie.rating is not None:
+                insort_left(self._rating_index, (movie.rating, movie.id))
+            if movie.time is not None:
+                insort_left(self._runtime_index, (movie.time, movie.id))
+            self._facet_index.add_movie(movie.id, movie.date.year, movie.director, movie.rating)
+            self._search_index.add_document(movie.id, movie_fields(movie))
+            if self._completion_index is not None:
+                self._completion_index.add_movie(movie.id, movie.title, movie.actors, movie.director, movie.votes)
+        self._bump_data_version()
+
+    def add_movies(self, movies: Iterable[Movie]):
+        # Adds the Movies as add_movie would one by one, but sorts each index once rather than inserting into it per
+        # Movie, which is quadratic for a large batch. Movies should have distinct ids, not already in the repository.
+        self._add_movies(movies, index_text=True)
+
+    def _add_movies(self, movies: Iterable[Movie], index_text: bool):
+        # Leaves the Movies out of the search index unless index_text is True.
+        movies = list(movies)
+        if len(movies) == 0:
+            return
+
+        # insort_left puts each Movie before the others of its date, so self._movies holds a date's Movies latest
+        # insertion first; putting the batch in reverse ahead of the existing Movies keeps that order through the
+        # stable sort.
+        ordered_movies = movies[::-1]
+        ordered_movies.extend(self._movies)
+        ordered_movies.sort(key=lambda movie: movie.date)
+        self._movies = ordered_movies
+
+        new_dates = False
+        identified_movies = list()
+        for movie in movies:
+            if movie.id not in self._movies_index:
+                self._movie_ids.append(movie.id)
+            self._movies_index[movie.id] = movie
+            bucket = self._movies_by_date.get(movie.date)
+            if bucket is None:
+                bucket = self._movies_by_date[movie.date] = list()
+                self._dates.append(movie.date)
+                new_dates = True
+            bucket.append(movie)
+            if movie.id is not None:
+                identified_movies.append(movie)
+                self._directors_index.setdefault(movie.director, list()).append(movie.id)
+                if movie.rating is not None:
+                    self._rating_index.append((movie.rating, movie.id))
+                if movie.time is not None:
+                    self._runtime_index.append((movie.time, movie.id))
+                if index_text:
+                    self._search_index.add_document(movie.id, movie_fields(movie))
+
+        self._facet_index.add_movies(
+            (movie.id, movie.date.year, movie.director, movie.rating) for movie in identified_movies
+        )
+        if self._completion_index is not None:
+            self._completion_index.add_movies(
+                (movie.id, movie.title, movie.actors, movie.director, movie.votes) for movie in identified_movies
+            )
+
+        if new_dates:
+            self._dates.sort()
+        for movie_ids in self._directors_index.values():
+            movie_ids.sort()
+        self._rating_index.sort()
+        self._runtime_index.sort()
+        self._bump_data_version()
 
     def get_movie(self, id: int) -> Movie:
         movie = None
@@ -43,37 +174,40 @@ class MemoryRepository(AbstractRepository):
         return movie
 
     def get_movies_by_date(self, target_date: date) -> List[Movie]:
-        target_movie = Movie(
-            date=target_date,
-            title=None,
-            first_para=None,
-            hyperlink=None,
-            image_hyperlink=None,
-            rank=None,
-            director=None,
-            time=None,
-            rating = None,
-            actors = None,
-            id=None
-        )
-        matching_movies = list()
+        # Buckets keep Movies in insertion order, whereas self._movies puts later insertions first within a date.
+        bucket = self._movies_by_date.get(target_date)
 
-        try:
-            index = self.movie_index(target_movie)
-            for movie in self._movies[index:None]:
-                if movie.date == target_date:
-                    matching_movies.append(movie)
-                else:
-                    break
-        except ValueError:
+        if bucket is None:
             # No movies for specified date. Simply return an empty list.
-            pass
+            return list()
 
-        return matching_movies
+        return bucket[::-1]
+
+    def get_date_page(self, target_date: date = None):
+        if len(self._dates) == 0:
+            return list(), None, None, None, None
+
+        if target_date is None:
+            target_date = self._dates[0]
+
+        movies = self.get_movies_by_date(target_date)
+        previous_date = next_date = None
+
+        if len(movies) > 0:
+            index = self.date_index(target_date)
+            if index > 0:
+                previous_date = self._dates[index - 1]
+            if index + 1 < len(self._dates):
+                next_date = self._dates[index + 1]
+
+        return movies, self._dates[0], previous_date, next_date, self._dates[-1]
 
     def get_number_of_movies(self):
         return len(self._movies)
 
+    def get_movie_ids(self) -> List[int]:
+        return sorted(id for id in self._movie_ids if id is not None)
+
     def get_first_movie(self):
         movie = None
 
@@ -96,44 +230,109 @@ class MemoryRepository(AbstractRepository):
         movies = [self._movies_index[id] for id in existing_ids]
         return movies
 
+    def get_random_movies(self, quantity: int) -> List[Movie]:
+        # random.sample draws from the id list in O(quantity) time, without copying or shuffling it.
+        quantity = max(0, min(quantity, len(self._movie_ids)))
+        return [self._movies_index[id] for id in random.sample(self._movie_ids, quantity)]
+
     def get_movie_ids_for_genre(self, genre_name: str):
-        # Linear search, to find the first occurrence of a Genre with the name genre_name.
-        genre = next((genre for genre in self._genres if genre.genre_name == genre_name), None)
+        # The returned list is the index itself, so callers must slice rather than modify it.
+        entry = self._genres_index.get(genre_name)
 
-        # Retrieve the ids of movies associated with the Genre.
-        if genre is not None:
-            movie_ids = [movie.id for movie in genre.genreged_movies]
-        else:
+        if entry is None:
             # No Genre with name genre_name, so return an empty list.
-            movie_ids = list()
+            return list()
 
-        return movie_ids
+        self._refresh_genre_entry(entry)
+        return entry.movie_ids
 
     def get_movie_ids_for_director(self, director_name: str):
-        # Linear search, to find the first occurrence of a Genre with the name director_name.
-        director = next((director for director in self._directors if director.director_name == director_name), None)
-
-        # Retrieve the ids of movies associated with the Genre.
-        if director is not None:
-            movie_ids = [movie.id for movie in director.directorged_movies]
+        # The returned list is the index itself, so callers must slice rather than modify it.
+        return self._directors_index.get(director_name, list())
+
+    def get_movies_sorted_by_rating(self, quantity: int, highest_first: bool = True) -> List[Movie]:
+        keys = reversed(self._rating_index) if highest_first else iter(self._rating_index)
+        return [self._movies_index[id] for rating, id in islice(keys, quantity)]
+
+    def get_movies_sorted_by_runtime(self, quantity: int, longest_first: bool = False) -> List[Movie]:
+        keys = reversed(self._runtime_index) if longest_first else iter(self._runtime_index)
+        return [self._movies_index[id] for time, id in islice(keys, quantity)]
+
+    def get_top_rated_movies_for_genre(self, genre_name: str, quantity: int, decade: int = None) -> List[Movie]:
+        entry = self._genres_index.get(genre_name)
+        if entry is None:
+            return list()
+
+        self._refresh_genre_entry(entry)
+        keys = entry.ratings_by_decade.get(decade, list())
+        return [self._movies_index[id] for rating, id in islice(reversed(keys), quantity)]
+
+    def get_most_reviewed_movies(self, quantity: int, since: date = None) -> List[Movie]:
+        if since is None:
+            return [self._movies_index[id] for count, id in islice(self._review_count_index, quantity)]
+
+        # Only the days in range are visited, so the cost depends on the reviews written since, not on all of them.
+        counts = dict()
+        for day in islice(self._review_days, bisect_left(self._review_days, since), None):
+            for movie_id, count in self._review_counts_by_day[day].items():
+                counts[movie_id] = counts.get(movie_id, 0) + count
+        best = heapq.nsmallest(quantity, counts, key=lambda movie_id: (-counts[movie_id], movie_id))
+        return [self._movies_index[id] for id in best]
+
+    def get_faceted_movie_ids(self, movie_filter: MovieFilter):
+        # Pick up genre associations made since the genres were last indexed.
+        for entry in self._genres_index.values():
+            self._refresh_genre_entry(entry)
+        return self._facet_index.query(movie_filter)
+
+    def get_movie_ids_page(self, movie_filter: MovieFilter, limit: int, after_id: int = None,
+                           before_id: int = None) -> MovieIdPage:
+        if movie_filter == MovieFilter(genres=movie_filter.genres) and len(set(movie_filter.genres)) == 1:
+            # A genre's ids are already sorted in its index entry.
+            movie_ids = self.get_movie_ids_for_genre(movie_filter.genres[0])
         else:
-            # No Genre with name director_name, so return an empty list.
-            movie_ids = list()
-
-        return movie_ids
-
+            for entry in self._genres_index.values():
+                self._refresh_genre_entry(entry)
+            movie_ids = self._facet_index.matching_ids(movie_filter)
+
+        # Find the page by binary search for its first or last id.
+        limit = max(limit, 0)
+        if before_id is not None:
+            end = bisect_left(movie_ids, before_id)
+            start = max(0, end - limit)
+        else:
+            start = bisect(movie_ids, after_id) if after_id is not None else 0
+            end = min(len(movie_ids), start + limit)
+        page = [int(id) for id in movie_ids[start:end]]
+        return MovieIdPage(page, start > 0, end < len(movie_ids), len(movie_ids))
+
+    def search_movies(self, query: str, limit: int, offset: int = 0) -> List[Movie]:
+        return [self._movies_index[id] for id in self._search_index.search(query, limit, offset)]
+
+    def get_completions(self, prefix: str, quantity: int) -> List[Completion]:
+        self.build_completion_index()
+        return self._completion_index.complete(prefix, quantity)
+
+    def build_completion_index(self):
+        if self._completion_index is None:
+            # Built in one go once the movies are loaded; inserting each movie into the sorted index as it's loaded
+            # would be slower. After that, add_movie keeps it up to date.
+            completion_index = CompletionIndex()
+            completion_index.add_movies(
+                (movie.id, movie.title, movie.actors, movie.director, movie.votes) for movie in self._movies
+                if movie.id is not None
+            )
+            self._completion_index = completion_index
 
     def get_date_of_previous_movie(self, movie: Movie):
         previous_date = None
 
         try:
-            index = self.movie_index(movie)
-            for stored_movie in reversed(self._movies[0:index]):
-                if stored_movie.date < movie.date:
-                    previous_date = stored_movie.date
-                    break
+            index = self.date_index(movie.date)
+            if index > 0:
+                previous_date = self._dates[index - 1]
         except ValueError:
-            # No earlier movies, so return None.
+            # No movies on the movie's date, so return None.
             pass
 
         return previous_date
@@ -142,123 +341,339 @@ class MemoryRepository(AbstractRepository):
         next_date = None
 
         try:
-            index = self.movie_index(movie)
-            for stored_movie in self._movies[index + 1:len(self._movies)]:
-                if stored_movie.date > movie.date:
-                    next_date = stored_movie.date
-                    break
+            index = self.date_index(movie.date)
+            if index + 1 < len(self._dates):
+                next_date = self._dates[index + 1]
         except ValueError:
-            # No subsequent movies, so return None.
+            # No movies on the movie's date, so return None.
             pass
 
         return next_date
 
     def add_genre(self, genre: Genre):
         self._genres.append(genre)
+        if genre.genre_name not in self._genres_index:
+            entry = GenreIndexEntry(genre)
+            self._refresh_genre_entry(entry)
+            self._genres_index[genre.genre_name] = entry
+        self._genres_version += 1
+        self._bump_data_version()
 
     def get_genres(self) -> List[Genre]:
         return self._genres
 
+    def get_genre_names(self) -> List[str]:
+        return [genre.genre_name for genre in self._genres]
+
+    def get_genres_version(self) -> int:
+        return self._genres_version
+
+    def get_movies_version(self) -> int:
+        return self._movies_version
+
+    def get_data_version(self):
+        return self._data_version, self._data_modified
+
+    def _bump_data_version(self):
+        self._data_version += 1
+        self._data_modified = datetime.utcnow().replace(microsecond=0)
+
     def add_review(self, review: Review):
         super().add_review(review)
         self._reviews.append(review)
+        self._co_review_index.add_review(review.user.username, review.movie.id)
+
+        # Keep the all-time ranking sorted by (-number of reviews, id), and count each day's reviews for rankings
+        # over recent days.
+        movie_id = review.movie.id
+        count = self._review_counts.get(movie_id, 0)
+        if count > 0:
+            del self._review_count_index[bisect_left(self._review_count_index, (-count, movie_id))]
+        self._review_counts[movie_id] = count + 1
+        insort_left(self._review_count_index, (-count - 1, movie_id))
+
+        day = review.timestamp.date()
+        if day not in self._review_counts_by_day:
+            insort_left(self._review_days, day)
+            self._review_counts_by_day[day] = dict()
+        day_counts = self._review_counts_by_day[day]
+        day_counts[movie_id] = day_counts.get(movie_id, 0) + 1
+        self._bump_data_version()
+
+    def get_co_reviewed_movies(self, movie_id: int, quantity: int) -> List[Movie]:
+        movie_ids = self._co_review_index.get_co_reviewed_movie_ids(movie_id, quantity)
+        return self.get_movies_by_id(movie_ids)
 
     def get_reviews(self):
         return self._reviews
 
-    # Helper method to return movie index.
-    def movie_index(self, movie: Movie):
-        index = bisect_left(self._movies, movie)
-        if index != len(self._movies) and self._movies[index].date == movie.date:
+    def save_snapshot(self, path: str, digest: str):
+        # Saves the Movies, Genres, Users and Reviews, and the search index, to a snapshot file at path tagged with
+        # digest. Movies are saved in the order they were added, which fixes the order of Movies of the same date.
+        movies = [self._movies_index[id] for id in self._movie_ids]
+        arrays = {
+            'movies.id': np.array([movie.id for movie in movies], dtype=np.int64),
+            'movies.date': np.array([movie.date.toordinal() for movie in movies], dtype=np.int32)
+        }
+        for attribute in MOVIE_INTEGER_ATTRIBUTES:
+            values = (getattr(movie, attribute) for movie in movies)
+            arrays['movies.' + attribute] = np.array(
+                [NULL_INTEGER if value is None else value for value in values], dtype=np.int64
+            )
+        for attribute in MOVIE_FLOAT_ATTRIBUTES:
+            values = (getattr(movie, attribute) for movie in movies)
+            arrays['movies.' + attribute] = np.array(
+                [math.nan if value is None else value for value in values], dtype=np.float64
+            )
+        strings = {
+            'movies.' + attribute: [getattr(movie, attribute) for movie in movies]
+            for attribute in MOVIE_TEXT_ATTRIBUTES
+        }
+
+        genre_sizes = [genre.number_of_genreged_movies for genre in self._genres]
+        arrays['genres.offsets'] = np.cumsum([0] + genre_sizes, dtype=np.int64)
+        arrays['genres.movie_ids'] = np.array(
+            [movie.id for genre in self._genres for movie in genre.genreged_movies], dtype=np.int64
+        )
+        strings['genres.name'] = [genre.genre_name for genre in self._genres]
+
+        strings['users.username'] = [user.username for user in self._users]
+        strings['users.password'] = [user.password for user in self._users]
+
+        user_positions = {user.username: position for position, user in reversed(list(enumerate(self._users)))}
+        arrays['reviews.user'] = np.array([user_positions[review.user.username] for review in self._reviews],
+                                          dtype=np.int64)
+        arrays['reviews.movie_id'] = np.array([review.movie.id for review in self._reviews], dtype=np.int64)
+        arrays['reviews.timestamp'] = np.array(
+            [(review.timestamp - EPOCH) // timedelta(microseconds=1) for review in self._reviews], dtype=np.int64
+        )
+        strings['reviews.text'] = [review.review for review in self._reviews]
+
+        terms, search_arrays = self._search_index.to_arrays()
+        strings['search.terms'] = terms
+        for name, array in search_arrays.items():
+            arrays['search.' + name] = array
+
+        write_snapshot(path, digest, arrays, strings)
+
+    def load_snapshot(self, snapshot: Snapshot):
+        # Loads the contents of a snapshot saved by save_snapshot into the repository, which should be empty. Genre
+        # associations are known to be distinct, and the search index is taken as saved rather than rebuilt.
+        columns = [snapshot.array('movies.id').tolist()]
+        columns.append([date.fromordinal(ordinal) for ordinal in snapshot.array('movies.date').tolist()])
+        columns.extend(snapshot.strings('movies.' + attribute) for attribute in MOVIE_TEXT_ATTRIBUTES)
+        for attribute in MOVIE_INTEGER_ATTRIBUTES:
+            values = snapshot.array('movies.' + attribute).tolist()
+            columns.append([None if value == NULL_INTEGER else value for value in values])
+        for attribute in MOVIE_FLOAT_ATTRIBUTES:
+            values = snapshot.array('movies.' + attribute).tolist()
+            columns.append([None if math.isnan(value) else value for value in values])
+
+        attributes = ('id', 'date') + MOVIE_TEXT_ATTRIBUTES + MOVIE_INTEGER_ATTRIBUTES + MOVIE_FLOAT_ATTRIBUTES
+        movies = [Movie(**dict(zip(attributes, values))) for values in zip(*columns)]
+
+        self._search_index = SearchIndex.from_arrays(
+            snapshot.strings('search.terms'), {name: snapshot.array('search.' + name) for name in SEARCH_INDEX_ARRAYS}
+        )
+        self._add_movies(movies, index_text=False)
+
+        genre_offsets = snapshot.array('genres.offsets').tolist()
+        genre_movie_ids = snapshot.array('genres.movie_ids').tolist()
+        for position, genre_name in enumerate(snapshot.strings('genres.name')):
+            genre = Genre(genre_name)
+            movie_ids = genre_movie_ids[genre_offsets[position]:genre_offsets[position + 1]]
+            associate_movies(genre, [self._movies_index[id] for id in movie_ids])
+            self.add_genre(genre)
+
+        users = [
+            User(username=username, password=password)
+            for username, password in zip(snapshot.strings('users.username'), snapshot.strings('users.password'))
+        ]
+        self.add_users(users)
+
+        reviews = zip(
+            snapshot.array('reviews.user').tolist(), snapshot.array('reviews.movie_id').tolist(),
+            snapshot.array('reviews.timestamp').tolist(), snapshot.strings('reviews.text')
+        )
+        for user_position, movie_id, timestamp, review_text in reviews:
+            self.add_review(make_review(
+                review_text=review_text,
+                user=users[user_position],
+                movie=self._movies_index[movie_id],
+                timestamp=EPOCH + timedelta(microseconds=timestamp)
+            ))
+
+    # Helper method to bring a genre's sorted movie ids up to date with associations made since it was indexed.
+    # Genre only ever appends to its movies, so just the unseen tail is inserted.
+    def _refresh_genre_entry(self, entry: 'GenreIndexEntry'):
+        number_of_movies = entry.genre.number_of_genreged_movies
+        if number_of_movies == entry.number_indexed:
+            return
+
+        new_movies = islice(entry.genre.genreged_movies, entry.number_indexed, None)
+        if number_of_movies - entry.number_indexed > len(entry.movie_ids):
+            # Each insertion shifts the sorted lists along, so when the new movies outnumber those indexed, as when a
+            # Genre is first indexed, append them and sort the lists once instead.
+            self._index_genre_movies_in_bulk(entry, new_movies)
+        else:
+            for movie in new_movies:
+                if movie.id is not None:
+                    position = bisect_left(entry.movie_ids, movie.id)
+                    if position < len(entry.movie_ids) and entry.movie_ids[position] == movie.id:
+                        # Already indexed; don't rank the movie twice.
+                        continue
+                    entry.movie_ids.insert(position, movie.id)
+                    self._facet_index.add_genre_movie(entry.genre.genre_name, movie.id)
+                    if movie.rating is not None:
+                        # Rank the movie among all of the Genre's movies, and among those of its decade.
+                        insort_left(entry.ratings_by_decade.setdefault(None, list()), (movie.rating, movie.id))
+                        decade = movie.date.year // 10 * 10
+                        insort_left(entry.ratings_by_decade.setdefault(decade, list()), (movie.rating, movie.id))
+        entry.number_indexed = number_of_movies
+
+    def _index_genre_movies_in_bulk(self, entry: 'GenreIndexEntry', movies: Iterable[Movie]):
+        indexed_ids = set(entry.movie_ids)
+        new_movies = dict()
+        for movie in movies:
+            if movie.id is not None and movie.id not in indexed_ids:
+                new_movies.setdefault(movie.id, movie)
+
+        entry.movie_ids.extend(new_movies)
+        entry.movie_ids.sort()
+        self._facet_index.add_genre_movies(entry.genre.genre_name, new_movies)
+
+        ratings_by_decade = entry.ratings_by_decade
+        for movie in new_movies.values():
+            if movie.rating is not None:
+                key = (movie.rating, movie.id)
+                ratings_by_decade.setdefault(None, list()).append(key)
+                ratings_by_decade.setdefault(movie.date.year // 10 * 10, list()).append(key)
+        for ratings in ratings_by_decade.values():
+            ratings.sort()
+
+    # Helper method to return the index of a date in the sorted list of distinct movie dates.
+    def date_index(self, target_date: date):
+        index = bisect_left(self._dates, target_date)
+        if index != len(self._dates) and self._dates[index] == target_date:
             return index
         raise ValueError
 
 
-def read_csv_file(filename: str):
-    with open(filename, encoding='utf-8-sig') as infile:
-        reader = csv.reader(infile)
-
-        # Read first line of the the CSV file.
-        headers = next(reader)
+class GenreIndexEntry:
+    # Sorted ids of the Movies associated with a Genre, their sorted (rating, id) pairs overall (key None) and by
+    # decade, and how many of the Genre's Movies they cover.
 
-        # Read remaining rows from the CSV file.
-        for row in reader:
-            # Strip any leading/trailing white space from data read.
-            row = [item.strip() for item in row]
-            yield row
+    def __init__(self, genre: Genre):
+        self.genre = genre
+        self.movie_ids = list()
+        self.ratings_by_decade = dict()
+        self.number_indexed = 0
 
 
 def load_movies_and_genres(data_path: str, repo: MemoryRepository):
     genres = dict()
+    movies = list()
 
-    for data_row in read_csv_file(os.path.join(data_path, 'Data1000Movies.csv')):
-
-        movie_key = int(data_row[0])
-        movie_genres = data_row[2].split(",")
+    for record in read_records(os.path.join(data_path, 'Data1000Movies.csv'), parse_movie):
         # Add any new genres; associate the current movie with genres.
-        for genre in movie_genres:
-            if genre not in genres.keys():
-                genres[genre] = list()
-            genres[genre].append(movie_key)
+        for genre in record.genres:
+            genres.setdefault(genre, list()).append(record.id)
 
         # Create Movie object.
         movie = Movie(
-            date=date.fromisoformat(data_row[6]+"-01-01"),
-            title=data_row[1],
-            first_para=data_row[3],
+            date=record.date,
+            title=record.title,
+            first_para=record.first_para,
             hyperlink="",
 
-            rank=data_row[0],
-            director=data_row[4],
-            time=data_row[7],
-            rating=data_row[8],
-            actors=data_row[5],
-            id=movie_key,
-        image_hyperlink = "https://image.tmdb.org/t/p/w780" + data_row[14]
+            rank=record.rank,
+            director=record.director,
+            time=record.time,
+            rating=record.rating,
+            actors=record.actors,
+            id=record.id,
+            image_hyperlink=record.image_hyperlink,
+            votes=record.votes,
+            revenue=record.revenue,
+            metascore=record.metascore
         )
+        movies.append(movie)
 
-        # Add the Movie to the repository.
-        repo.add_movie(movie)
+    # Add the Movies to the repository.
+    repo.add_movies(movies)
 
     # Create Genre objects, associate them with Movies and add them to the repository.
     for genre_name in genres.keys():
         genre = Genre(genre_name)
-        for movie_id in genres[genre_name]:
-            movie = repo.get_movie(movie_id)
-            make_genre_association(movie, genre)
+        associate_movies(genre, repo.get_movies_by_id(genres[genre_name]))
         repo.add_genre(genre)
 
 
-def load_users(data_path: str, repo: MemoryRepository):
+def associate_movies(genre: Genre, movies: Iterable[Movie]):
+    # Associates a new Genre with Movies known to be distinct. make_genre_association checks each pair against all of
+    # the Genre's Movies so far, which is quadratic in the size of the Genre.
+    for movie in movies:
+        movie.add_genre(genre)
+        genre.add_movie(movie)
+
+
+def load_users(data_path: str, repo: MemoryRepository, credentials_cache_path: str = None):
     users = dict()
 
-    for data_row in read_csv_file(os.path.join(data_path, 'users.csv')):
-        user = User(
-            username=data_row[1],
-            password=generate_password_hash(data_row[2])
-        )
-        repo.add_user(user)
-        users[data_row[0]] = user
+    records = read_records(os.path.join(data_path, 'users.csv'), parse_user)
+    # Hash the passwords a batch at a time, so those not already hashed or cached can be hashed in parallel without
+    # holding every record and hash at once.
+    batches = iter(lambda: list(islice(records, USER_BATCH_SIZE)), [])
+    for batch, password_hashes in hash_password_batches(
+            batches, lambda record: (record.username, record.password), credentials_cache_path):
+        new_users = list()
+        for record, password_hash in zip(batch, password_hashes):
+            user = User(
+                username=record.username,
+                password=password_hash
+            )
+            new_users.append(user)
+            users[record.id] = user
+
+        # Add each batch of users in one pass so the username index is built alongside the list.
+        repo.add_users(new_users)
     return users
 
 
 def load_reviews(data_path: str, repo: MemoryRepository, users):
-    for data_row in read_csv_file(os.path.join(data_path, 'comments.csv')):
+    for record in read_records(os.path.join(data_path, 'comments.csv'), parse_review):
         review = make_review(
-            review_text=data_row[3],
-            user=users[data_row[1]],
-            movie=repo.get_movie(int(data_row[2])),
-            timestamp=datetime.fromisoformat(data_row[4])
+            review_text=record.review,
+            user=users[record.user_id],
+            movie=repo.get_movie(record.movie_id),
+            timestamp=record.timestamp
         )
         repo.add_review(review)
 
 
-def populate(data_path: str, repo: MemoryRepository):
+def populate(data_path: str, repo: MemoryRepository, snapshot_path: str = None, credentials_cache_path: str = None):
+    # Given a snapshot_path, the repository is loaded from the snapshot there if it was saved from the data files as
+    # they are now, and otherwise from the data files, after which it's saved to a new snapshot there. Given a
+    # credentials_cache_path, users' password hashes are reused from the cache there (see credentials.py).
+    if snapshot_path is not None:
+        digest = source_digest(os.path.join(data_path, filename) for filename in DATA_FILES)
+        snapshot = read_snapshot(snapshot_path, digest)
+        if snapshot is not None:
+            repo.load_snapshot(snapshot)
+            return
+
     # Load movies and genres into the repository.
     load_movies_and_genres(data_path, repo)
 
     # Load users into the repository.
-    users = load_users(data_path, repo)
+    users = load_users(data_path, repo, credentials_cache_path)
 
     # Load reviews into the repository.
     load_reviews(data_path, repo, users)
+
+    if snapshot_path is not None:
+        try:
+            repo.save_snapshot(snapshot_path, digest)
+        except OSError as error:
+            # The repository is complete without a snapshot; the next start just loads the data files again.
+            logger.warning('Could not save snapshot: %s', error)
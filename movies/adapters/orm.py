@@ -1,65 +1,225 @@
+from typing import List
+
 from sqlalchemy import (
-    Table, MetaData, Column, Integer, String, Date, DateTime,
-    ForeignKey
+    Table, MetaData, Column, Integer, Float, String, Date, DateTime,
+    ForeignKey, Index, inspect
 )
+from sqlalchemy.dialects import sqlite
+from sqlalchemy.engine import Engine
 from sqlalchemy.orm import mapper, relationship
+from sqlalchemy.schema import CreateTable
 
 from movies.domain import model
 
 metadata = MetaData()
 
+# Users and reviews loaded from the data files record the id they have there as seed_id. Rows written through the
+# site have none, so the data files' ids and the site's can never be confused.
 users = Table(
     'users', metadata,
     Column('id', Integer, primary_key=True, autoincrement=True),
     Column('username', String(255), unique=True, nullable=False),
-    Column('password', String(255), nullable=False)
+    Column('password', String(255), nullable=False),
+    Column('seed_id', Integer, unique=True)
 )
 
 reviews = Table(
     'reviews', metadata,
     Column('id', Integer, primary_key=True, autoincrement=True),
-    Column('user_id', ForeignKey('users.id')),
-    Column('movie_id', ForeignKey('movies.id')),
+    Column('user_id', ForeignKey('users.id'), index=True),
+    Column('movie_id', ForeignKey('movies.id'), index=True),
     Column('review', String(1024), nullable=False),
-    Column('timestamp', DateTime, nullable=False)
+    Column('timestamp', DateTime, nullable=False),
+    Column('seed_id', Integer, unique=True),
+    # Covers counting the reviews of each movie written since a given time, without visiting the table.
+    Index('ix_reviews_timestamp_movie_id', 'timestamp', 'movie_id')
 )
 
 movies = Table(
     'movies', metadata,
     Column('id', Integer, primary_key=True, autoincrement=True),
-    Column('date', Date, nullable=False),
+    Column('date', Date, nullable=False, index=True),
     Column('title', String(255), nullable=False),
     Column('first_para', String(1024), nullable=False),
     Column('hyperlink', String(255), nullable=False),
-    Column('rank', String(255), nullable=False),
+    Column('rank', Integer, nullable=False),
     Column('director', String(255), nullable=False),
-    Column('time', String(255), nullable=False),
-    Column('rating', String(255), nullable=False),
+    Column('time', Integer, nullable=False, index=True),
+    Column('rating', Float, nullable=False, index=True),
     Column('actors', String(255), nullable=False),
-    Column('image_hyperlink', String(255), nullable=False)
+    Column('image_hyperlink', String(255), nullable=False),
+    Column('votes', Integer),
+    Column('revenue', Float),
+    Column('metascore', Integer)
 )
 
 genres = Table(
     'genres', metadata,
     Column('id', Integer, primary_key=True, autoincrement=True),
-    Column('name', String(64), nullable=False)
+    Column('name', String(64), nullable=False, index=True)
 )
 
 movie_genres = Table(
     'movie_genres', metadata,
     Column('id', Integer, primary_key=True, autoincrement=True),
-    Column('movie_id', ForeignKey('movies.id')),
-    Column('genre_id', ForeignKey('genres.id'))
+    Column('movie_id', ForeignKey('movies.id'), index=True),
+    Column('genre_id', ForeignKey('genres.id')),
+    # Covers genre -> movie id lookups without visiting the table.
+    Index('ix_movie_genres_genre_id_movie_id', 'genre_id', 'movie_id')
 )
 
 
+def schema_is_current(engine: Engine) -> bool:
+    # Returns False if an existing table's columns differ, by name or type, from those declared here. SQLite can't
+    # alter column types in place, so such a table has to be rebuilt (see migrate_tables).
+    return len(outdated_tables(engine)) == 0
+
+
+def outdated_tables(engine: Engine) -> List[Table]:
+    inspector = inspect(engine)
+    existing_tables = inspector.get_table_names()
+
+    tables = list()
+    for table in metadata.sorted_tables:
+        if table.name not in existing_tables:
+            continue
+        existing_columns = {
+            column['name']: str(column['type'].compile(dialect=engine.dialect))
+            for column in inspector.get_columns(table.name)
+        }
+        declared_columns = {
+            column.name: str(column.type.compile(dialect=engine.dialect))
+            for column in table.columns
+        }
+        if existing_columns != declared_columns:
+            tables.append(table)
+
+    return tables
+
+
+def migrate_tables(engine: Engine) -> List[str]:
+    # Rebuilds each table whose columns differ from those declared here, keeping its rows, and returns their names.
+    # Each is copied into a new table with the declared columns, which then takes its place: the columns both have
+    # are copied, new columns are left NULL, and columns no longer declared are dropped. All the tables are rebuilt
+    # in one transaction, so a failure leaves the database as it was. Indexes, and the full-text index's triggers on
+    # movies, go with the old tables; create_missing_indexes and create_search_index put them back.
+    tables = outdated_tables(engine)
+    if len(tables) == 0:
+        return []
+
+    conn = engine.raw_connection()
+    cursor = conn.cursor()
+    # Dropping a table other tables refer to would otherwise check, or cascade to, their rows.
+    foreign_keys = cursor.execute('PRAGMA foreign_keys').fetchone()[0]
+    cursor.execute('PRAGMA foreign_keys = OFF')
+    try:
+        cursor.execute('BEGIN')
+        for table in tables:
+            existing_columns = {row[1] for row in cursor.execute(f'PRAGMA table_info({table.name})')}
+            columns = ', '.join(column.name for column in table.columns if column.name in existing_columns)
+            create_table = str(CreateTable(table).compile(dialect=sqlite.dialect()))
+            cursor.execute(create_table.replace(f'CREATE TABLE {table.name} ', f'CREATE TABLE {table.name}_new ', 1))
+            cursor.execute(f'INSERT INTO {table.name}_new ({columns}) SELECT {columns} FROM {table.name}')
+            cursor.execute(f'DROP TABLE {table.name}')
+            cursor.execute(f'ALTER TABLE {table.name}_new RENAME TO {table.name}')
+        conn.commit()
+    finally:
+        # Rolls back a failed migration; a no-op after the commit.
+        conn.rollback()
+        cursor.execute(f'PRAGMA foreign_keys = {foreign_keys}')
+        conn.close()
+
+    return [table.name for table in tables]
+
+
+def create_missing_indexes(engine: Engine):
+    # metadata.create_all only creates indexes along with their tables, so a database file created before an index
+    # was declared needs the index added separately. This is safe to run on every start-up.
+    inspector = inspect(engine)
+    existing_tables = inspector.get_table_names()
+
+    for table in metadata.sorted_tables:
+        if table.name not in existing_tables:
+            continue
+        existing_indexes = {index['name'] for index in inspector.get_indexes(table.name)}
+        for index in table.indexes:
+            if index.name not in existing_indexes:
+                index.create(engine)
+
+
+def create_tables_without_indexes(connectable):
+    # Creates the declared tables but none of their indexes, so a bulk load needn't maintain them row by row;
+    # create_missing_indexes builds them afterwards. Constraints, such as the unique usernames, are still created.
+    # connectable is an Engine, Connection or DB-API cursor, so the tables can be created within a transaction.
+    for table in metadata.sorted_tables:
+        connectable.execute(str(CreateTable(table).compile(dialect=sqlite.dialect())))
+
+
+# Full-text index over the searchable movie columns. It's an external-content FTS5 table: it stores only the index and
+# reads the text back from movies, whose rows it shares ids with. Triggers on movies keep the two in step. The column
+# order matters, as search queries weight the columns by position.
+SEARCH_INDEX_COLUMNS = ('title', 'first_para', 'actors', 'director')
+
+SEARCH_INDEX_DDL = {
+    'movies_fts': f"""
+        CREATE VIRTUAL TABLE movies_fts USING fts5(
+            {', '.join(SEARCH_INDEX_COLUMNS)}, content='movies', content_rowid='id'
+        )""",
+    'movies_fts_after_insert': f"""
+        CREATE TRIGGER movies_fts_after_insert AFTER INSERT ON movies BEGIN
+            INSERT INTO movies_fts(rowid, {', '.join(SEARCH_INDEX_COLUMNS)})
+            VALUES (new.id, {', '.join('new.' + column for column in SEARCH_INDEX_COLUMNS)});
+        END""",
+    'movies_fts_after_delete': f"""
+        CREATE TRIGGER movies_fts_after_delete AFTER DELETE ON movies BEGIN
+            INSERT INTO movies_fts(movies_fts, rowid, {', '.join(SEARCH_INDEX_COLUMNS)})
+            VALUES ('delete', old.id, {', '.join('old.' + column for column in SEARCH_INDEX_COLUMNS)});
+        END""",
+    'movies_fts_after_update': f"""
+        CREATE TRIGGER movies_fts_after_update AFTER UPDATE ON movies BEGIN
+            INSERT INTO movies_fts(movies_fts, rowid, {', '.join(SEARCH_INDEX_COLUMNS)})
+            VALUES ('delete', old.id, {', '.join('old.' + column for column in SEARCH_INDEX_COLUMNS)});
+            INSERT INTO movies_fts(rowid, {', '.join(SEARCH_INDEX_COLUMNS)})
+            VALUES (new.id, {', '.join('new.' + column for column in SEARCH_INDEX_COLUMNS)});
+        END"""
+}
+
+
+def create_search_index(connectable) -> bool:
+    # Creates whichever parts of the SQLite full-text index are missing, and rebuilds the index from movies if any
+    # were. connectable is an Engine, Connection or Session. The index isn't part of metadata, so metadata.drop_all
+    # leaves movies_fts behind but drops the triggers with movies; the rebuild then resynchronises it with the new
+    # rows. This is safe to run on every start-up, and returns True if the index had to be rebuilt.
+    existing = {
+        row[0] for row in connectable.execute(
+            "SELECT name FROM sqlite_master WHERE type IN ('table', 'trigger') AND name LIKE 'movies_fts%'"
+        )
+    }
+    missing = [name for name in SEARCH_INDEX_DDL if name not in existing]
+    if len(missing) == 0:
+        return False
+
+    for name in missing:
+        connectable.execute(SEARCH_INDEX_DDL[name])
+    connectable.execute("INSERT INTO movies_fts(movies_fts) VALUES ('rebuild')")
+    return True
+
+
+def drop_search_index(connectable):
+    # Drops the full-text index and its triggers, so rows can be loaded without indexing each one as it's inserted.
+    # connectable is as for create_tables_without_indexes.
+    for name in reversed(list(SEARCH_INDEX_DDL)):
+        kind = 'TABLE' if name == 'movies_fts' else 'TRIGGER'
+        connectable.execute(f'DROP {kind} IF EXISTS {name}')
+
+
 def map_model_to_tables():
-    mapper(model.User, users, properties={
+    mapper(model.User, users, exclude_properties=['seed_id'], properties={
         '_username': users.c.username,
         '_password': users.c.password,
         '_reviews': relationship(model.Review, backref='_user')
     })
-    mapper(model.Review, reviews, properties={
+    mapper(model.Review, reviews, exclude_properties=['seed_id'], properties={
         '_review': reviews.c.review,
         '_timestamp': reviews.c.timestamp
     })
@@ -75,6 +235,9 @@ def map_model_to_tables():
         '_rating': movies.c.rating,
         '_actors': movies.c.actors,
         '_image_hyperlink': movies.c.image_hyperlink,
+        '_votes': movies.c.votes,
+        '_revenue': movies.c.revenue,
+        '_metascore': movies.c.metascore,
         '_reviews': relationship(model.Review, backref='_movie')
     })
     mapper(model.Genre, genres, properties={
@@ -1,12 +1,19 @@
 import abc
+from collections import namedtuple
 from typing import List
 from datetime import date
 
+from movies.adapters.completion_index import Completion
+from movies.adapters.facet_index import MovieFilter
 from movies.domain.model import User, Movie, Genre, Review
 
 
 repo_instance = None
 
+# A page of a keyset-paginated listing: the ids on the page in ascending order, whether there are matching ids before
+# and after it, and the total number of matching ids.
+MovieIdPage = namedtuple('MovieIdPage', ['movie_ids', 'has_previous', 'has_next', 'total'])
+
 
 class RepositoryException(Exception):
 
@@ -50,11 +57,30 @@ class AbstractRepository(abc.ABC):
         """
         raise NotImplementedError
 
+    @abc.abstractmethod
+    def get_date_page(self, target_date: date = None):
+        """ Returns everything needed to display the Movies published on target_date, in a single query.
+
+        The result is a tuple (movies, first_date, previous_date, next_date, last_date), where movies is the list
+        that get_movies_by_date would return, first_date and last_date are the earliest and latest dates of any Movie
+        in the repository, and previous_date and next_date are the dates of the Movies that immediately precede and
+        follow target_date. If target_date is None, the earliest date in the repository is used.
+
+        If there are no Movies on target_date, movies is an empty list and previous_date and next_date are None. If
+        the repository is empty, first_date and last_date are also None.
+        """
+        raise NotImplementedError
+
     @abc.abstractmethod
     def get_number_of_movies(self):
         """ Returns the number of Movies in the repository. """
         raise NotImplementedError
 
+    @abc.abstractmethod
+    def get_movie_ids(self) -> List[int]:
+        """ Returns the ids of all Movies in the repository, in ascending order. """
+        raise NotImplementedError
+
     @abc.abstractmethod
     def get_first_movie(self) -> Movie:
         """ Returns the first Movie, ordered by date, from the repository.
@@ -79,6 +105,14 @@ class AbstractRepository(abc.ABC):
         """
         raise NotImplementedError
 
+    @abc.abstractmethod
+    def get_random_movies(self, quantity: int) -> List[Movie]:
+        """ Returns up to quantity distinct Movies, chosen at random, in random order.
+
+        Fewer Movies are returned only if the repository holds fewer than quantity Movies.
+        """
+        raise NotImplementedError
+
     @abc.abstractmethod
     def get_movie_ids_for_genre(self, genre_name: str):
         """ Returns a list of ids representing Movies that are genreged by genre_name.
@@ -88,6 +122,90 @@ class AbstractRepository(abc.ABC):
         raise NotImplementedError
 
 
+    @abc.abstractmethod
+    def get_movies_sorted_by_rating(self, quantity: int, highest_first: bool = True) -> List[Movie]:
+        """ Returns up to quantity Movies ordered by rating, highest first unless highest_first is False.
+
+        Movies with equal ratings are ordered by id, in the same direction as the ratings.
+        """
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def get_movies_sorted_by_runtime(self, quantity: int, longest_first: bool = False) -> List[Movie]:
+        """ Returns up to quantity Movies ordered by runtime, shortest first unless longest_first is True.
+
+        Movies with equal runtimes are ordered by id, in the same direction as the runtimes.
+        """
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def get_top_rated_movies_for_genre(self, genre_name: str, quantity: int, decade: int = None) -> List[Movie]:
+        """ Returns up to quantity of the highest rated Movies associated with the named Genre, optionally only those
+        released in the decade starting with the year decade (e.g. 2010).
+
+        Movies with equal ratings are ordered by id, highest first, as in get_movies_sorted_by_rating. If there is
+        no such Genre, this method returns an empty list.
+        """
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def get_most_reviewed_movies(self, quantity: int, since: date = None) -> List[Movie]:
+        """ Returns up to quantity Movies with the most Reviews, counting only Reviews written on or after since if
+        it's given.
+
+        Movies with equal numbers of Reviews are ordered by id, lowest first. Movies without Reviews are left out.
+        """
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def get_faceted_movie_ids(self, movie_filter: MovieFilter):
+        """ Returns the ids of the Movies matching every facet of movie_filter, in ascending order, and the facet
+        counts of those Movies: a dictionary mapping each of 'genre', 'year', 'director' and 'rating' to a
+        dictionary from the facet's values to the number of matching Movies having them.
+
+        Ratings are counted by band, the whole number part of the rating. Values no matching Movie has are left out.
+        If no Movies match, this method returns an empty list and empty counts.
+        """
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def get_movie_ids_page(self, movie_filter: MovieFilter, limit: int, after_id: int = None,
+                           before_id: int = None) -> MovieIdPage:
+        """ Returns a MovieIdPage of up to limit ids of the Movies matching movie_filter, in ascending order.
+
+        The page holds the first ids greater than after_id, or if before_id is given instead, the last ids less than
+        before_id. With neither, it holds the first ids. Pages are found by id rather than position, so each costs
+        the same however far into the listing it is.
+        """
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def search_movies(self, query: str, limit: int, offset: int = 0) -> List[Movie]:
+        """ Returns up to limit Movies whose title, description, actors and director together contain every word of
+        query, best match first, skipping the first offset matches.
+
+        Matches are ranked with BM25, weighting the title above actors and director, and those above the description.
+        Common words such as "the" are ignored unless the query has no other words. If nothing matches, this method
+        returns an empty list.
+        """
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def get_completions(self, prefix: str, quantity: int) -> List[Completion]:
+        """ Returns completions of prefix: up to quantity titles, then directors, then actors, each having a word
+        starting with prefix.
+
+        Titles are ranked by number of votes and people by number of movies. The index behind this is built by
+        build_completion_index, or on first use, and kept up to date by add_movie.
+        """
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def build_completion_index(self):
+        """ Builds the index behind get_completions, or brings it up to date, so that the next lookup doesn't have to.
+        """
+        raise NotImplementedError
+
     @abc.abstractmethod
     def get_date_of_previous_movie(self, movie: Movie):
         """ Returns the date of an Movie that immediately precedes movie.
@@ -116,6 +234,37 @@ class AbstractRepository(abc.ABC):
         """ Returns the Genres stored in the repository. """
         raise NotImplementedError
 
+    @abc.abstractmethod
+    def get_genre_names(self) -> List[str]:
+        """ Returns the names of the Genres stored in the repository, without loading the Genres themselves. """
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def get_genres_version(self) -> int:
+        """ Returns a number that changes whenever a Genre is added, or Movies' genres are changed in place.
+
+        Anything derived from the Genres can be cached for as long as the number stays the same.
+        """
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def get_movies_version(self) -> int:
+        """ Returns a number that changes whenever Movies already stored are changed in place, as a sync does.
+
+        Adding Movies doesn't change it. Anything derived from the Movies' attributes or genres has to be rebuilt when
+        it changes.
+        """
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def get_data_version(self):
+        """ Returns (version, modified): a number that increases whenever a Movie, Genre or Review is added or changed,
+        and the UTC time, to the second, at which the repository first had that version.
+
+        Pages built from the repository's data stay the same for as long as the version does.
+        """
+        raise NotImplementedError
+
     @abc.abstractmethod
     def add_review(self, review: Review):
         """ Adds a Review to the repository.
@@ -128,6 +277,16 @@ class AbstractRepository(abc.ABC):
         if review.movie is None or review not in review.movie.reviews:
             raise RepositoryException('Review not correctly attached to an Movie')
 
+    @abc.abstractmethod
+    def get_co_reviewed_movies(self, movie_id: int, quantity: int) -> List[Movie]:
+        """ Returns up to quantity Movies most often reviewed by users who also reviewed the Movie with movie_id,
+        most often first, and equally often by id.
+
+        A user counts once per Movie however many Reviews they write. If no one who reviewed the Movie reviewed
+        anything else, or there is no such Movie, this method returns an empty list.
+        """
+        raise NotImplementedError
+
     @abc.abstractmethod
     def get_reviews(self):
         """ Returns the Reviews stored in the repository. """
@@ -0,0 +1,242 @@
+import heapq
+import math
+import re
+import unicodedata
+from typing import Dict, List, Tuple
+
+import numpy as np
+
+
+# Fields indexed for each Movie, with the weight given to a match in each field.
+FIELD_WEIGHTS = {
+    'title': 3.0,
+    'first_para': 1.0,
+    'actors': 2.0,
+    'director': 2.0
+}
+
+# Words too common to narrow a search; they are dropped from queries unless a query consists only of them.
+STOP_WORDS = frozenset([
+    'a', 'an', 'and', 'are', 'as', 'at', 'be', 'by', 'for', 'from', 'has', 'he', 'her', 'his', 'in', 'is', 'it',
+    'its', 'of', 'on', 'or', 'she', 'that', 'the', 'their', 'they', 'to', 'was', 'who', 'with'
+])
+
+TOKEN_PATTERN = re.compile(r'\w+')
+
+# BM25 parameters.
+K1 = 1.2
+B = 0.75
+
+
+def tokenize(text: str) -> List[str]:
+    # Case-fold and strip diacritics before splitting on non-word characters, as SQLite's unicode61 tokenizer does.
+    if not text:
+        return list()
+    text = text.lower()
+    if not text.isascii():
+        text = unicodedata.normalize('NFKD', text)
+        text = ''.join(character for character in text if not unicodedata.combining(character))
+    return TOKEN_PATTERN.findall(text)
+
+
+def query_terms(query: str) -> List[str]:
+    # Returns the distinct terms of a search query, in order, without stop words.
+    terms = list(dict.fromkeys(tokenize(query)))
+    significant_terms = [term for term in terms if term not in STOP_WORDS]
+    return significant_terms if len(significant_terms) > 0 else terms
+
+
+def movie_fields(movie) -> Dict[str, str]:
+    return {
+        'title': movie.title,
+        'first_para': movie.first_para,
+        'actors': movie.actors,
+        'director': movie.director
+    }
+
+
+class SearchIndex:
+    # An inverted index from terms to the documents containing them, ranked with BM25. Field matches are weighted by
+    # FIELD_WEIGHTS, which scales both a document's term frequencies and its length. A search returns the documents
+    # containing every query term.
+    #
+    # Each term's BM25 scores are computed on first use and kept, ordered best first, until the index next changes.
+    # A one-term search then reads its page straight off that order, and a search for several terms walks the orders
+    # together (Fagin's threshold algorithm), stopping once no document further down can make the page.
+    #
+    # An index can be saved as arrays of its postings (see to_arrays) and loaded back from them without re-tokenising
+    # any text. A loaded term's postings are left in the arrays until a search or change first needs them.
+
+    def __init__(self):
+        self._postings = dict()
+        self._document_terms = dict()
+        self._document_lengths = dict()
+        self._total_length = 0.0
+        self._ranked_postings = dict()
+        self._frozen_postings = dict()
+        self._frozen_arrays = None
+
+    @classmethod
+    def from_arrays(cls, terms: List[str], arrays: Dict[str, np.ndarray]) -> 'SearchIndex':
+        # Loads an index saved by to_arrays. The arrays are kept, and may be views of a memory-mapped file.
+        index = cls()
+        index._frozen_postings = dict(zip(terms, range(len(terms))))
+        index._frozen_arrays = (arrays['offsets'], arrays['documents'], arrays['frequencies'])
+        lengths = arrays['document_lengths'].tolist()
+        index._document_lengths = dict(zip(arrays['document_ids'].tolist(), lengths))
+        index._total_length = sum(lengths)
+        return index
+
+    def to_arrays(self) -> Tuple[List[str], Dict[str, np.ndarray]]:
+        # Returns the terms, and arrays of each term's documents and frequencies in the order of the terms, with the
+        # offsets of each term's postings, and the documents' lengths.
+        self._thaw()
+        terms = list(self._postings)
+        offsets = np.zeros(len(terms) + 1, dtype=np.int64)
+        np.cumsum([len(self._postings[term]) for term in terms], out=offsets[1:])
+        documents = np.fromiter(
+            (document_id for term in terms for document_id in self._postings[term]), dtype=np.int64, count=offsets[-1]
+        )
+        frequencies = np.fromiter(
+            (frequency for term in terms for frequency in self._postings[term].values()), dtype=np.float64,
+            count=offsets[-1]
+        )
+        arrays = {
+            'offsets': offsets,
+            'documents': documents,
+            'frequencies': frequencies,
+            'document_ids': np.array(list(self._document_lengths), dtype=np.int64),
+            'document_lengths': np.array(list(self._document_lengths.values()), dtype=np.float64)
+        }
+        return terms, arrays
+
+    @property
+    def number_of_documents(self) -> int:
+        return len(self._document_lengths)
+
+    def add_document(self, document_id, fields: Dict[str, str]):
+        if document_id in self._document_lengths:
+            self.remove_document(document_id)
+
+        frequencies = dict()
+        length = 0.0
+        for field, text in fields.items():
+            weight = FIELD_WEIGHTS.get(field, 1.0)
+            for term in tokenize(text):
+                frequencies[term] = frequencies.get(term, 0.0) + weight
+                length += weight
+
+        for term, frequency in frequencies.items():
+            postings = self._postings_for(term)
+            if postings is None:
+                postings = self._postings[term] = dict()
+            postings[document_id] = frequency
+        self._document_terms[document_id] = list(frequencies)
+        self._document_lengths[document_id] = length
+        self._total_length += length
+
+        # Document frequencies and the average length have changed, so every cached score is stale.
+        self._ranked_postings.clear()
+
+    def remove_document(self, document_id):
+        length = self._document_lengths.pop(document_id, None)
+        if length is None:
+            return
+
+        self._total_length -= length
+        terms = self._document_terms.pop(document_id, None)
+        if terms is None:
+            # The document was loaded from arrays, which don't record each document's terms.
+            self._thaw()
+            terms = [term for term, postings in self._postings.items() if document_id in postings]
+        for term in terms:
+            postings = self._postings[term]
+            del postings[document_id]
+            if len(postings) == 0:
+                del self._postings[term]
+        self._ranked_postings.clear()
+
+    def search(self, query: str, limit: int, offset: int = 0) -> List:
+        # Returns ids of the matching documents, best first; equal scores are ordered by id.
+        terms = query_terms(query)
+        if len(terms) == 0 or limit <= 0:
+            return list()
+
+        ranked_postings = list()
+        for term in terms:
+            if self._postings_for(term) is None:
+                return list()
+            ranked_postings.append(self._ranked_postings_for(term))
+
+        if len(ranked_postings) == 1:
+            return ranked_postings[0][1][offset:offset + limit]
+
+        return self._search_all_terms(ranked_postings, offset + limit)[offset:]
+
+    def _postings_for(self, term: str):
+        # Returns the term's frequencies by document, or None if no document contains it, first unpacking them from
+        # the arrays the index was loaded from if need be.
+        postings = self._postings.get(term)
+        if postings is None:
+            position = self._frozen_postings.get(term)
+            if position is not None:
+                offsets, documents, frequencies = self._frozen_arrays
+                start, end = int(offsets[position]), int(offsets[position + 1])
+                unpacked = dict(zip(documents[start:end].tolist(), frequencies[start:end].tolist()))
+                # Threads searching for the term at once each unpack it, but all use whichever is stored first.
+                postings = self._postings.setdefault(term, unpacked)
+                self._frozen_postings.pop(term, None)
+        return postings
+
+    def _thaw(self):
+        # Unpacks the postings of every term still held in arrays.
+        for term in list(self._frozen_postings):
+            self._postings_for(term)
+
+    def _ranked_postings_for(self, term: str):
+        # Returns the term's scores by document, and its documents ordered by descending score then id.
+        ranked_postings = self._ranked_postings.get(term)
+        if ranked_postings is None:
+            postings = self._postings[term]
+            number_of_documents = len(self._document_lengths)
+            average_length = self._total_length / number_of_documents
+            idf = math.log(1 + (number_of_documents - len(postings) + 0.5) / (len(postings) + 0.5))
+            lengths = self._document_lengths
+
+            scores = dict()
+            for document_id, frequency in postings.items():
+                normaliser = K1 * (1 - B + B * lengths[document_id] / average_length)
+                scores[document_id] = idf * frequency * (K1 + 1) / (frequency + normaliser)
+
+            ranked_postings = (scores, sorted(scores, key=lambda document_id: (-scores[document_id], document_id)))
+            self._ranked_postings[term] = ranked_postings
+        return ranked_postings
+
+    @staticmethod
+    def _search_all_terms(ranked_postings, quantity: int) -> List:
+        # Keeps the best documents found so far in a min-heap keyed (score, -id). A document not yet seen in any
+        # list scores at most the sum of the scores at the current depth, so the walk ends once the worst kept
+        # document beats that sum, or once the shortest list runs out, as every match appears in every list.
+        best = list()
+        seen = set()
+        all_scores = [scores for scores, _ in ranked_postings]
+        depth = 0
+        while all(depth < len(ordered) for _, ordered in ranked_postings):
+            threshold = 0.0
+            for scores, ordered in ranked_postings:
+                document_id = ordered[depth]
+                threshold += scores[document_id]
+                if document_id in seen:
+                    continue
+                seen.add(document_id)
+                if all(document_id in other_scores for other_scores in all_scores):
+                    entry = (sum(other_scores[document_id] for other_scores in all_scores), -document_id)
+                    if len(best) < quantity:
+                        heapq.heappush(best, entry)
+                    elif entry > best[0]:
+                        heapq.heapreplace(best, entry)
+            if len(best) == quantity and best[0][0] > threshold:
+                break
+            depth += 1
+
+        return [-negative_id for _, negative_id in sorted(best, reverse=True)]
@@ -0,0 +1,131 @@
+import hashlib
+import json
+import os
+import struct
+from typing import Dict, Iterable, List, Optional
+
+import numpy as np
+
+
+# A snapshot is a binary file of named arrays, tagged with a digest of the files its contents were loaded from:
+#
+#   MAGIC | format version and header length (two little-endian uint32s) | JSON header | arrays
+#
+# The header records the digest and each array's dtype, shape and offset. Arrays start on ALIGNMENT-byte boundaries,
+# so a reader maps the file and views each array in place rather than reading and copying it. Lists of strings are
+# stored as two arrays: the UTF-8 encoding of the joined strings, and the offsets of each string in characters.
+#
+# A snapshot written by another FORMAT_VERSION, or from files with another digest, is ignored, so changing the layout
+# or the source files just causes the next load to rebuild it.
+
+MAGIC = b'MOVSNAP\x00'
+FORMAT_VERSION = 1
+ALIGNMENT = 64
+
+_PREAMBLE = struct.Struct('<II')
+
+
+def source_digest(filenames: Iterable[str]) -> str:
+    # Returns the SHA-256 of the names and contents of the files, in order.
+    digest = hashlib.sha256()
+    for filename in filenames:
+        digest.update(os.path.basename(filename).encode('utf-8') + b'\x00')
+        with open(filename, 'rb') as infile:
+            for block in iter(lambda: infile.read(1 << 20), b''):
+                digest.update(block)
+    return digest.hexdigest()
+
+
+def encode_strings(strings: Iterable[str]) -> Dict[str, np.ndarray]:
+    strings = list(strings)
+    offsets = np.zeros(len(strings) + 1, dtype=np.int64)
+    np.cumsum([len(string) for string in strings], out=offsets[1:])
+    text = np.frombuffer(''.join(strings).encode('utf-8'), dtype=np.uint8)
+    return {'text': text, 'offsets': offsets}
+
+
+class Snapshot:
+    # The arrays of a snapshot file, viewed in place in a read-only mapping of it.
+
+    def __init__(self, buffer, sections: Dict[str, dict]):
+        self._buffer = buffer
+        self._sections = sections
+
+    def __contains__(self, name: str) -> bool:
+        return name in self._sections
+
+    def array(self, name: str) -> np.ndarray:
+        section = self._sections[name]
+        dtype = np.dtype(section['dtype'])
+        count = int(np.prod(section['shape'], dtype=np.int64))
+        if count == 0:
+            # An empty array's offset may lie past the end of the file.
+            return np.empty(section['shape'], dtype=dtype)
+        array = np.frombuffer(self._buffer, dtype=dtype, count=count, offset=section['offset'])
+        return array.reshape(section['shape'])
+
+    def strings(self, name: str) -> List[str]:
+        # Decoding the text once and slicing it is much faster than decoding each string.
+        text = self.array(name + '.text').tobytes().decode('utf-8')
+        offsets = self.array(name + '.offsets').tolist()
+        return [text[start:end] for start, end in zip(offsets, offsets[1:])]
+
+
+def write_snapshot(path: str, digest: str, arrays: Dict[str, np.ndarray], strings: Dict[str, Iterable[str]] = None):
+    # Writes to a temporary file that then replaces any snapshot at path, so a reader never sees a partial snapshot.
+    arrays = {name: np.ascontiguousarray(array) for name, array in arrays.items()}
+    for name, values in (strings or dict()).items():
+        for part, array in encode_strings(values).items():
+            arrays[f'{name}.{part}'] = array
+
+    sections = dict()
+    offset = 0
+    for name, array in arrays.items():
+        sections[name] = {'dtype': array.dtype.str, 'shape': list(array.shape), 'offset': offset}
+        offset = _aligned(offset + array.nbytes)
+
+    # Arrays follow the header, whose size depends on their offsets, so move them along until the header fits.
+    start = 0
+    while True:
+        header = json.dumps({
+            'digest': digest,
+            'sections': {name: dict(section, offset=section['offset'] + start) for name, section in sections.items()}
+        }).encode('utf-8')
+        end_of_header = _aligned(len(MAGIC) + _PREAMBLE.size + len(header))
+        if end_of_header <= start:
+            break
+        start = end_of_header
+    for section in sections.values():
+        section['offset'] += start
+
+    temporary_path = f'{path}.{os.getpid()}.tmp'
+    with open(temporary_path, 'wb') as outfile:
+        outfile.write(MAGIC)
+        outfile.write(_PREAMBLE.pack(FORMAT_VERSION, len(header)))
+        outfile.write(header)
+        for name, array in arrays.items():
+            outfile.write(b'\x00' * (sections[name]['offset'] - outfile.tell()))
+            outfile.write(array.tobytes())
+    os.replace(temporary_path, path)
+
+
+def read_snapshot(path: str, digest: str) -> Optional[Snapshot]:
+    # Returns the snapshot at path, or None if there isn't one, or it's of another format or digest.
+    try:
+        with open(path, 'rb') as infile:
+            if infile.read(len(MAGIC)) != MAGIC:
+                return None
+            version, header_length = _PREAMBLE.unpack(infile.read(_PREAMBLE.size))
+            if version != FORMAT_VERSION:
+                return None
+            header = json.loads(infile.read(header_length).decode('utf-8'))
+    except (OSError, struct.error, ValueError):
+        return None
+
+    if header.get('digest') != digest:
+        return None
+    return Snapshot(np.memmap(path, dtype=np.uint8, mode='r'), header['sections'])
+
+
+def _aligned(offset: int) -> int:
+    return -(-offset // ALIGNMENT) * ALIGNMENT
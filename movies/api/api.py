@@ -0,0 +1,140 @@
+from flask import Blueprint, request, url_for, current_app
+
+import orjson
+
+import movies.adapters.repository as repo
+import movies.news.services as services
+import movies.utilities.services as utilities_services
+from movies.adapters.facet_index import MovieFilter
+
+
+# Configure Blueprint. Breaking changes to the responses belong under a new prefix, leaving /api/v1 as it is.
+api_blueprint = Blueprint(
+    'api_bp', __name__, url_prefix='/api/v1')
+
+# Number of movies in a page, unless the client asks for another number up to MAX_PAGE_SIZE.
+DEFAULT_PAGE_SIZE = 20
+MAX_PAGE_SIZE = 100
+
+
+class InvalidRequestException(Exception):
+    pass
+
+
+@api_blueprint.route('/movies', methods=['GET'])
+def movies():
+    # Movies in order of id, optionally filtered by the facets /movies_by_genre takes. Pages follow the id after, or
+    # precede the id before, as in /movies_by_genre.
+    movie_filter = MovieFilter(
+        genres=tuple(request.args.getlist('genre')),
+        first_year=request.args.get('first_year', type=int),
+        last_year=request.args.get('last_year', type=int),
+        director=request.args.get('director'),
+        rating=request.args.get('rating', type=int)
+    )
+    after_id = request.args.get('after', type=int)
+    before_id = request.args.get('before', type=int)
+    limit = get_page_size()
+    fields = get_fields()
+
+    page = services.get_movie_ids_page(movie_filter, limit, after_id, before_id, repo.repo_instance)
+    movies = services.get_movies_by_id(page.movie_ids, repo.repo_instance, fields)
+
+    # Query parameters selecting the current filter and fields, for building the cursor URLs.
+    args = {key: value for key, value in request.args.items(multi=False) if key not in ('after', 'before')}
+    args['genre'] = list(movie_filter.genres)
+
+    next_url = None
+    previous_url = None
+    if page.has_next and len(page.movie_ids) > 0:
+        next_url = url_for('api_bp.movies', **args, after=page.movie_ids[-1])
+    if page.has_previous and len(page.movie_ids) > 0:
+        previous_url = url_for('api_bp.movies', **args, before=page.movie_ids[0])
+
+    return json_response({'movies': movies, 'total': page.total, 'next': next_url, 'previous': previous_url})
+
+
+@api_blueprint.route('/movies/<int:movie_id>', methods=['GET'])
+def movie(movie_id):
+    try:
+        movie = services.get_movie(movie_id, repo.repo_instance, get_fields())
+    except services.NonExistentMovieException:
+        return json_error('No movie with id ' + str(movie_id), 404)
+
+    return json_response(movie)
+
+
+@api_blueprint.route('/movies/<int:movie_id>/reviews', methods=['GET'])
+def reviews(movie_id):
+    try:
+        reviews = services.get_reviews_for_movie(movie_id, repo.repo_instance)
+    except services.NonExistentMovieException:
+        return json_error('No movie with id ' + str(movie_id), 404)
+
+    return json_response({'reviews': reviews})
+
+
+@api_blueprint.route('/genres', methods=['GET'])
+def genres():
+    # Every genre with its number of movies, counted as the facets of an unfiltered listing are.
+    genre_counts = dict(services.get_faceted_movies(MovieFilter(), repo.repo_instance)[1]['genre'])
+    genres = [
+        {
+            'name': genre_name,
+            'number_of_movies': genre_counts.get(genre_name, 0),
+            'movies': url_for('api_bp.movies', genre=genre_name)
+        }
+        for genre_name in utilities_services.get_genre_names(repo.repo_instance)
+    ]
+
+    return json_response({'genres': genres})
+
+
+@api_blueprint.route('/search', methods=['GET'])
+def search():
+    # Search results are ranked rather than ordered by id, so their cursor is the number of results already seen.
+    query = request.args.get('q', '').strip()
+    cursor = max(0, request.args.get('cursor', 0, type=int))
+    limit = get_page_size()
+
+    # Retrieve one movie more than a page holds, to learn whether there is a next page without counting every match.
+    movies = services.search_movies(query, limit + 1, cursor, repo.repo_instance, get_fields())
+
+    next_url = None
+    if len(movies) > limit:
+        args = {key: value for key, value in request.args.items(multi=False) if key != 'cursor'}
+        next_url = url_for('api_bp.search', **args, cursor=cursor + limit)
+
+    return json_response({'movies': movies[:limit], 'next': next_url})
+
+
+@api_blueprint.errorhandler(InvalidRequestException)
+def invalid_request(exception):
+    return json_error(str(exception), 400)
+
+
+def get_page_size() -> int:
+    limit = request.args.get('limit', DEFAULT_PAGE_SIZE, type=int)
+    return max(1, min(limit, MAX_PAGE_SIZE))
+
+
+def get_fields():
+    # Reads the comma separated movie fields to return, e.g. ?fields=id,title. Without it, every field is returned.
+    fields = request.args.get('fields')
+    if fields is None:
+        return None
+
+    fields = [field.strip() for field in fields.split(',') if field.strip() != '']
+    unknown_fields = [field for field in fields if field not in services.MOVIE_FIELDS]
+    if len(unknown_fields) > 0:
+        raise InvalidRequestException('Unknown fields: ' + ', '.join(unknown_fields))
+    return fields
+
+
+def json_response(payload, status: int = 200):
+    # orjson writes dates and datetimes in ISO 8601 format, and is several times faster than the json module.
+    return current_app.response_class(orjson.dumps(payload), status=status, mimetype='application/json')
+
+
+def json_error(message: str, status: int):
+    return json_response({'error': message}, status)
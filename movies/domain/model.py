@@ -67,7 +67,8 @@ class Review:
 
 class Movie:
     def __init__(
-            self, date: date, title: str, first_para: str, hyperlink: str, image_hyperlink: str, rank: int, actors, time: int, director: str, rating: int, id: int = None,
+            self, date: date, title: str, first_para: str, hyperlink: str, image_hyperlink: str, rank: int, actors, time: int, director: str, rating: float, id: int = None,
+            votes: int = None, revenue: float = None, metascore: int = None
     ):
         self._id: int = id
         self._date: date = date
@@ -85,6 +86,10 @@ class Movie:
 
         self._rank = rank
 
+        self._votes = votes
+        self._revenue = revenue
+        self._metascore = metascore
+
     @property
     def id(self) -> int:
         return self._id
@@ -109,6 +114,18 @@ class Movie:
     def rank(self) -> int:
         return self._rank
 
+    @property
+    def votes(self) -> int:
+        return self._votes
+
+    @property
+    def revenue(self) -> float:
+        return self._revenue
+
+    @property
+    def metascore(self) -> int:
+        return self._metascore
+
     @property
     def date(self) -> date:
         return self._date
@@ -1,7 +1,7 @@
-from datetime import date
+from datetime import date, timedelta
 
 from flask import Blueprint
-from flask import request, render_template, redirect, url_for, session
+from flask import request, render_template, redirect, url_for, session, jsonify, current_app
 
 from better_profanity import profanity
 from flask_wtf import FlaskForm
@@ -12,7 +12,9 @@ import movies.adapters.repository as repo
 import movies.utilities.utilities as utilities
 import movies.news.services as services
 
+from movies.adapters.facet_index import MovieFilter
 from movies.authentication.authentication import login_required
+from movies.news.recommender import MovieRecommender
 
 
 # Configure Blueprint.
@@ -21,19 +23,13 @@ news_blueprint = Blueprint(
 
 
 @news_blueprint.route('/movies_by_date', methods=['GET'])
+@utilities.conditional_get
 def movies_by_date():
     # Read query parameters.
     target_date = request.args.get('date')
     movie_to_show_reviews = request.args.get('view_reviews_for')
 
-    # Fetch the first and last movies in the series.
-    first_movie = services.get_first_movie(repo.repo_instance)
-    last_movie = services.get_last_movie(repo.repo_instance)
-
-    if target_date is None:
-        # No date query parameter, so return movies from day 1 of the series.
-        target_date = first_movie['date']
-    else:
+    if target_date is not None:
         # Convert target_date from string to date.
         target_date = date.fromisoformat(target_date)
 
@@ -44,9 +40,13 @@ def movies_by_date():
         # Convert movie_to_show_reviews from string to int.
         movie_to_show_reviews = int(movie_to_show_reviews)
 
-    # Fetch movie(s) for the target date. This call also returns the previous and next dates for movies immediately
-    # before and after the target date.
-    movies, previous_date, next_date = services.get_movies_by_date(target_date, repo.repo_instance)
+    # Fetch movie(s) for the target date, together with the dates of the first and last movies in the series and the
+    # previous and next dates for movies immediately before and after the target date. With no date query parameter,
+    # movies from day 1 of the series are returned.
+    movies, first_date, previous_date, next_date, last_date = services.get_date_page(target_date, repo.repo_instance)
+
+    if target_date is None:
+        target_date = first_date
 
     first_movie_url = None
     last_movie_url = None
@@ -58,12 +58,12 @@ def movies_by_date():
         if previous_date is not None:
             # There are movies on a previous date, so generate URLs for the 'previous' and 'first' navigation buttons.
             prev_movie_url = url_for('news_bp.movies_by_date', date=previous_date.isoformat())
-            first_movie_url = url_for('news_bp.movies_by_date', date=first_movie['date'].isoformat())
+            first_movie_url = url_for('news_bp.movies_by_date', date=first_date.isoformat())
 
         # There are movies on a subsequent date, so generate URLs for the 'next' and 'last' navigation buttons.
         if next_date is not None:
             next_movie_url = url_for('news_bp.movies_by_date', date=next_date.isoformat())
-            last_movie_url = url_for('news_bp.movies_by_date', date=last_movie['date'].isoformat())
+            last_movie_url = url_for('news_bp.movies_by_date', date=last_date.isoformat())
 
         # Construct urls for viewing movie reviews and adding reviews.
         for movie in movies:
@@ -76,7 +76,7 @@ def movies_by_date():
             title='Movies',
             movies_title='Movies made in ' + target_date.strftime('%Y'),
             movies=movies,
-            selected_movies=utilities.get_selected_movies(len(movies) * 2),
+            selected_movies=utilities.get_selected_movies(),
             genre_urls=utilities.get_genres_and_urls(),
             first_movie_url=first_movie_url,
             last_movie_url=last_movie_url,
@@ -90,11 +90,182 @@ def movies_by_date():
 
 
 @news_blueprint.route('/movies_by_genre', methods=['GET'])
+@utilities.conditional_get
 def movies_by_genre():
     movies_per_page = 5
 
+    # Read query parameters. Any number of genres can be combined with a year range, a director and a rating band.
+    movie_filter = MovieFilter(
+        genres=tuple(request.args.getlist('genre')),
+        first_year=request.args.get('first_year', type=int),
+        last_year=request.args.get('last_year', type=int),
+        director=request.args.get('director'),
+        rating=request.args.get('rating', type=int)
+    )
+    # The page starts after the movie id after, or ends before the movie id before. With neither, it's the first page.
+    after_id = request.args.get('after', type=int)
+    before_id = request.args.get('before', type=int)
+    movie_to_show_reviews = request.args.get('view_reviews_for')
+
+    if movie_to_show_reviews is None:
+        # No view-reviews query parameter, so set to a non-existent movie id.
+        movie_to_show_reviews = -1
+    else:
+        # Convert movie_to_show_reviews from string to int.
+        movie_to_show_reviews = int(movie_to_show_reviews)
+
+    # Retrieve the ids of the page of movies matching every facet, found by id rather than by position.
+    page = services.get_movie_ids_page(movie_filter, movies_per_page, after_id, before_id, repo.repo_instance)
+
+    # Retrieve the facet counts of all the matching movies.
+    facets = services.get_faceted_movies(movie_filter, repo.repo_instance)[1]
+
+    # Retrieve the batch of movies to display on the Web page.
+    movies = services.get_movies_by_id(page.movie_ids, repo.repo_instance)
+
+    # Query parameters selecting the current filter, for building URLs.
+    filter_args = {key: value for key, value in movie_filter._asdict().items() if key != 'genres'}
+    filter_args['genre'] = list(movie_filter.genres)
+
+    first_movie_url = None
+    next_movie_url = None
+    prev_movie_url = None
+
+    if page.has_previous and len(page.movie_ids) > 0:
+        # There are preceding movies, so generate URLs for the 'previous' and 'first' navigation buttons.
+        prev_movie_url = url_for('news_bp.movies_by_genre', **filter_args, before=page.movie_ids[0])
+        first_movie_url = url_for('news_bp.movies_by_genre', **filter_args)
+
+    if page.has_next and len(page.movie_ids) > 0:
+        # There are further movies, so generate a URL for the 'next' navigation button. Going straight to the last
+        # page would mean counting back from the end, so there's no 'last' button.
+        next_movie_url = url_for('news_bp.movies_by_genre', **filter_args, after=page.movie_ids[-1])
+
+    # Construct urls for viewing movie reviews and adding reviews.
+    for movie in movies:
+        movie['view_review_url'] = url_for(
+            'news_bp.movies_by_genre', **filter_args, after=after_id, before=before_id, view_reviews_for=movie['id']
+        )
+        movie['add_review_url'] = url_for('news_bp.review_on_movie', movie=movie['id'])
+
+    # Construct urls that narrow the filter by each facet value, or widen it again by dropping a selected value.
+    facet_links = {'Genres': [], 'Years': [], 'Directors': [], 'Ratings': []}
+    for genre_name, count in facets['genre']:
+        selected = genre_name in movie_filter.genres
+        if selected:
+            genres = [name for name in movie_filter.genres if name != genre_name]
+        else:
+            genres = list(movie_filter.genres) + [genre_name]
+        facet_links['Genres'].append((genre_name, count, selected, url_for(
+            'news_bp.movies_by_genre', **{**filter_args, 'genre': genres}
+        )))
+    single_year = movie_filter.first_year is not None and movie_filter.first_year == movie_filter.last_year
+    for year, count in facets['year']:
+        selected = single_year and year == movie_filter.first_year
+        year_args = {'first_year': None, 'last_year': None} if selected else {'first_year': year, 'last_year': year}
+        facet_links['Years'].append((str(year), count, selected, url_for(
+            'news_bp.movies_by_genre', **{**filter_args, **year_args}
+        )))
+    for director, count in facets['director'][:10]:
+        selected = director == movie_filter.director
+        facet_links['Directors'].append((director, count, selected, url_for(
+            'news_bp.movies_by_genre', **{**filter_args, 'director': None if selected else director}
+        )))
+    for band, count in facets['rating']:
+        selected = band == movie_filter.rating
+        facet_links['Ratings'].append((str(band) + '+', count, selected, url_for(
+            'news_bp.movies_by_genre', **{**filter_args, 'rating': None if selected else band}
+        )))
+
+    # Describe the filter, e.g. 'Movies by Action and Sci-Fi from 2010 to 2012'.
+    description = ['Movies']
+    if len(movie_filter.genres) > 0:
+        description.append('by ' + ' and '.join(movie_filter.genres))
+    if single_year:
+        description.append('in ' + str(movie_filter.first_year))
+    elif movie_filter.first_year is not None and movie_filter.last_year is not None:
+        description.append('from ' + str(movie_filter.first_year) + ' to ' + str(movie_filter.last_year))
+    elif movie_filter.first_year is not None:
+        description.append('from ' + str(movie_filter.first_year))
+    elif movie_filter.last_year is not None:
+        description.append('up to ' + str(movie_filter.last_year))
+    if movie_filter.director is not None:
+        description.append('directed by ' + movie_filter.director)
+    if movie_filter.rating is not None:
+        description.append('rated ' + str(movie_filter.rating) + ' to ' + str(movie_filter.rating + 1))
+
+    # Generate the webpage to display the movies.
+    return render_template(
+        'news/movies.html',
+        title='Movies',
+        movies_title=' '.join(description),
+        movies=movies,
+        selected_movies=utilities.get_selected_movies(),
+        genre_urls=utilities.get_genres_and_urls(),
+        first_movie_url=first_movie_url,
+        last_movie_url=None,
+        prev_movie_url=prev_movie_url,
+        next_movie_url=next_movie_url,
+        show_reviews_for_movie=movie_to_show_reviews,
+        facet_links=facet_links
+    )
+
+
+@news_blueprint.route('/leaderboards', methods=['GET'])
+def leaderboards():
     # Read query parameters.
     genre_name = request.args.get('genre')
+    quantity = request.args.get('n', 10, type=int)
+    quantity = max(1, min(quantity, 50))
+
+    # Each leaderboard is a (heading, movies) pair, and is ranked by the repository from its indexes.
+    boards = list()
+    if genre_name is None:
+        boards.append(('Top Rated', services.get_top_rated_movies(quantity, repo.repo_instance)))
+        week_ago = date.today() - timedelta(days=7)
+        boards.append((
+            'Most Reviewed This Week', services.get_most_reviewed_movies(quantity, week_ago, repo.repo_instance)
+        ))
+        boards.append(('Most Reviewed', services.get_most_reviewed_movies(quantity, None, repo.repo_instance)))
+        boards.append(('Longest', services.get_longest_movies(quantity, repo.repo_instance)))
+    else:
+        boards.append((
+            'Best ' + genre_name,
+            services.get_top_rated_movies_for_genre(genre_name, quantity, None, repo.repo_instance)
+        ))
+        # The date page gives the earliest and latest dates on either repository; the first and last movies are
+        # ordered by id in the database.
+        _, first_date, _, _, last_date = services.get_date_page(None, repo.repo_instance)
+        decades = range(last_date.year // 10 * 10, first_date.year // 10 * 10 - 1, -10) if first_date else range(0)
+        for decade in decades:
+            boards.append((
+                'Best ' + genre_name + ' of the ' + str(decade) + 's',
+                services.get_top_rated_movies_for_genre(genre_name, quantity, decade, repo.repo_instance)
+            ))
+
+    for heading, movies in boards:
+        for movie in movies:
+            movie['add_review_url'] = url_for('news_bp.review_on_movie', movie=movie['id'])
+
+    genre_urls = utilities.get_genres_and_urls()
+    leaderboard_urls = {name: url_for('news_bp.leaderboards', genre=name) for name in genre_urls}
+
+    return render_template(
+        'news/leaderboards.html',
+        title='Leaderboards',
+        boards=[(heading, movies) for heading, movies in boards if len(movies) > 0],
+        leaderboard_urls=leaderboard_urls,
+        selected_movies=utilities.get_selected_movies(),
+        genre_urls=genre_urls
+    )
+
+
+@news_blueprint.route('/search', methods=['GET'])
+def search():
+    movies_per_page = 5
+
+    # Read query parameters.
+    query = request.args.get('q', '').strip()
     cursor = request.args.get('cursor')
     movie_to_show_reviews = request.args.get('view_reviews_for')
 
@@ -110,54 +281,68 @@ def movies_by_genre():
         cursor = 0
     else:
         # Convert cursor from string to int.
-        cursor = int(cursor)
+        cursor = max(0, int(cursor))
 
-    # Retrieve movie ids for movies that are genreged with genre_name.
-    movie_ids = services.get_movie_ids_for_genre(genre_name, repo.repo_instance)
-
-    # Retrieve the batch of movies to display on the Web page.
-    movies = services.get_movies_by_id(movie_ids[cursor:cursor + movies_per_page], repo.repo_instance)
+    # Retrieve one movie more than a page holds, to learn whether there is a next page without counting every match.
+    movies = services.search_movies(query, movies_per_page + 1, cursor, repo.repo_instance)
+    has_next_page = len(movies) > movies_per_page
+    movies = movies[:movies_per_page]
 
     first_movie_url = None
-    last_movie_url = None
     next_movie_url = None
     prev_movie_url = None
 
     if cursor > 0:
         # There are preceding movies, so generate URLs for the 'previous' and 'first' navigation buttons.
-        prev_movie_url = url_for('news_bp.movies_by_genre', genre=genre_name, cursor=cursor - movies_per_page)
-        first_movie_url = url_for('news_bp.movies_by_genre', genre=genre_name)
+        prev_movie_url = url_for('news_bp.search', q=query, cursor=max(0, cursor - movies_per_page))
+        first_movie_url = url_for('news_bp.search', q=query)
 
-    if cursor + movies_per_page < len(movie_ids):
-        # There are further movies, so generate URLs for the 'next' and 'last' navigation buttons.
-        next_movie_url = url_for('news_bp.movies_by_genre', genre=genre_name, cursor=cursor + movies_per_page)
-
-        last_cursor = movies_per_page * int(len(movie_ids) / movies_per_page)
-        if len(movie_ids) % movies_per_page == 0:
-            last_cursor -= movies_per_page
-        last_movie_url = url_for('news_bp.movies_by_genre', genre=genre_name, cursor=last_cursor)
+    if has_next_page:
+        # There are further movies, so generate a URL for the 'next' navigation button. Finding the last page would
+        # mean ranking every match, so there's no 'last' button.
+        next_movie_url = url_for('news_bp.search', q=query, cursor=cursor + movies_per_page)
 
     # Construct urls for viewing movie reviews and adding reviews.
     for movie in movies:
-        movie['view_review_url'] = url_for('news_bp.movies_by_genre', genre=genre_name, cursor=cursor, view_reviews_for=movie['id'])
+        movie['view_review_url'] = url_for('news_bp.search', q=query, cursor=cursor, view_reviews_for=movie['id'])
         movie['add_review_url'] = url_for('news_bp.review_on_movie', movie=movie['id'])
 
+    if len(movies) > 0:
+        movies_title = 'Movies matching "' + query + '"'
+    else:
+        movies_title = 'No movies match "' + query + '"'
+
     # Generate the webpage to display the movies.
     return render_template(
         'news/movies.html',
-        title='Movies',
-        movies_title='Movies by ' + genre_name,
+        title='Search',
+        movies_title=movies_title,
         movies=movies,
-        selected_movies=utilities.get_selected_movies(len(movies) * 2),
+        selected_movies=utilities.get_selected_movies(),
         genre_urls=utilities.get_genres_and_urls(),
         first_movie_url=first_movie_url,
-        last_movie_url=last_movie_url,
+        last_movie_url=None,
         prev_movie_url=prev_movie_url,
         next_movie_url=next_movie_url,
         show_reviews_for_movie=movie_to_show_reviews
     )
 
 
+@news_blueprint.route('/autocomplete', methods=['GET'])
+def autocomplete():
+    # Typeahead for the search box: returns JSON listing up to n titles, directors and actors for the prefix q.
+    prefix = request.args.get('q', '')
+    quantity = request.args.get('n', 5, type=int)
+    quantity = max(1, min(quantity, 20))
+
+    completions = services.get_completions(prefix, quantity, repo.repo_instance)
+    for kind in completions:
+        for completion in completions[kind]:
+            completion['url'] = url_for('news_bp.search', q=completion['text'])
+
+    return jsonify(completions)
+
+
 @news_blueprint.route('/review', methods=['GET', 'POST'])
 @login_required
 def review_on_movie():
@@ -199,10 +384,17 @@ def review_on_movie():
     # For a GET or an unsuccessful POST, retrieve the movie to review in dict form, and return a Web page that allows
     # the user to enter a review. The generated Web page includes a form object.
     movie = services.get_movie(movie_id, repo.repo_instance)
+    similar_movies = services.get_similar_movies(movie_id, 5, get_recommender())
+    co_reviewed_movies = services.get_co_reviewed_movies(movie_id, 5, repo.repo_instance)
+    for other_movie in similar_movies + co_reviewed_movies:
+        other_movie['add_review_url'] = url_for('news_bp.review_on_movie', movie=other_movie['id'])
+
     return render_template(
         'news/review_on_movie.html',
         title='Edit movie',
         movie=movie,
+        similar_movies=similar_movies,
+        co_reviewed_movies=co_reviewed_movies,
         form=form,
         handler_url=url_for('news_bp.review_on_movie'),
         selected_movies=utilities.get_selected_movies(),
@@ -210,6 +402,17 @@ def review_on_movie():
     )
 
 
+def get_recommender():
+    # The recommender's matrix is built once per application, at start-up (see create_app), and replaced only if
+    # the repository is.
+    recommender = current_app.extensions.get('movie_recommender')
+    if recommender is None or recommender.repo is not repo.repo_instance:
+        recommender = MovieRecommender(repo.repo_instance)
+        recommender.refresh()
+        current_app.extensions['movie_recommender'] = recommender
+    return recommender
+
+
 class ProfanityFree:
     def __init__(self, message=None):
         if not message:
@@ -0,0 +1,171 @@
+import threading
+from typing import Dict, Iterable, List
+
+import numpy as np
+from scipy import sparse
+
+from movies.adapters.completion_index import split_people
+from movies.adapters.repository import AbstractRepository
+from movies.domain.model import Movie
+
+
+# Weight of each kind of feature before a movie's vector is scaled to unit length. Sharing a director says more about
+# two movies than sharing one of their actors.
+FEATURE_WEIGHTS = {
+    'genre': 1.0,
+    'director': 1.5,
+    'actor': 1.0
+}
+
+
+def movie_features(movie: Movie) -> Dict[tuple, float]:
+    features = dict()
+    for genre in movie.genres:
+        features[('genre', genre.genre_name)] = FEATURE_WEIGHTS['genre']
+    if movie.director:
+        features[('director', movie.director.strip())] = FEATURE_WEIGHTS['director']
+    for actor in split_people(movie.actors):
+        features[('actor', actor)] = FEATURE_WEIGHTS['actor']
+    return features
+
+
+class MovieRecommender:
+    # Finds similar movies by the cosine similarity of their genres, director and actors. Each movie is a row of a
+    # sparse matrix with one column per genre, director and actor, and rows are scaled to unit length, so the cosine
+    # similarities of some movies to every other movie are one sparse matrix product.
+    #
+    # The matrix is built by the first refresh(), and later calls keep it in step with the repository: movies the
+    # matrix hasn't seen are encoded and appended as new rows, movies in newly added Genres are re-encoded, and every
+    # movie is re-encoded when the repository's Movies version says movies were changed in place. Other genre
+    # associations made to existing Genres aren't visible through the repository's interface, so whoever makes them
+    # should pass the movies to update_movies().
+
+    def __init__(self, repo: AbstractRepository):
+        self.repo = repo
+        self._movie_ids = list()
+        self._row_of = dict()
+        self._rows = list()
+        self._columns = dict()
+        self._matrix = sparse.csr_matrix((0, 0))
+        self._matrix_ids = np.array([], dtype=np.int64)
+        self._pending_rows = 0
+        self._rebuild = False
+        self._number_of_movies = 0
+        self._genre_names = set()
+        self._genres_version = None
+        self._movies_version = None
+        self._lock = threading.Lock()
+
+    @property
+    def number_of_movies(self) -> int:
+        return len(self._movie_ids)
+
+    def refresh(self):
+        # Cheap when nothing has changed: the Movies version, a count of movies and the Genres version.
+        repo = self.repo
+        movies_version = repo.get_movies_version()
+        if self._movies_version is not None and movies_version != self._movies_version:
+            # Movies were changed in place, as a sync does, so every movie is encoded again.
+            self.update_movies(repo.get_movies_by_id(repo.get_movie_ids()))
+            self._number_of_movies = len(self._movie_ids)
+            self._genre_names = set(repo.get_genre_names())
+            self._genres_version = repo.get_genres_version()
+        self._movies_version = movies_version
+
+        number_of_movies = repo.get_number_of_movies()
+        if number_of_movies != self._number_of_movies:
+            new_ids = [id for id in repo.get_movie_ids() if id not in self._row_of]
+            self.update_movies(repo.get_movies_by_id(new_ids))
+            self._number_of_movies = number_of_movies
+
+        genres_version = repo.get_genres_version()
+        if genres_version != self._genres_version:
+            new_genre_names = [name for name in repo.get_genre_names() if name not in self._genre_names]
+            if self._genres_version is not None:
+                movie_ids = set()
+                for genre_name in new_genre_names:
+                    movie_ids.update(repo.get_movie_ids_for_genre(genre_name))
+                self.update_movies(repo.get_movies_by_id(sorted(movie_ids)))
+            self._genre_names.update(new_genre_names)
+            self._genres_version = genres_version
+
+    def update_movies(self, movies: Iterable[Movie]):
+        # Encodes new movies as rows appended to the matrix, and re-encodes movies it already holds.
+        with self._lock:
+            for movie in movies:
+                columns = list()
+                values = list()
+                for feature, weight in movie_features(movie).items():
+                    columns.append(self._columns.setdefault(feature, len(self._columns)))
+                    values.append(weight)
+                values = np.array(values, dtype=np.float64)
+                norm = np.linalg.norm(values)
+                row = (np.array(columns, dtype=np.int64), values / norm if norm > 0 else values)
+
+                if movie.id in self._row_of:
+                    self._rows[self._row_of[movie.id]] = row
+                    self._rebuild = True
+                else:
+                    self._row_of[movie.id] = len(self._movie_ids)
+                    self._movie_ids.append(movie.id)
+                    self._rows.append(row)
+                    self._pending_rows += 1
+
+    def get_similar_movie_ids(self, movie_ids: List[int], quantity: int) -> List[List[int]]:
+        # Returns, for each of movie_ids, the ids of up to quantity other movies with some similarity to it, most
+        # similar first, and equally similar movies by id. All of movie_ids are scored in one matrix product.
+        matrix, ids = self._current_matrix()
+        known = [id for id in movie_ids if self._row_of.get(id, len(ids)) < len(ids)]
+        similar = {id: list() for id in movie_ids}
+        if len(known) == 0 or quantity <= 0:
+            return [similar[id] for id in movie_ids]
+
+        rows = np.array([self._row_of[id] for id in known])
+        scores = (matrix[rows] @ matrix.T).toarray()
+        scores[np.arange(len(rows)), rows] = 0.0
+
+        count = min(quantity, len(ids) - 1)
+        for position, id in enumerate(known):
+            row_scores = scores[position]
+            if count < len(row_scores):
+                # Anything scoring at least the count-th best score could make the list, including ties.
+                threshold = np.partition(row_scores, -count)[-count]
+                candidates = np.flatnonzero(row_scores >= threshold)
+            else:
+                candidates = np.arange(len(row_scores))
+            candidates = candidates[row_scores[candidates] > 0]
+            order = np.lexsort((ids[candidates], -row_scores[candidates]))[:count]
+            similar[id] = ids[candidates[order]].tolist()
+
+        return [similar[id] for id in movie_ids]
+
+    def _current_matrix(self):
+        # Brings the matrix up to date with the encoded rows. Appended rows are stacked under the existing matrix; a
+        # re-encoded row means rebuilding it.
+        with self._lock:
+            if self._rebuild:
+                self._matrix = self._build_matrix(self._rows)
+            elif self._pending_rows > 0:
+                # Widen the existing matrix for any new columns, without changing the one readers may be using.
+                matrix = self._matrix
+                matrix = sparse.csr_matrix(
+                    (matrix.data, matrix.indices, matrix.indptr), shape=(matrix.shape[0], len(self._columns))
+                )
+                new_rows = self._build_matrix(self._rows[-self._pending_rows:])
+                self._matrix = sparse.vstack([matrix, new_rows], format='csr')
+            if self._rebuild or self._pending_rows > 0:
+                self._matrix_ids = np.array(self._movie_ids, dtype=np.int64)
+            self._pending_rows = 0
+            self._rebuild = False
+            return self._matrix, self._matrix_ids
+
+    def _build_matrix(self, rows) -> sparse.csr_matrix:
+        lengths = [len(columns) for columns, values in rows]
+        indptr = np.concatenate(([0], np.cumsum(lengths))).astype(np.int64)
+        if len(rows) > 0:
+            indices = np.concatenate([columns for columns, values in rows])
+            data = np.concatenate([values for columns, values in rows])
+        else:
+            indices = np.array([], dtype=np.int64)
+            data = np.array([], dtype=np.float64)
+        return sparse.csr_matrix((data, indices, indptr), shape=(len(rows), len(self._columns)))
@@ -1,7 +1,10 @@
 from typing import List, Iterable
 
+from movies.adapters.completion_index import Completion
+from movies.adapters.facet_index import MovieFilter
 from movies.adapters.repository import AbstractRepository
 from movies.domain.model import make_review, Movie, Review, Genre
+from movies.news.recommender import MovieRecommender
 
 
 class NonExistentMovieException(Exception):
@@ -29,13 +32,13 @@ def add_review(movie_id: int, review_text: str, username: str, repo: AbstractRep
     repo.add_review(review)
 
 
-def get_movie(movie_id: int, repo: AbstractRepository):
+def get_movie(movie_id: int, repo: AbstractRepository, fields: Iterable[str] = None):
     movie = repo.get_movie(movie_id)
 
     if movie is None:
         raise NonExistentMovieException
 
-    return movie_to_dict(movie)
+    return movie_to_dict(movie, fields)
 
 
 def get_first_movie(repo: AbstractRepository):
@@ -54,19 +57,21 @@ def get_last_movie(repo: AbstractRepository):
 def get_movies_by_date(date, repo: AbstractRepository):
     # Returns movies for the target date (empty if no matches), the date of the previous movie (might be null), the date of the next movie (might be null)
 
-    movies = repo.get_movies_by_date(target_date=date)
+    movies_dto, first_date, prev_date, next_date, last_date = get_date_page(date, repo)
 
-    movies_dto = list()
-    prev_date = next_date = None
+    return movies_dto, prev_date, next_date
 
-    if len(movies) > 0:
-        prev_date = repo.get_date_of_previous_movie(movies[0])
-        next_date = repo.get_date_of_next_movie(movies[0])
 
-        # Convert Movies to dictionary form.
-        movies_dto = movies_to_dict(movies)
+def get_date_page(date, repo: AbstractRepository):
+    # Returns movies for the target date (empty if no matches), and the dates of the first, previous, next and last
+    # movies (any of which might be null). A null target date selects the date of the first movie.
 
-    return movies_dto, prev_date, next_date
+    movies, first_date, prev_date, next_date, last_date = repo.get_date_page(target_date=date)
+
+    # Convert Movies to dictionary form.
+    movies_dto = movies_to_dict(movies)
+
+    return movies_dto, first_date, prev_date, next_date, last_date
 
 
 def get_movie_ids_for_genre(genre_name, repo: AbstractRepository):
@@ -75,15 +80,105 @@ def get_movie_ids_for_genre(genre_name, repo: AbstractRepository):
     return movie_ids
 
 
-def get_movies_by_id(id_list, repo: AbstractRepository):
+def get_faceted_movies(movie_filter: MovieFilter, repo: AbstractRepository):
+    # Returns the ids of the movies matching movie_filter, and each facet's (value, number of movies) pairs: genres
+    # by name, years in order, directors with the most movies first, and rating bands from highest.
+    movie_ids, counts = repo.get_faceted_movie_ids(movie_filter)
+
+    facets = {
+        'genre': sorted(counts['genre'].items()),
+        'year': sorted(counts['year'].items()),
+        'director': sorted(counts['director'].items(), key=lambda item: (-item[1], item[0])),
+        'rating': sorted(counts['rating'].items(), reverse=True)
+    }
+    return movie_ids, facets
+
+
+def get_movie_ids_page(movie_filter: MovieFilter, limit: int, after_id, before_id, repo: AbstractRepository):
+    # Returns a page of up to limit ids of the movies matching movie_filter, following after_id or preceding
+    # before_id, with whether there are more before or after it and the total number of matches.
+    return repo.get_movie_ids_page(movie_filter, limit, after_id=after_id, before_id=before_id)
+
+
+def get_movies_by_id(id_list, repo: AbstractRepository, fields: Iterable[str] = None):
     movies = repo.get_movies_by_id(id_list)
 
     # Convert Movies to dictionary form.
-    movies_as_dict = movies_to_dict(movies)
+    movies_as_dict = movies_to_dict(movies, fields)
 
     return movies_as_dict
 
 
+def get_top_rated_movies(quantity: int, repo: AbstractRepository):
+    movies = repo.get_movies_sorted_by_rating(quantity, highest_first=True)
+
+    # Convert Movies to dictionary form.
+    return movies_to_dict(movies)
+
+
+def get_longest_movies(quantity: int, repo: AbstractRepository):
+    movies = repo.get_movies_sorted_by_runtime(quantity, longest_first=True)
+
+    # Convert Movies to dictionary form.
+    return movies_to_dict(movies)
+
+
+def get_most_reviewed_movies(quantity: int, since, repo: AbstractRepository):
+    # Returns up to quantity movies with the most reviews written on or after since (or ever, if since is None).
+    movies = repo.get_most_reviewed_movies(quantity, since=since)
+
+    # Convert Movies to dictionary form.
+    return movies_to_dict(movies)
+
+
+def get_top_rated_movies_for_genre(genre_name: str, quantity: int, decade, repo: AbstractRepository):
+    # Returns up to quantity of the genre's highest rated movies, from the decade starting in the year decade (or
+    # from any decade, if decade is None).
+    movies = repo.get_top_rated_movies_for_genre(genre_name, quantity, decade=decade)
+
+    # Convert Movies to dictionary form.
+    return movies_to_dict(movies)
+
+
+def search_movies(query: str, limit: int, offset: int, repo: AbstractRepository, fields: Iterable[str] = None):
+    # Returns up to limit movies matching every word of query, best match first, after skipping offset matches.
+    movies = repo.search_movies(query, limit, offset)
+
+    # Convert Movies to dictionary form.
+    movies_as_dict = movies_to_dict(movies, fields)
+
+    return movies_as_dict
+
+
+def get_completions(prefix: str, quantity: int, repo: AbstractRepository):
+    # Returns up to quantity titles, directors and actors with a word starting with prefix, grouped by kind.
+    completions = {'titles': [], 'directors': [], 'actors': []}
+    for completion in repo.get_completions(prefix, quantity):
+        completions[completion.kind + 's'].append(completion_to_dict(completion))
+
+    return completions
+
+
+def get_similar_movies(movie_id: int, quantity: int, recommender: MovieRecommender):
+    # Returns up to quantity movies most like the movie with movie_id, most similar first. The recommender first
+    # picks up any movies and genres added to its repository since it was last used.
+    recommender.refresh()
+    similar_ids = recommender.get_similar_movie_ids([movie_id], quantity)[0]
+
+    movies = {movie.id: movie for movie in recommender.repo.get_movies_by_id(similar_ids)}
+
+    # Convert Movies to dictionary form, keeping the order of similarity.
+    return movies_to_dict(movies[id] for id in similar_ids if id in movies)
+
+
+def get_co_reviewed_movies(movie_id: int, quantity: int, repo: AbstractRepository):
+    # Returns up to quantity movies that reviewers of the movie with movie_id also reviewed, most often first.
+    movies = repo.get_co_reviewed_movies(movie_id, quantity)
+
+    # Convert Movies to dictionary form.
+    return movies_to_dict(movies)
+
+
 def get_reviews_for_movie(movie_id, repo: AbstractRepository):
     movie = repo.get_movie(movie_id)
 
@@ -97,26 +192,46 @@ def get_reviews_for_movie(movie_id, repo: AbstractRepository):
 # Functions to convert model entities to dicts
 # ============================================
 
-def movie_to_dict(movie: Movie):
-    movie_dict = {
-        'id': movie.id,
-        'date': movie.date,
-        'title': movie.title,
-        'first_para': movie.first_para,
-        'hyperlink': movie.hyperlink,
-        'image_hyperlink': movie.image_hyperlink,
-        'reviews': reviews_to_dict(movie.reviews),
-        'genres': genres_to_dict(movie.genres),
-        'director': movie.director,
-        'time': movie.time,
-        'rating': movie.rating,
-        'actors': movie.actors,
-    }
+# How to get each field of a movie's dictionary form, in the order the fields appear.
+MOVIE_FIELDS = {
+    'id': lambda movie: movie.id,
+    'date': lambda movie: movie.date,
+    'title': lambda movie: movie.title,
+    'first_para': lambda movie: movie.first_para,
+    'hyperlink': lambda movie: movie.hyperlink,
+    'image_hyperlink': lambda movie: movie.image_hyperlink,
+    'reviews': lambda movie: reviews_to_dict(movie.reviews),
+    'genres': lambda movie: genres_to_dict(movie.genres),
+    'director': lambda movie: movie.director,
+    'time': lambda movie: movie.time,
+    'rating': lambda movie: movie.rating,
+    'actors': lambda movie: movie.actors,
+    'votes': lambda movie: movie.votes,
+    'revenue': lambda movie: movie.revenue,
+    'metascore': lambda movie: movie.metascore,
+}
+
+
+def movie_to_dict(movie: Movie, fields: Iterable[str] = None):
+    # Only the named fields are built, if fields is given, which saves converting reviews and genres that aren't
+    # wanted. fields must be keys of MOVIE_FIELDS.
+    if fields is None:
+        fields = MOVIE_FIELDS
+    movie_dict = {field: MOVIE_FIELDS[field](movie) for field in fields}
     return movie_dict
 
 
-def movies_to_dict(movies: Iterable[Movie]):
-    return [movie_to_dict(movie) for movie in movies]
+def movies_to_dict(movies: Iterable[Movie], fields: Iterable[str] = None):
+    return [movie_to_dict(movie, fields) for movie in movies]
+
+
+def completion_to_dict(completion: Completion):
+    completion_dict = {
+        'text': completion.text
+    }
+    if completion.movie_id is not None:
+        completion_dict['movie_id'] = completion.movie_id
+    return completion_dict
 
 
 def review_to_dict(review: Review):
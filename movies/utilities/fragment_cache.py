@@ -0,0 +1,52 @@
+import threading
+from collections import OrderedDict
+from typing import Hashable
+
+
+class FragmentCache:
+    # Rendered template fragments, keyed by (template name, data version, key arguments), and evicted least recently
+    # used first once their total size passes max_bytes. A fragment rendered for an older data version is never
+    # found again, and ages out of the cache like any other.
+    #
+    # Sizes are counted in characters of the rendered text, which is close to its size in bytes for HTML.
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self._fragments = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def size(self) -> int:
+        return self._size
+
+    def __len__(self):
+        return len(self._fragments)
+
+    def get(self, key: Hashable):
+        # Returns the fragment cached under key, or None.
+        with self._lock:
+            fragment = self._fragments.get(key)
+            if fragment is None:
+                self.misses += 1
+                return None
+            self._fragments.move_to_end(key)
+            self.hits += 1
+            return fragment
+
+    def put(self, key: Hashable, fragment: str):
+        # Fragments larger than the whole cache aren't kept.
+        if len(fragment) > self.max_bytes:
+            return
+
+        with self._lock:
+            previous = self._fragments.pop(key, None)
+            if previous is not None:
+                self._size -= len(previous)
+            self._fragments[key] = fragment
+            self._size += len(fragment)
+            while self._size > self.max_bytes:
+                _, evicted = self._fragments.popitem(last=False)
+                self._size -= len(evicted)
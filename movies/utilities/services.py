@@ -1,5 +1,6 @@
 from typing import Iterable
 import random
+import threading
 
 import json
 import urllib.parse
@@ -9,26 +10,44 @@ from movies.domain.model import Movie
 
 
 def get_genre_names(repo: AbstractRepository):
-    genres = repo.get_genres()
-    genre_names = [genre.genre_name for genre in genres]
+    genre_names = repo.get_genre_names()
 
     return genre_names
 
 
 def get_random_movies(quantity, repo: AbstractRepository):
-    movie_count = repo.get_number_of_movies()
-
-    if quantity >= movie_count:
-        # Reduce the quantity of ids to generate if the repository has an insufficient number of movies.
-        quantity = movie_count - 1
-
     # Pick distinct and random movies.
-    random_ids = [1,2,3]
-    movies = repo.get_movies_by_id(random_ids)
+    movies = repo.get_random_movies(quantity)
 
     return movies_to_dict(movies)
 
 
+class RandomMoviePool:
+    # Serves random movies from a batch sampled with a single repository call, so that pages showing a few random
+    # movies don't each cost a query. Movies are handed out without repeats until the batch runs out, and then a new
+    # batch is sampled.
+
+    def __init__(self, repo: AbstractRepository, size: int):
+        self.repo = repo
+        self._size = size
+        self._movies = list()
+        self._lock = threading.Lock()
+
+    def get_random_movies(self, quantity):
+        if quantity > self._size:
+            # Too many for one batch; sample them directly.
+            return get_random_movies(quantity, self.repo)
+
+        with self._lock:
+            if len(self._movies) < quantity:
+                self._movies = get_random_movies(self._size, self.repo)
+            movies = self._movies[-quantity:]
+            del self._movies[-quantity:]
+
+        # Callers may add to the dicts, so hand out copies.
+        return [dict(movie) for movie in movies]
+
+
 
 # ============================================
 # Functions to convert dicts to model entities
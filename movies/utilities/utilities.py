@@ -1,7 +1,13 @@
-from flask import Blueprint, request, render_template, redirect, url_for, session
+import time
+from functools import wraps
+from hashlib import sha256
+
+from flask import Blueprint, request, render_template, redirect, url_for, session, current_app, make_response, g
+from markupsafe import Markup
 
 import movies.adapters.repository as repo
 import movies.utilities.services as services
+from movies.utilities.fragment_cache import FragmentCache
 
 
 # Configure Blueprint.
@@ -10,17 +16,128 @@ utilities_blueprint = Blueprint(
 
 
 def get_genres_and_urls():
-    genre_names = services.get_genre_names(repo.repo_instance)
-    genre_urls = dict()
-    for genre_name in genre_names:
-        genre_urls[genre_name] = url_for('news_bp.movies_by_genre', genre=genre_name)
+    # The genre -> URL map is cached on the application, and rebuilt only when the repository reports that a genre
+    # has been added since it was built. The returned dict is shared, so callers must not modify it.
+    cache = current_app.extensions.setdefault('genre_urls', dict())
+    version = repo.repo_instance.get_genres_version()
+
+    if cache.get('repo') is not repo.repo_instance or cache.get('version') != version:
+        genre_names = services.get_genre_names(repo.repo_instance)
+        genre_urls = dict()
+        for genre_name in genre_names:
+            genre_urls[genre_name] = url_for('news_bp.movies_by_genre', genre=genre_name)
+
+        cache['repo'] = repo.repo_instance
+        cache['version'] = version
+        cache['genre_urls'] = genre_urls
 
-    return genre_urls
+    return cache['genre_urls']
 
 
 def get_selected_movies(quantity=4):
-    movies = services.get_random_movies(quantity, repo.repo_instance)
+    # The sidebar shows the same few movies whatever the page lists, so that they're served from the pool.
+    pool_size = current_app.config.get('SELECTED_MOVIES_POOL_SIZE', 0)
+
+    if pool_size > 0:
+        # Draw from a per-process pool of pre-sampled movies, replacing it if the repository has changed.
+        pool = current_app.extensions.get('random_movie_pool')
+        if pool is None or pool.repo is not repo.repo_instance:
+            pool = services.RandomMoviePool(repo.repo_instance, pool_size)
+            current_app.extensions['random_movie_pool'] = pool
+        movies = pool.get_random_movies(quantity)
+    else:
+        movies = services.get_random_movies(quantity, repo.repo_instance)
 
     for movie in movies:
         movie['hyperlink'] = url_for('news_bp.movies_by_date', date=movie['date'].isoformat())
     return movies
+
+
+def conditional_get(view):
+    # Lets clients and caches revalidate a page with If-None-Match or If-Modified-Since, and answers 304 Not Modified
+    # without running the view while the repository's data version, and so the page, is unchanged. Pages greet the
+    # logged in user, so the ETag also depends on who that is.
+    @wraps(view)
+    def wrapped_view(**kwargs):
+        version, modified = get_data_version()
+        etag = str(version)
+        username = session.get('username')
+        if username is not None:
+            etag += '-' + sha256(username.encode('utf-8')).hexdigest()[:16]
+
+        if request.if_none_match:
+            not_modified = request.if_none_match.contains(etag)
+        else:
+            not_modified = request.if_modified_since is not None and modified <= request.if_modified_since
+
+        if not_modified:
+            response = current_app.response_class(status=304)
+        else:
+            response = make_response(view(**kwargs))
+        response.set_etag(etag)
+        response.last_modified = modified
+        response.vary.add('Cookie')
+        # Caches may keep the page, but must check it's still current before each use.
+        response.cache_control.no_cache = True
+        if username is None:
+            response.cache_control.public = True
+        else:
+            response.cache_control.private = True
+        return response
+    return wrapped_view
+
+
+def get_data_version():
+    # The repository's (version, modified), read once per request.
+    if 'data_version' not in g:
+        g.data_version = repo.repo_instance.get_data_version()
+    return g.data_version
+
+
+@utilities_blueprint.app_template_global()
+def cached_fragment(template_name, *key, **context):
+    # Renders template_name with context, reusing the rendering from an earlier request if the data version and key
+    # are the same. The key must identify everything in context that the fragment shows, apart from data that only
+    # changes with the data version. Fragments are only cached if FRAGMENT_CACHE_BYTES is set.
+    max_bytes = current_app.config.get('FRAGMENT_CACHE_BYTES', 0)
+    if max_bytes <= 0:
+        return Markup(render_template(template_name, **context))
+
+    cache = current_app.extensions.get('fragment_cache')
+    if cache is None or cache.max_bytes != max_bytes:
+        cache = current_app.extensions['fragment_cache'] = FragmentCache(max_bytes)
+
+    # Fragments are rendered outside the cache's lock, so two requests may render the same one; the later is kept.
+    cache_key = (template_name, get_data_version()[0], key)
+    fragment = cache.get(cache_key)
+    if fragment is None:
+        g.fragment_misses = g.get('fragment_misses', 0) + 1
+        fragment = render_template(template_name, **context)
+        cache.put(cache_key, fragment)
+    else:
+        g.fragment_hits = g.get('fragment_hits', 0) + 1
+    return Markup(fragment)
+
+
+@utilities_blueprint.before_app_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+
+
+@utilities_blueprint.after_app_request
+def record_request_time(response):
+    # Keeps the number of requests and total time spent on each endpoint, and reports the request's time and use of
+    # the fragment cache in a Server-Timing header, which browsers' developer tools show alongside network timings.
+    if 'request_started' not in g:
+        return response
+    elapsed = time.perf_counter() - g.request_started
+
+    timings = current_app.extensions.setdefault('route_timings', dict())
+    count, total = timings.get(request.endpoint, (0, 0.0))
+    timings[request.endpoint] = (count + 1, total + elapsed)
+
+    server_timing = 'app;dur=%.2f' % (elapsed * 1000)
+    if 'fragment_hits' in g or 'fragment_misses' in g:
+        server_timing += ', fragments;desc="%d hits, %d misses"' % (g.get('fragment_hits', 0), g.get('fragment_misses', 0))
+    response.headers['Server-Timing'] = server_timing
+    return response
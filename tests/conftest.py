@@ -83,7 +83,9 @@ def client():
         'TESTING': True,                                # Set to True during testing.
         'REPOSITORY': 'memory',                         # Set to 'memory' or 'database' depending on desired repository.
         'TEST_DATA_PATH': TEST_DATA_PATH_MEMORY,        # Path for loading test data into the repository.
-        'WTF_CSRF_ENABLED': False                       # test_client will not send a CSRF token, so disable validation.
+        'WTF_CSRF_ENABLED': False,                      # test_client will not send a CSRF token, so disable validation.
+        'MEMORY_SNAPSHOT_PATH': None,                   # Load the test data itself, rather than snapshot it.
+        'CREDENTIALS_CACHE_PATH': None                  # Keep the test users' hashes out of the application's cache.
     })
 
     return my_app.test_client()
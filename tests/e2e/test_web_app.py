@@ -1,6 +1,19 @@
+import csv
+import shutil
+
 import pytest
 
 from flask import session
+from sqlalchemy import create_engine
+from sqlalchemy.orm import clear_mappers
+
+from movies import create_app
+from movies.adapters.completion_index import CompletionIndex
+import movies.adapters.repository as repo
+from movies.domain.model import Genre
+from movies.news import news, services
+from movies.utilities import utilities
+from tests.conftest import TEST_DATA_PATH_DATABASE, TEST_DATA_PATH_MEMORY
 
 
 def test_register(client):
@@ -110,3 +123,323 @@ def test_movies_with_review(client):
     assert response.status_code == 302
 
 
+def test_movies_by_date(client):
+    # Check that we can retrieve the movies page for a date with movies.
+    response = client.get('/movies_by_date?date=2012-01-01')
+    assert response.status_code == 200
+    assert b'Movies made in 2012' in response.data
+    assert b'Prometheus' in response.data
+    # The sidebar shows a fixed few movies, however many the page lists.
+    sidebar = response.data.split(b'<aside id="sidebar">')[1]
+    assert sidebar.count(b'id="movie-container"') == 4
+
+
+def test_movies_by_date_defaults_to_first_date(client):
+    response = client.get('/movies_by_date')
+    assert response.status_code == 200
+    assert b'Movies made in 2006' in response.data
+
+
+def test_genre_urls_are_cached_until_a_genre_is_added(client):
+    with client.application.test_request_context():
+        genre_urls = utilities.get_genres_and_urls()
+        assert genre_urls['Action'] == '/movies_by_genre?genre=Action'
+        assert utilities.get_genres_and_urls() is genre_urls
+
+        repo.repo_instance.add_genre(Genre('Motoring'))
+
+        genre_urls = utilities.get_genres_and_urls()
+        assert genre_urls['Motoring'] == '/movies_by_genre?genre=Motoring'
+
+
+def test_search(client):
+    response = client.get('/search?q=Nolan')
+    assert response.status_code == 200
+    assert b'Movies matching &#34;Nolan&#34;' in response.data
+    assert b'Inception' in response.data
+    assert b'/search?q=Nolan&amp;cursor=5' not in response.data
+
+
+def test_search_pages_through_matches(client):
+    response = client.get('/search?q=dark')
+    assert b'/search?q=dark&amp;cursor=5' in response.data
+
+    response = client.get('/search?q=dark&cursor=5')
+    assert response.status_code == 200
+    assert b'/search?q=dark&amp;cursor=0' in response.data
+
+
+def test_search_without_matches(client):
+    response = client.get('/search?q=xyzzy')
+    assert response.status_code == 200
+    assert b'No movies match &#34;xyzzy&#34;' in response.data
+
+
+def test_autocomplete(client):
+    response = client.get('/autocomplete?q=nol&n=1')
+    assert response.status_code == 200
+    assert response.get_json() == {
+        'titles': [],
+        'directors': [{'text': 'Christopher Nolan', 'url': '/search?q=Christopher+Nolan'}],
+        'actors': [{'text': 'Nick Nolte', 'url': '/search?q=Nick+Nolte'}]
+    }
+
+
+@pytest.mark.parametrize('repository, data_path', [
+    ('memory', TEST_DATA_PATH_MEMORY),
+    ('database', TEST_DATA_PATH_DATABASE)
+])
+def test_completion_index_is_built_at_start_up(tmp_path, monkeypatch, repository, data_path):
+    builds = list()
+    add_movies = CompletionIndex.add_movies
+    monkeypatch.setattr('movies.adapters.completion_index.CompletionIndex.add_movies',
+                        lambda index, movies: builds.append(index) or add_movies(index, movies))
+    app = create_app({
+        'TESTING': True,
+        'REPOSITORY': repository,
+        'SQLALCHEMY_DATABASE_URI': 'sqlite:///' + str(tmp_path / 'movies.db'),
+        'TEST_DATA_PATH': data_path,
+        'MEMORY_SNAPSHOT_PATH': None,
+        'CREDENTIALS_CACHE_PATH': None
+    })
+    assert len(builds) == 1
+
+    response = app.test_client().get('/autocomplete?q=nol&n=1')
+    assert response.get_json()['directors'][0]['text'] == 'Christopher Nolan'
+    assert len(builds) == 1
+
+
+def test_movies_by_genre_combines_facets(client):
+    response = client.get('/movies_by_genre?genre=Sci-Fi&genre=Action&first_year=2010&last_year=2012')
+    assert response.status_code == 200
+    assert b'Movies by Sci-Fi and Action from 2010 to 2012' in response.data
+    assert b'Adventure (11)' in response.data
+    assert b'href="/movies_by_genre?first_year=2010&amp;last_year=2012&amp;genre=Action"' in response.data
+
+    response = client.get('/movies_by_genre?director=Christopher+Nolan&rating=9')
+    assert b'Movies directed by Christopher Nolan rated 9 to 10' in response.data
+    assert b'The Dark Knight' in response.data
+    assert b'Inception' not in response.data
+
+
+def test_movies_by_genre_pages_by_movie_id(client):
+    response = client.get('/movies_by_genre?genre=Sci-Fi')
+    assert b'/movies_by_genre?genre=Sci-Fi&amp;after=25' in response.data
+    assert b'before=' not in response.data
+
+    response = client.get('/movies_by_genre?genre=Sci-Fi&after=25')
+    assert b'Interstellar' in response.data
+    assert b'/movies_by_genre?genre=Sci-Fi&amp;before=33' in response.data
+    assert b'/movies_by_genre?genre=Sci-Fi&amp;after=49' in response.data
+
+
+def test_api_lists_movies_with_cursor_pagination(client):
+    response = client.get('/api/v1/movies?genre=Sci-Fi&limit=2&fields=id,title,date')
+    assert response.status_code == 200
+    assert response.content_type == 'application/json'
+    assert response.json == {
+        'movies': [
+            {'id': 1, 'title': 'Guardians of the Galaxy', 'date': '2014-01-01'},
+            {'id': 2, 'title': 'Prometheus', 'date': '2012-01-01'}
+        ],
+        'total': 120,
+        'next': '/api/v1/movies?genre=Sci-Fi&limit=2&fields=id%2Ctitle%2Cdate&after=2',
+        'previous': None
+    }
+
+    response = client.get(response.json['next'])
+    assert [movie['id'] for movie in response.json['movies']] == [13, 20]
+    assert response.json['previous'] == '/api/v1/movies?genre=Sci-Fi&limit=2&fields=id%2Ctitle%2Cdate&before=13'
+
+
+def test_api_returns_a_movie_and_its_reviews(client):
+    response = client.get('/api/v1/movies/1')
+    assert response.json['title'] == 'Guardians of the Galaxy'
+    assert response.json['genres'][0]['name'] == 'Action'
+
+    response = client.get('/api/v1/movies/1/reviews')
+    assert response.json['reviews'][0] == {
+        'username': 'fmercury',
+        'movie_id': 1,
+        'review_text': 'Oh no, COVID-19 has hit New Zealand',
+        'timestamp': '2020-02-28T14:31:26'
+    }
+
+
+def test_api_reports_errors(client):
+    response = client.get('/api/v1/movies/100000')
+    assert response.status_code == 404
+    assert response.json == {'error': 'No movie with id 100000'}
+
+    response = client.get('/api/v1/movies?fields=id,bogus')
+    assert response.status_code == 400
+    assert response.json == {'error': 'Unknown fields: bogus'}
+
+
+def test_api_lists_genres_and_searches(client):
+    genres = client.get('/api/v1/genres').json['genres']
+    assert {'name': 'Sci-Fi', 'number_of_movies': 120, 'movies': '/api/v1/movies?genre=Sci-Fi'} in genres
+
+    response = client.get('/api/v1/search?q=nolan&limit=2&fields=id,title')
+    assert response.json == {
+        'movies': [{'id': 37, 'title': 'Interstellar'}, {'id': 65, 'title': 'The Prestige'}],
+        'next': '/api/v1/search?q=nolan&limit=2&fields=id%2Ctitle&cursor=2'
+    }
+
+
+def test_listing_pages_answer_conditional_gets(client, auth):
+    response = client.get('/movies_by_genre?genre=Action')
+    etag = response.headers['ETag']
+    assert response.headers['Last-Modified'] is not None
+    assert 'no-cache' in response.headers['Cache-Control']
+
+    response = client.get('/movies_by_genre?genre=Action', headers={'If-None-Match': etag})
+    assert response.status_code == 304
+    assert response.data == b''
+
+    response = client.get('/movies_by_date', headers={'If-None-Match': etag})
+    assert response.status_code == 304
+
+    # Logging in changes the page, and adding a review changes the data.
+    auth.login()
+    response = client.get('/movies_by_genre?genre=Action', headers={'If-None-Match': etag})
+    assert response.status_code == 200
+    etag = response.headers['ETag']
+    client.post('/review', data={'review': 'Seen it too', 'movie_id': 2})
+    response = client.get('/movies_by_genre?genre=Action', headers={'If-None-Match': etag})
+    assert response.status_code == 200
+    assert response.headers['ETag'] != etag
+
+
+def test_layout_fragments_are_cached_between_requests(client):
+    response = client.get('/authentication/login')
+    assert response.headers['Server-Timing'].startswith('app;dur=')
+    assert 'fragments;desc="0 hits' in response.headers['Server-Timing']
+
+    response = client.get('/authentication/register')
+    assert b'<a class="btn-nav" href="/movies_by_genre?genre=Action">Action</a>' in response.data
+    # The genre menu at least is rendered from the cache.
+    assert 'fragments;desc="0 hits' not in response.headers['Server-Timing']
+
+
+def test_leaderboards(client, auth):
+    auth.login()
+    client.post('/review', data={'review': 'Seen it too', 'movie_id': 2})
+
+    response = client.get('/leaderboards')
+    assert response.status_code == 200
+    assert b'Top Rated' in response.data
+    assert b'Most Reviewed This Week' in response.data
+    assert b'Longest' in response.data
+    assert b'<a href="/review?movie=2">Prometheus</a>' in response.data
+
+
+def test_leaderboards_for_genre(client):
+    response = client.get('/leaderboards?genre=Sci-Fi&n=1')
+    assert response.status_code == 200
+    assert b'Best Sci-Fi of the 2010s' in response.data
+    assert b'Best Sci-Fi of the 2000s' in response.data
+    assert b'<a href="/review?movie=81">Inception</a>' in response.data
+    assert b'<a href="/review?movie=65">The Prestige</a>' in response.data
+
+
+def test_review_page_shows_similar_movies(client, auth):
+    auth.login()
+
+    response = client.get('/review?movie=55')
+    assert response.status_code == 200
+    assert b'Similar Movies:' in response.data
+    assert b'<a href="/review?movie=125">The Dark Knight Rises</a>' in response.data
+
+
+def test_review_page_shows_co_reviewed_movies(client, auth):
+    auth.login()
+    client.post('/review', data={'review': 'Seen it too', 'movie_id': 2})
+
+    response = client.get('/review?movie=1')
+    assert b'Reviewers Of This Movie Also Reviewed:' in response.data
+    assert b'<a href="/review?movie=2">Prometheus</a>' in response.data
+
+
+@pytest.fixture
+def database_app(tmp_path):
+    return create_app({
+        'TESTING': True,
+        'REPOSITORY': 'database',
+        'SQLALCHEMY_DATABASE_URI': 'sqlite:///' + str(tmp_path / 'movies.db'),
+        'TEST_DATA_PATH': TEST_DATA_PATH_DATABASE,
+        'MEMORY_SNAPSHOT_PATH': None,
+        'CREDENTIALS_CACHE_PATH': None
+    })
+
+
+def test_leaderboards_for_genre_span_every_decade_on_the_database(database_app):
+    response = database_app.test_client().get('/leaderboards?genre=Sci-Fi&n=1')
+    assert response.status_code == 200
+    assert b'Best Sci-Fi of the 2010s' in response.data
+    assert b'Best Sci-Fi of the 2000s' in response.data
+
+
+def test_sync_data_command_reports_rows_written(database_app):
+    result = database_app.test_cli_runner().invoke(args=['sync-data'])
+    assert result.exit_code == 0
+    assert 'movies: 0 inserted, 0 updated, 1000 unchanged, 0 skipped' in result.output
+    assert 'reviews: 0 inserted, 0 updated, 3 unchanged, 0 skipped' in result.output
+
+
+def test_sync_data_changes_reach_the_nav_and_recommendations_of_a_running_site(tmp_path):
+    data_path = tmp_path / 'data'
+    shutil.copytree(TEST_DATA_PATH_DATABASE, data_path)
+    app = create_app({
+        'TESTING': True,
+        'REPOSITORY': 'database',
+        'SQLALCHEMY_DATABASE_URI': 'sqlite:///' + str(tmp_path / 'movies.db'),
+        'TEST_DATA_PATH': str(data_path),
+        'MEMORY_SNAPSHOT_PATH': None,
+        'CREDENTIALS_CACHE_PATH': None
+    })
+    client = app.test_client()
+    assert b'Zzznewgenre' not in client.get('/').data
+    with app.app_context():
+        assert services.get_similar_movies(1, 5, news.get_recommender())[0]['id'] != 500
+
+    # Movie 1 is rewritten in place to share Up's genres, director and actors, and gains a new Genre.
+    movies_file = data_path / 'Data1000Movies.csv'
+    with open(movies_file, newline='', encoding='utf-8-sig') as infile:
+        rows = list(csv.reader(infile))
+    header = rows[0]
+    first, up = rows[1], rows[500]
+    first[header.index('Genre')] = up[header.index('Genre')] + ',Zzznewgenre'
+    for column in ('Director', 'Actors'):
+        first[header.index(column)] = up[header.index(column)]
+    with open(movies_file, 'w', newline='', encoding='utf-8') as outfile:
+        csv.writer(outfile).writerows(rows)
+
+    result = app.test_cli_runner().invoke(args=['sync-data'])
+    assert 'movies: 0 inserted, 1 updated, 999 unchanged, 0 skipped' in result.output
+
+    assert b'Zzznewgenre' in client.get('/').data
+    with app.app_context():
+        assert services.get_similar_movies(1, 5, news.get_recommender())[0]['id'] == 500
+
+
+def test_start_up_asks_for_a_sync_after_migrating_tables(tmp_path, capsys):
+    config = {
+        'TESTING': True,
+        'REPOSITORY': 'database',
+        'SQLALCHEMY_DATABASE_URI': 'sqlite:///' + str(tmp_path / 'movies.db'),
+        'TEST_DATA_PATH': TEST_DATA_PATH_DATABASE,
+        'MEMORY_SNAPSHOT_PATH': None,
+        'CREDENTIALS_CACHE_PATH': None
+    }
+    create_app(config)
+    # A database from before movies' votes were stored.
+    create_engine(config['SQLALCHEMY_DATABASE_URI']).execute('ALTER TABLE movies DROP COLUMN votes')
+    capsys.readouterr()
+
+    # Restarting maps the model classes again.
+    clear_mappers()
+    create_app({**config, 'TESTING': False})
+    output = capsys.readouterr().out
+    assert 'MIGRATED TABLES: movies' in output
+    assert 'RUN `flask sync-data`' in output
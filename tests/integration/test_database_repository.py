@@ -1,10 +1,28 @@
 from datetime import date, datetime
+import csv
+import os
+import threading
 
 import pytest
-
-from movies.adapters.database_repository import SqlAlchemyRepository
+from werkzeug.security import check_password_hash, generate_password_hash
+
+from sqlalchemy import event, create_engine, inspect
+from sqlalchemy.pool import NullPool, QueuePool
+from sqlalchemy.orm import sessionmaker, clear_mappers
+
+from movies.adapters.database_repository import (
+    SqlAlchemyRepository, SyncCounts, bulk_populate, create_database_engine, sync
+)
+from movies.adapters.facet_index import MovieFilter
+from movies.adapters.ingestion import IngestionException
+from movies.adapters.orm import (
+    metadata, create_missing_indexes, create_search_index, map_model_to_tables, migrate_tables, schema_is_current
+)
+from movies.news import services as news_services
+from movies.news.recommender import MovieRecommender
 from movies.domain.model import User, Movie, Genre, Review, make_review
 from movies.adapters.repository import RepositoryException
+from tests.conftest import TEST_DATA_PATH_DATABASE
 
 def test_repository_can_add_a_user(session_factory):
     repo = SqlAlchemyRepository(session_factory)
@@ -72,6 +90,37 @@ def test_repository_can_retrieve_movie(session_factory):
     assert movie.is_genreged_by(Genre('Adventure'))
     assert movie.is_genreged_by(Genre('Adventure'))
 
+def test_repository_loads_numeric_movie_fields(session_factory):
+    repo = SqlAlchemyRepository(session_factory)
+
+    movie = repo.get_movie(1)
+
+    assert movie.rank == 1
+    assert movie.time == 121
+    assert movie.rating == 8.1
+    assert movie.votes == 757074
+    assert movie.revenue == 333.13
+    assert movie.metascore == 76
+    assert repo.get_movie(430).metascore is None
+
+def test_repository_can_get_movies_sorted_by_rating(session_factory):
+    repo = SqlAlchemyRepository(session_factory)
+
+    movies = repo.get_movies_sorted_by_rating(4)
+    assert [movie.id for movie in movies] == [55, 118, 81, 250]
+
+    movies = repo.get_movies_sorted_by_rating(3, highest_first=False)
+    assert [movie.id for movie in movies] == [830, 43, 872]
+
+def test_repository_can_get_movies_sorted_by_runtime(session_factory):
+    repo = SqlAlchemyRepository(session_factory)
+
+    movies = repo.get_movies_sorted_by_runtime(4)
+    assert [movie.id for movie in movies] == [794, 43, 820, 712]
+
+    movies = repo.get_movies_sorted_by_runtime(3, longest_first=True)
+    assert [movie.id for movie in movies] == [829, 89, 966]
+
 def test_repository_does_not_retrieve_a_non_existent_movie(session_factory):
     repo = SqlAlchemyRepository(session_factory)
 
@@ -98,6 +147,37 @@ def test_repository_does_not_retrieve_an_movie_when_there_are_no_movies_for_a_gi
     movies = repo.get_movies_by_date(date(2020, 3, 8))
     assert len(movies) == 0
 
+def test_repository_can_get_date_page(session_factory):
+    repo = SqlAlchemyRepository(session_factory)
+
+    movies, first_date, previous_date, next_date, last_date = repo.get_date_page(date(2012, 1, 1))
+
+    assert len(movies) == 64
+    assert all(movie.date == date(2012, 1, 1) for movie in movies)
+    assert first_date == date(2006, 1, 1)
+    assert previous_date == date(2011, 1, 1)
+    assert next_date == date(2013, 1, 1)
+    assert last_date == date(2017, 1, 1)
+
+def test_repository_date_page_defaults_to_first_date(session_factory):
+    repo = SqlAlchemyRepository(session_factory)
+
+    movies, first_date, previous_date, next_date, last_date = repo.get_date_page(None)
+
+    assert len(movies) == 44
+    assert all(movie.date == date(2006, 1, 1) for movie in movies)
+    assert previous_date is None
+    assert next_date == date(2007, 1, 1)
+
+def test_repository_date_page_for_a_date_without_movies(session_factory):
+    repo = SqlAlchemyRepository(session_factory)
+
+    movies, first_date, previous_date, next_date, last_date = repo.get_date_page(date(2020, 3, 8))
+
+    assert movies == []
+    assert previous_date is None and next_date is None
+    assert first_date == date(2006, 1, 1) and last_date == date(2017, 1, 1)
+
 def test_repository_can_retrieve_genres(session_factory):
     repo = SqlAlchemyRepository(session_factory)
 
@@ -266,6 +346,27 @@ def test_repository_returns_movie_ids_for_existing_genre(session_factory):
  977,
 996]
 
+def test_repository_can_get_random_movies(session_factory):
+    movies, queries = count_queries(session_factory, lambda repo: repo.get_random_movies(5))
+
+    assert len(movies) == 5
+    assert len({movie.id for movie in movies}) == 5
+    # One query for the id range and one for the movies.
+    assert queries == 2
+
+def test_repository_finds_random_movies_among_sparse_ids(session_factory):
+    session = session_factory()
+    session.execute('DELETE FROM movies WHERE id % 10 != 0')
+    session.commit()
+    repo = SqlAlchemyRepository(session_factory)
+
+    movies = repo.get_random_movies(20)
+    assert len(movies) == 20
+    assert len({movie.id for movie in movies}) == 20
+    assert all(movie.id % 10 == 0 for movie in movies)
+
+    assert len(repo.get_random_movies(500)) == 100
+
 def test_repository_returns_an_empty_list_for_non_existent_genre(session_factory):
     repo = SqlAlchemyRepository(session_factory)
 
@@ -319,6 +420,23 @@ def test_repository_can_add_a_genre(session_factory):
     assert genre in repo.get_genres()
 
 
+def test_repository_can_retrieve_genre_names(session_factory):
+    repo = SqlAlchemyRepository(session_factory)
+
+    genre_names = repo.get_genre_names()
+
+    assert len(genre_names) == 20
+    assert genre_names == [genre.genre_name for genre in repo.get_genres()]
+
+def test_repository_changes_genres_version_when_a_genre_is_added(session_factory):
+    repo = SqlAlchemyRepository(session_factory)
+
+    version = repo.get_genres_version()
+    repo.add_genre(Genre('Motoring'))
+
+    assert repo.get_genres_version() != version
+    assert 'Motoring' in repo.get_genre_names()
+
 def test_repository_can_add_a_review(session_factory):
     repo = SqlAlchemyRepository(session_factory)
 
@@ -373,3 +491,577 @@ def test_can_retrieve_an_movie_and_add_a_review_to_it(session_factory):
     assert review in movie_fetched.reviews
     assert review in author_fetched.reviews
 
+class QueryCounter:
+    def __init__(self, engine):
+        self.count = 0
+        event.listen(engine, 'before_cursor_execute', self)
+
+    def __call__(self, *args):
+        self.count += 1
+
+def count_queries(session_factory, function):
+    repo = SqlAlchemyRepository(session_factory)
+    counter = QueryCounter(session_factory.kw['bind'])
+    result = function(repo)
+    event.remove(session_factory.kw['bind'], 'before_cursor_execute', counter)
+    return result, counter.count
+
+def test_serialising_movies_by_id_uses_a_fixed_number_of_queries(session_factory):
+    few_movies, few_queries = count_queries(session_factory, lambda repo: news_services.get_movies_by_id([1, 2, 3], repo))
+    many_movies, many_queries = count_queries(session_factory, lambda repo: news_services.get_movies_by_id(list(range(1, 51)), repo))
+
+    assert len(few_movies) == 3 and len(many_movies) == 50
+    assert [review['username'] for review in few_movies[0]['reviews']] == ['fmercury', 'thorke', 'mjackson']
+    assert few_queries == many_queries
+    assert many_queries <= 4
+
+def test_serialising_a_date_page_uses_a_fixed_number_of_queries(session_factory):
+    page, queries = count_queries(session_factory, lambda repo: news_services.get_date_page(date(2016, 1, 1), repo))
+
+    assert len(page[0]) == 295
+    assert all(len(genre['genreged_movies']) > 0 for movie in page[0] for genre in movie['genres'])
+    assert queries <= 4
+
+def make_engine_config(database_uri):
+    return {
+        'SQLALCHEMY_DATABASE_URI': database_uri,
+        'SQLALCHEMY_ECHO': False,
+        'SQLALCHEMY_POOL_SIZE': 8,
+        'SQLALCHEMY_MAX_OVERFLOW': 0,
+        'SQLALCHEMY_POOL_RECYCLE': 3600,
+        'SQLITE_PRAGMAS': {'journal_mode': 'WAL', 'synchronous': 'NORMAL', 'mmap_size': 268435456, 'cache_size': -65536}
+    }
+
+def test_database_engine_pools_connections_and_applies_pragmas(tmp_path):
+    engine = create_database_engine(make_engine_config('sqlite:///' + str(tmp_path / 'movies.db')))
+
+    assert isinstance(engine.pool, QueuePool)
+    assert engine.pool.size() == 8
+    with engine.connect() as connection:
+        assert connection.execute('PRAGMA journal_mode').scalar() == 'wal'
+        assert connection.execute('PRAGMA synchronous').scalar() == 1
+        assert connection.execute('PRAGMA cache_size').scalar() == -65536
+    engine.dispose()
+
+def test_database_engine_keeps_default_pool_for_in_memory_database():
+    engine = create_database_engine(make_engine_config('sqlite://'))
+
+    assert not isinstance(engine.pool, QueuePool)
+    metadata.create_all(engine)
+    assert engine.execute('SELECT COUNT(*) FROM movies').scalar() == 0
+
+def count_connections_opened(engine, number_of_readers=8, reads_per_reader=300):
+    # Runs concurrent readers against engine and returns the number of DB-API connections opened for them.
+    opened = list()
+    event.listen(engine, 'connect', lambda dbapi_connection, connection_record: opened.append(dbapi_connection))
+
+    def read():
+        for i in range(reads_per_reader):
+            with engine.connect() as connection:
+                connection.execute('SELECT title FROM movies WHERE id = ?', i + 1).fetchall()
+
+    readers = [threading.Thread(target=read) for _ in range(number_of_readers)]
+    for reader in readers:
+        reader.start()
+    for reader in readers:
+        reader.join()
+    return len(opened)
+
+def test_pooled_engine_reuses_connections_for_concurrent_readers(tmp_path):
+    database_uri = 'sqlite:///' + str(tmp_path / 'movies.db')
+    pooled_engine = create_database_engine(make_engine_config(database_uri))
+    metadata.create_all(pooled_engine)
+    pooled_engine.dispose()
+    unpooled_engine = create_engine(database_uri, connect_args={'check_same_thread': False}, poolclass=NullPool)
+
+    # Every read opens a fresh connection without a pool, which costs an open, a schema load and a close; the pool
+    # opens no more than one per reader.
+    assert count_connections_opened(unpooled_engine) == 8 * 300
+    assert count_connections_opened(pooled_engine) <= 8
+    pooled_engine.dispose()
+
+def query_plans(session_factory, function):
+    # Runs function against a repository and returns the EXPLAIN QUERY PLAN details of every statement it issued.
+    engine = session_factory.kw['bind']
+    statements = []
+
+    def capture(conn, cursor, statement, parameters, context, executemany):
+        statements.append((statement, parameters))
+
+    event.listen(engine, 'before_cursor_execute', capture)
+    function(SqlAlchemyRepository(session_factory))
+    event.remove(engine, 'before_cursor_execute', capture)
+
+    plans = []
+    with engine.connect() as connection:
+        for statement, parameters in statements:
+            plans.extend(row[3] for row in connection.execute('EXPLAIN QUERY PLAN ' + statement, parameters))
+    return plans
+
+def test_get_user_uses_username_index(session_factory):
+    plans = query_plans(session_factory, lambda repo: repo.get_user('fmercury'))
+
+    assert any('INDEX sqlite_autoindex_users_1' in plan for plan in plans)
+
+def test_get_movie_ids_for_genre_uses_genre_indexes(session_factory):
+    plans = query_plans(session_factory, lambda repo: repo.get_movie_ids_for_genre('Action'))
+
+    assert any('COVERING INDEX ix_genres_name' in plan for plan in plans)
+    assert any('COVERING INDEX ix_movie_genres_genre_id_movie_id' in plan for plan in plans)
+
+def test_get_movies_by_date_uses_date_and_foreign_key_indexes(session_factory):
+    plans = query_plans(session_factory, lambda repo: repo.get_movies_by_date(date(2012, 1, 1)))
+
+    assert any('INDEX ix_movies_date' in plan for plan in plans)
+    assert any('INDEX ix_reviews_movie_id' in plan for plan in plans)
+    assert any('INDEX ix_movie_genres_movie_id' in plan for plan in plans)
+
+def test_get_date_page_does_not_scan_movies(session_factory):
+    plans = query_plans(session_factory, lambda repo: repo.get_date_page(date(2012, 1, 1)))
+
+    assert any('INDEX ix_movies_date' in plan for plan in plans)
+    assert not any(plan.startswith('SCAN') and 'movies' in plan and 'INDEX' not in plan for plan in plans)
+
+def test_create_missing_indexes_adds_indexes_to_an_existing_database(tmp_path):
+    engine = create_engine('sqlite:///' + str(tmp_path / 'movies.db'))
+    metadata.create_all(engine)
+    for table in metadata.sorted_tables:
+        for index in table.indexes:
+            engine.execute(f'DROP INDEX {index.name}')
+
+    create_missing_indexes(engine)
+    create_missing_indexes(engine)
+
+    inspector = inspect(engine)
+    movie_genres_indexes = {index['name']: index['column_names'] for index in inspector.get_indexes('movie_genres')}
+    assert movie_genres_indexes['ix_movie_genres_genre_id_movie_id'] == ['genre_id', 'movie_id']
+    assert 'ix_movies_date' in {index['name'] for index in inspector.get_indexes('movies')}
+    assert {'ix_reviews_movie_id', 'ix_reviews_user_id'} <= {index['name'] for index in inspector.get_indexes('reviews')}
+
+def test_bulk_populate_rebuilds_the_tables_with_indexes_and_statistics(tmp_path):
+    engine = create_database_engine({
+        'SQLALCHEMY_DATABASE_URI': 'sqlite:///' + str(tmp_path / 'movies.db'),
+        'SQLITE_PRAGMAS': {'journal_mode': 'WAL', 'synchronous': 'NORMAL'}
+    })
+
+    number_of_rows = bulk_populate(engine, TEST_DATA_PATH_DATABASE)
+    assert bulk_populate(engine, TEST_DATA_PATH_DATABASE) == number_of_rows
+
+    counts = [engine.execute(f'SELECT COUNT(*) FROM {table.name}').scalar() for table in metadata.sorted_tables]
+    assert sum(counts) == number_of_rows
+    assert engine.execute('SELECT COUNT(*) FROM movies').scalar() == 1000
+    assert engine.execute('PRAGMA journal_mode').scalar() == 'wal'
+    assert create_search_index(engine) is False
+    assert engine.execute("SELECT rowid FROM movies_fts WHERE movies_fts MATCH 'nolan' LIMIT 1").scalar() is not None
+    assert engine.execute("SELECT COUNT(*) FROM sqlite_stat1 WHERE idx = 'ix_movies_date'").scalar() == 1
+
+    inspector = inspect(engine)
+    assert 'ix_movie_genres_genre_id_movie_id' in {index['name'] for index in inspector.get_indexes('movie_genres')}
+
+def test_bulk_populate_leaves_the_database_as_it_was_when_the_load_fails(tmp_path):
+    engine = create_database_engine({'SQLALCHEMY_DATABASE_URI': 'sqlite:///' + str(tmp_path / 'movies.db')})
+    number_of_rows = bulk_populate(engine, TEST_DATA_PATH_DATABASE)
+
+    data_path = tmp_path / 'data'
+    data_path.mkdir()
+    for filename in ('Data1000Movies.csv', 'users.csv', 'comments.csv'):
+        with open(os.path.join(TEST_DATA_PATH_DATABASE, filename), newline='', encoding='utf-8-sig') as infile:
+            rows = list(csv.reader(infile))
+        if filename == 'comments.csv':
+            rows.append(['not an id', '1', '1', 'Broken', '2020-03-01 09:00:00'])
+        with open(data_path / filename, 'w', newline='', encoding='utf-8') as outfile:
+            csv.writer(outfile).writerows(rows)
+
+    with pytest.raises(IngestionException):
+        bulk_populate(engine, str(data_path))
+
+    counts = [engine.execute(f'SELECT COUNT(*) FROM {table.name}').scalar() for table in metadata.sorted_tables]
+    assert sum(counts) == number_of_rows
+    assert engine.execute("SELECT rowid FROM movies_fts WHERE movies_fts MATCH 'nolan' LIMIT 1").scalar() is not None
+    assert 'ix_movies_date' in {index['name'] for index in inspect(engine).get_indexes('movies')}
+
+def test_sync_writes_only_new_and_changed_rows(tmp_path):
+    engine = create_database_engine({'SQLALCHEMY_DATABASE_URI': 'sqlite:///' + str(tmp_path / 'movies.db')})
+    bulk_populate(engine, TEST_DATA_PATH_DATABASE)
+    clear_mappers()
+    map_model_to_tables()
+    repo = SqlAlchemyRepository(sessionmaker(bind=engine))
+    version = repo.get_data_version()[0]
+    # Build the repository's indexes and caches, which must notice the sync.
+    assert repo.get_completions('redux', 1) == []
+    westerns = repo.get_faceted_movie_ids(MovieFilter())[1]['genre']['Western']
+    assert repo.get_co_reviewed_movies(1, 5) == []
+
+    data_path = tmp_path / 'data'
+    data_path.mkdir()
+    tables = dict()
+    for filename in ('Data1000Movies.csv', 'users.csv', 'comments.csv'):
+        with open(os.path.join(TEST_DATA_PATH_DATABASE, filename), newline='', encoding='utf-8-sig') as infile:
+            tables[filename] = list(csv.reader(infile))
+    movies = tables['Data1000Movies.csv']
+    movies[1][1] = 'Guardians of the Galaxy Redux'
+    movies[2][2] = 'Mystery,Western'
+    movies.append(list(movies[3]))
+    movies[-1][0] = '1001'
+    tables['users.csv'][2][2] = 'a new password'
+    tables['comments.csv'].append(['4', '1', '1001', 'A new film!', '2020-03-01 09:00:00'])
+    for filename, rows in tables.items():
+        with open(data_path / filename, 'w', newline='', encoding='utf-8') as outfile:
+            csv.writer(outfile).writerows(rows)
+
+    try:
+        assert sync(engine, str(data_path)) == {
+            'movies': SyncCounts(1, 2, 998), 'users': SyncCounts(0, 1, 2), 'reviews': SyncCounts(1, 0, 3)
+        }
+        assert repo.get_data_version()[0] > version
+        assert repo.get_movie(1).title == 'Guardians of the Galaxy Redux'
+        assert [movie.id for movie in repo.search_movies('redux', 10)] == [1]
+        assert [completion.movie_id for completion in repo.get_completions('redux', 1)] == [1]
+        assert repo.get_faceted_movie_ids(MovieFilter())[1]['genre']['Western'] == westerns + 1
+        assert [movie.id for movie in repo.get_co_reviewed_movies(1, 5)] == [1001]
+        assert [genre.genre_name for genre in repo.get_movie(2).genres] == ['Mystery', 'Western']
+        assert 'Western' in repo.get_genre_names()
+        assert [genre.genre_name for genre in repo.get_movie(1001).genres] == movies[3][2].split(',')
+        assert [review.review for review in repo.get_movie(1001).reviews] == ['A new film!']
+        assert check_password_hash(repo.get_user('fmercury').password, 'a new password')
+
+        version = repo.get_data_version()[0]
+        assert sync(engine, str(data_path)) == {
+            'movies': SyncCounts(0, 0, 1001), 'users': SyncCounts(0, 0, 3), 'reviews': SyncCounts(0, 0, 4)
+        }
+        assert repo.get_data_version()[0] == version
+    finally:
+        clear_mappers()
+
+def test_sync_never_changes_users_or_reviews_written_through_the_site(tmp_path):
+    engine = create_database_engine({'SQLALCHEMY_DATABASE_URI': 'sqlite:///' + str(tmp_path / 'movies.db')})
+    bulk_populate(engine, TEST_DATA_PATH_DATABASE)
+    clear_mappers()
+    map_model_to_tables()
+    repo = SqlAlchemyRepository(sessionmaker(bind=engine))
+
+    # The site's user and review take the next ids, 4, which the data files then use too.
+    repo.add_user(User('visitor', generate_password_hash('visitor password')))
+    repo.add_review(make_review('My own review', repo.get_user('visitor'), repo.get_movie(1)))
+    repo.add_user(User('taken', generate_password_hash('site password')))
+
+    data_path = tmp_path / 'data'
+    data_path.mkdir()
+    tables = dict()
+    for filename in ('Data1000Movies.csv', 'users.csv', 'comments.csv'):
+        with open(os.path.join(TEST_DATA_PATH_DATABASE, filename), newline='', encoding='utf-8-sig') as infile:
+            tables[filename] = list(csv.reader(infile))
+    tables['users.csv'] += [['4', 'mallory', 'seed password'], ['5', 'taken', 'seed password']]
+    tables['comments.csv'] += [
+        ['4', '4', '2', 'A seed review', '2020-03-01 09:00:00'], ['5', '5', '2', 'Another', '2020-03-01 09:00:00']
+    ]
+    for filename, rows in tables.items():
+        with open(data_path / filename, 'w', newline='', encoding='utf-8') as outfile:
+            csv.writer(outfile).writerows(rows)
+
+    try:
+        assert sync(engine, str(data_path)) == {
+            'movies': SyncCounts(0, 0, 1000), 'users': SyncCounts(1, 0, 3, 1), 'reviews': SyncCounts(1, 0, 3, 1)
+        }
+        repo.reset_session()
+        assert check_password_hash(repo.get_user('visitor').password, 'visitor password')
+        assert [review.review for review in repo.get_user('visitor').reviews] == ['My own review']
+        assert check_password_hash(repo.get_user('taken').password, 'site password')
+        assert [review.review for review in repo.get_user('mallory').reviews] == ['A seed review']
+
+        assert sync(engine, str(data_path)) == {
+            'movies': SyncCounts(0, 0, 1000), 'users': SyncCounts(0, 0, 4, 1), 'reviews': SyncCounts(0, 0, 4, 1)
+        }
+    finally:
+        clear_mappers()
+
+def test_sorted_movie_queries_walk_indexes_without_sorting(session_factory):
+    plans = query_plans(session_factory, lambda repo: repo.get_movies_sorted_by_rating(10))
+    assert any('INDEX ix_movies_rating' in plan for plan in plans)
+
+    plans += query_plans(session_factory, lambda repo: repo.get_movies_sorted_by_runtime(10, longest_first=True))
+    assert any('INDEX ix_movies_time' in plan for plan in plans)
+
+    assert not any('TEMP B-TREE' in plan for plan in plans)
+
+def test_schema_is_current_detects_an_older_movies_table(tmp_path):
+    engine = create_engine('sqlite:///' + str(tmp_path / 'movies.db'))
+    metadata.create_all(engine)
+    assert schema_is_current(engine)
+
+    engine.execute('DROP TABLE movies')
+    engine.execute(
+        'CREATE TABLE movies (id INTEGER PRIMARY KEY, date DATE, title VARCHAR(255), first_para VARCHAR(1024), '
+        'hyperlink VARCHAR(255), rank VARCHAR(255), director VARCHAR(255), time VARCHAR(255), rating VARCHAR(255), '
+        'actors VARCHAR(255), image_hyperlink VARCHAR(255))'
+    )
+    assert not schema_is_current(engine)
+
+def test_migrate_tables_keeps_the_rows_of_tables_from_an_older_schema(tmp_path):
+    engine = create_database_engine({'SQLALCHEMY_DATABASE_URI': 'sqlite:///' + str(tmp_path / 'movies.db')})
+    bulk_populate(engine, TEST_DATA_PATH_DATABASE)
+
+    # Users and reviews as they were before seed ids were recorded, with a user and review written through the site.
+    engine.execute('CREATE TABLE old_users AS SELECT id, username, password FROM users')
+    engine.execute('CREATE TABLE old_reviews AS SELECT id, user_id, movie_id, review, timestamp FROM reviews')
+    engine.execute('DROP TABLE reviews')
+    engine.execute('DROP TABLE users')
+    engine.execute(
+        'CREATE TABLE users (id INTEGER NOT NULL, username VARCHAR(255) NOT NULL, password VARCHAR(255) NOT NULL, '
+        'PRIMARY KEY (id), UNIQUE (username))'
+    )
+    engine.execute(
+        'CREATE TABLE reviews (id INTEGER NOT NULL, user_id INTEGER, movie_id INTEGER, review VARCHAR(1024) NOT NULL, '
+        'timestamp DATETIME NOT NULL, PRIMARY KEY (id), FOREIGN KEY(user_id) REFERENCES users (id), '
+        'FOREIGN KEY(movie_id) REFERENCES movies (id))'
+    )
+    engine.execute('INSERT INTO users SELECT * FROM old_users')
+    engine.execute('INSERT INTO reviews SELECT * FROM old_reviews')
+    engine.execute("INSERT INTO users VALUES (4, 'visitor', 'not a seed password')")
+    engine.execute("INSERT INTO reviews VALUES (4, 4, 2, 'My own review', '2020-03-01 09:00:00')")
+    assert not schema_is_current(engine)
+
+    assert set(migrate_tables(engine)) == {'users', 'reviews'}
+    create_missing_indexes(engine)
+    assert schema_is_current(engine)
+    assert migrate_tables(engine) == []
+    assert engine.execute('SELECT COUNT(*) FROM movies').scalar() == 1000
+    assert engine.execute('SELECT username, password, seed_id FROM users WHERE id = 4').fetchone() == \
+        ('visitor', 'not a seed password', None)
+    assert 'ix_reviews_movie_id' in {index['name'] for index in inspect(engine).get_indexes('reviews')}
+
+    # The seed rows are recognised by their ids and content; the site's are left alone.
+    assert sync(engine, TEST_DATA_PATH_DATABASE)['users'] == SyncCounts(0, 0, 3)
+    assert sync(engine, TEST_DATA_PATH_DATABASE)['reviews'] == SyncCounts(0, 0, 3)
+    assert engine.execute('SELECT id FROM users WHERE seed_id IS NULL').fetchall() == [(4,)]
+    assert engine.execute('SELECT id FROM reviews WHERE seed_id IS NULL').fetchall() == [(4,)]
+
+def test_repository_can_search_movies_by_director(session_factory):
+    repo = SqlAlchemyRepository(session_factory)
+
+    movies = repo.search_movies('Nolan', 10)
+
+    assert sorted(movie.id for movie in movies) == [37, 55, 65, 81, 125]
+
+def test_repository_search_requires_every_word_and_ignores_common_words(session_factory):
+    repo = SqlAlchemyRepository(session_factory)
+
+    assert [movie.id for movie in repo.search_movies('The Dark Knight', 10)] == [55, 125]
+    assert repo.search_movies('Nolan xyzzy', 10) == []
+    assert repo.search_movies('"', 10) == []
+
+def test_repository_search_pages_through_matches(session_factory):
+    repo = SqlAlchemyRepository(session_factory)
+
+    movies = repo.search_movies('dark', 6)
+
+    assert movies[0].title == 'Thor: The Dark World'
+    assert repo.search_movies('dark', 3, 2) == movies[2:5]
+
+def test_repository_search_agrees_with_memory_repository(session_factory, in_memory_repo):
+    repo = SqlAlchemyRepository(session_factory)
+
+    for query in ['Nolan', 'christian bale', 'guardians', 'PEÑA', 'love story']:
+        database_ids = {movie.id for movie in repo.search_movies(query, 1000)}
+        memory_ids = {movie.id for movie in in_memory_repo.search_movies(query, 1000)}
+        assert database_ids == memory_ids
+
+def test_search_index_follows_changes_to_movies(session_factory):
+    repo = SqlAlchemyRepository(session_factory)
+    repo.search_movies('Nolan', 10)
+
+    movie = Movie(date.fromisoformat('2020-03-15'), 'Zyzzyva Returns', 'A beetle comes home.', '', '', 1001,
+                  'Jane Doe', 100, 'John Roe', 7.0, 1001)
+    repo.add_movie(movie)
+    assert repo.search_movies('zyzzyva', 10) == [movie]
+
+    engine = session_factory.kw['bind']
+    engine.execute("UPDATE movies SET title = 'Aardvark Returns' WHERE id = 1001")
+    engine.execute('DELETE FROM movies WHERE id = 37')
+    repo.reset_session()
+    assert repo.search_movies('zyzzyva', 10) == []
+    assert [movie.id for movie in repo.search_movies('aardvark', 10)] == [1001]
+    assert sorted(movie.id for movie in repo.search_movies('Nolan', 10)) == [55, 65, 81, 125]
+
+def test_create_search_index_resynchronises_after_tables_are_rebuilt(tmp_path):
+    engine = create_engine('sqlite:///' + str(tmp_path / 'movies.db'))
+    metadata.create_all(engine)
+    engine.execute(
+        "INSERT INTO movies (id, date, title, first_para, hyperlink, rank, director, time, rating, actors, "
+        "image_hyperlink) VALUES (1, '2020-01-01', 'Zyzzyva', '', '', 1, 'Jane Doe', 90, 7.0, '', '')"
+    )
+    assert create_search_index(engine)
+    assert not create_search_index(engine)
+
+    # Dropping movies drops its triggers but leaves movies_fts holding the old rows.
+    metadata.drop_all(engine)
+    metadata.create_all(engine)
+    engine.execute(
+        "INSERT INTO movies (id, date, title, first_para, hyperlink, rank, director, time, rating, actors, "
+        "image_hyperlink) VALUES (1, '2020-01-01', 'Aardvark', '', '', 1, 'Jane Doe', 90, 7.0, '', '')"
+    )
+    assert create_search_index(engine)
+
+    assert engine.execute("SELECT rowid FROM movies_fts WHERE movies_fts MATCH 'zyzzyva'").fetchall() == []
+    assert engine.execute("SELECT rowid FROM movies_fts WHERE movies_fts MATCH 'aardvark'").fetchall() == [(1,)]
+
+def test_repository_can_complete_titles_and_people(session_factory):
+    repo = SqlAlchemyRepository(session_factory)
+
+    completions = repo.get_completions('Nol', 5)
+
+    assert [(completion.kind, completion.text) for completion in completions] == [
+        ('director', 'Christopher Nolan'), ('director', 'George Nolfi'), ('actor', 'Nick Nolte')
+    ]
+
+def test_repository_completes_a_movie_added_after_the_index_was_built(session_factory, in_memory_repo):
+    repo = SqlAlchemyRepository(session_factory)
+    assert repo.get_completions('chris', 3) == in_memory_repo.get_completions('chris', 3)
+
+    movie = Movie(date.fromisoformat('2020-03-15'), 'Zyzzyva Returns', '', '', '', 1001,
+                  'Jane Doe', 100, 'John Roe', 7.0, 1001)
+    repo.add_movie(movie)
+
+    assert [completion.movie_id for completion in repo.get_completions('zyz', 5)] == [1001]
+
+def test_recommender_finds_similar_movies_in_a_database_repository(session_factory):
+    repo = SqlAlchemyRepository(session_factory)
+
+    movies = news_services.get_similar_movies(55, 5, MovieRecommender(repo))
+
+    assert [movie['id'] for movie in movies] == [65, 125, 425, 37, 81]
+def test_repository_can_get_top_rated_movies_for_genre(session_factory):
+    repo = SqlAlchemyRepository(session_factory)
+
+    movies = repo.get_top_rated_movies_for_genre('Sci-Fi', 4)
+    assert [movie.id for movie in movies] == [81, 37, 65, 77]
+
+    # Movies with equal ratings are ordered by id, highest first.
+    movies = repo.get_top_rated_movies_for_genre('Sci-Fi', 4, decade=2000)
+    assert [movie.id for movie in movies] == [65, 469, 141, 599]
+    movies = repo.get_top_rated_movies_for_genre('Sci-Fi', 4, decade=2010)
+    assert [movie.id for movie in movies] == [81, 37, 77, 68]
+
+    assert repo.get_top_rated_movies_for_genre('Sci-Fi', 4, decade=1990) == []
+    assert repo.get_top_rated_movies_for_genre('Nonexistent', 4) == []
+
+
+def test_repository_can_get_most_reviewed_movies(session_factory):
+    repo = SqlAlchemyRepository(session_factory)
+    # fmercury, thorke and mjackson have all reviewed movie 1, in February 2020.
+    today = datetime(2020, 3, 10, 12, 0, 0)
+    for username, movie_id in [('thorke', 3), ('fmercury', 3), ('thorke', 2), ('fmercury', 3)]:
+        repo.add_review(make_review('Seen it', repo.get_user(username), repo.get_movie(movie_id), today))
+
+    assert [movie.id for movie in repo.get_most_reviewed_movies(5)] == [1, 3, 2]
+    assert [movie.id for movie in repo.get_most_reviewed_movies(1)] == [1]
+    assert [movie.id for movie in repo.get_most_reviewed_movies(5, since=date(2020, 3, 1))] == [3, 2]
+    assert repo.get_most_reviewed_movies(5, since=date(2020, 3, 11)) == []
+
+
+def test_repository_can_get_faceted_movie_ids(session_factory):
+    repo = SqlAlchemyRepository(session_factory)
+
+    movie_ids, counts = repo.get_faceted_movie_ids(
+        MovieFilter(genres=('Sci-Fi', 'Action'), first_year=2010, last_year=2012)
+    )
+
+    assert movie_ids == [77, 81, 196, 206, 228, 257, 258, 324, 390, 447, 451, 455, 567, 578, 674, 691]
+    assert counts['genre'] == {'Action': 16, 'Adventure': 11, 'Drama': 1, 'Horror': 1, 'Sci-Fi': 16, 'Thriller': 1}
+    assert counts['year'] == {2010: 4, 2011: 7, 2012: 5}
+    assert counts['rating'] == {5: 3, 6: 7, 7: 4, 8: 2}
+    assert counts['director']['Christopher Nolan'] == 1 and sum(counts['director'].values()) == 16
+
+    movie_ids, counts = repo.get_faceted_movie_ids(MovieFilter(director='Christopher Nolan', rating=9))
+    assert movie_ids == [55]
+    assert counts['director'] == {'Christopher Nolan': 1}
+
+
+def test_repository_faceted_movie_ids_match_the_memory_repository(session_factory, in_memory_repo):
+    repo = SqlAlchemyRepository(session_factory)
+
+    for movie_filter in [
+        MovieFilter(),
+        MovieFilter(genres=('Drama',), rating=7),
+        MovieFilter(genres=('Drama', 'Romance', 'Drama'), last_year=2010),
+        MovieFilter(genres=('Sci-Fi', 'Nonexistent')),
+    ]:
+        assert repo.get_faceted_movie_ids(movie_filter) == in_memory_repo.get_faceted_movie_ids(movie_filter)
+
+
+def test_repository_faceted_movie_ids_include_added_movies(session_factory):
+    repo = SqlAlchemyRepository(session_factory)
+    movie_filter = MovieFilter(director='John Roe')
+    assert repo.get_faceted_movie_ids(movie_filter)[0] == []
+
+    movie = Movie(date.fromisoformat('2008-01-01'), 'Best Ever', 'Very good.', '', '', 1001,
+                  'Jane Doe', 100, 'John Roe', 9.9, 1001)
+    repo.add_movie(movie)
+
+    assert repo.get_faceted_movie_ids(movie_filter)[0] == [1001]
+
+
+def test_repository_pages_of_movie_ids_match_the_memory_repository(session_factory, in_memory_repo):
+    repo = SqlAlchemyRepository(session_factory)
+
+    for movie_filter in [
+        MovieFilter(genres=('Sci-Fi',)),
+        MovieFilter(genres=('Drama', 'Romance')),
+        MovieFilter(director='Christopher Nolan'),
+        MovieFilter(genres=('Nonexistent',)),
+    ]:
+        for after_id, before_id in [(None, None), (29, None), (55, None), (949, None), (None, 36), (None, 10)]:
+            assert repo.get_movie_ids_page(movie_filter, 5, after_id, before_id) == (
+                in_memory_repo.get_movie_ids_page(movie_filter, 5, after_id, before_id)
+            )
+
+
+def test_repository_reads_a_page_of_movie_ids_for_a_genre_by_keyset(session_factory):
+    repo = SqlAlchemyRepository(session_factory)
+    statements = list()
+
+    def capture(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    engine = session_factory.kw['bind']
+    event.listen(engine, 'before_cursor_execute', capture)
+    page = repo.get_movie_ids_page(MovieFilter(genres=('Sci-Fi',)), 5, after_id=29)
+    event.remove(engine, 'before_cursor_execute', capture)
+
+    assert page.movie_ids == [33, 35, 36, 37, 49]
+    assert any('movie_genres.movie_id > ?' in statement and 'LIMIT ?' in statement for statement in statements)
+
+
+def test_repository_data_version_increases_with_additions(session_factory):
+    repo = SqlAlchemyRepository(session_factory)
+    version, modified = repo.get_data_version()
+    assert repo.get_data_version() == (version, modified)
+
+    repo.add_review(make_review('Seen it', repo.get_user('thorke'), repo.get_movie(2)))
+    assert repo.get_data_version()[0] > version
+
+    # Additions made through another repository, as by another process, count too.
+    version = repo.get_data_version()[0]
+    SqlAlchemyRepository(session_factory).add_genre(Genre('Motoring'))
+    assert repo.get_data_version()[0] > version
+
+
+def test_repository_can_retrieve_co_reviewed_movies(session_factory):
+    repo = SqlAlchemyRepository(session_factory)
+    # fmercury, thorke and mjackson have all reviewed movie 1.
+    assert repo.get_co_reviewed_movies(1, 5) == []
+
+    for username, movie_id in [('thorke', 2), ('thorke', 3), ('fmercury', 3), ('fmercury', 3)]:
+        repo.add_review(make_review('Seen it', repo.get_user(username), repo.get_movie(movie_id)))
+
+    assert [movie.id for movie in repo.get_co_reviewed_movies(1, 5)] == [3, 2]
+    assert [movie.id for movie in SqlAlchemyRepository(session_factory).get_co_reviewed_movies(1, 5)] == [3, 2]
+
+def test_repository_co_reviewed_movies_include_reviews_written_by_another_repository(session_factory):
+    repo = SqlAlchemyRepository(session_factory)
+    assert repo.get_co_reviewed_movies(1, 5) == []
+
+    other_repo = SqlAlchemyRepository(session_factory)
+    other_repo.add_review(make_review('Seen it', other_repo.get_user('thorke'), other_repo.get_movie(2)))
+
+    assert [movie.id for movie in repo.get_co_reviewed_movies(1, 5)] == [2]
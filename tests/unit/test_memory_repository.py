@@ -1,10 +1,30 @@
 from datetime import date, datetime
+from types import SimpleNamespace
 from typing import List
-
+import heapq
+import os
+import random
+import shutil
+import threading
+from itertools import islice
+
+import numpy as np
 import pytest
-
-from movies.domain.model import User, Movie, Genre, Review, make_review
-from movies.adapters.repository import RepositoryException
+from werkzeug.security import check_password_hash
+
+from movies.domain.model import User, Movie, Genre, Review, make_review, make_genre_association
+from movies.adapters.repository import MovieIdPage, RepositoryException
+from movies.adapters.memory_repository import MemoryRepository, populate
+from movies.adapters.credentials import (
+    hash_password_batches, hash_passwords, is_password_hash, read_cache, write_hashed_users_file
+)
+from movies.adapters.snapshot import read_snapshot, write_snapshot
+from movies.adapters.search_index import SearchIndex
+from movies.adapters.completion_index import CACHE_THRESHOLD, Completion, CompletionIndex
+from movies.adapters.co_review_index import CoReviewIndex, COUNTERS_PER_MOVIE
+from movies.adapters.facet_index import FacetIndex, MovieFilter
+from movies.adapters.ingestion import IngestionException, chunk_boundaries, parse_movie, parse_review, read_records
+from tests.conftest import TEST_DATA_PATH_MEMORY
 
 
 def test_repository_can_add_a_user(in_memory_repo):
@@ -24,6 +44,45 @@ def test_repository_does_not_retrieve_a_non_existent_user(in_memory_repo):
     assert user is None
 
 
+def test_repository_can_add_users_in_bulk(in_memory_repo):
+    users = [User('Dave', '123456789'), User('Martin', '123456789')]
+    in_memory_repo.add_users(users)
+
+    assert in_memory_repo.get_user('Dave') is users[0]
+    assert in_memory_repo.get_user('Martin') is users[1]
+    assert in_memory_repo.get_user('fmercury') == User('fmercury', '8734gfe2058v')
+
+
+def test_repository_keeps_first_user_added_for_a_username(in_memory_repo):
+    user = in_memory_repo.get_user('thorke')
+    in_memory_repo.add_user(User('thorke', 'another password'))
+
+    assert in_memory_repo.get_user('thorke') is user
+
+
+class CountingUser(User):
+    # Counts reads of username, which a search through the users makes for every user it passes.
+    username_reads = 0
+
+    @property
+    def username(self) -> str:
+        CountingUser.username_reads += 1
+        return super().username
+
+
+def test_repository_looks_up_users_without_searching_through_them():
+    repo = MemoryRepository()
+    repo.add_users(CountingUser(f'user{i}', 'password') for i in range(10000))
+
+    CountingUser.username_reads = 0
+    for i in range(100):
+        assert repo.get_user(f'user{9999 - i}').password == 'password'
+    assert repo.get_user('nobody') is None
+
+    # A linear search would read thousands of usernames per lookup.
+    assert CountingUser.username_reads == 0
+
+
 def test_repository_can_retrieve_movie_count(in_memory_repo):
     number_of_movies = in_memory_repo.get_number_of_movies()
 
@@ -57,6 +116,36 @@ def test_repository_can_retrieve_movie(in_memory_repo):
 
     # Check that the Movie is reviewed as expected.
 
+def test_repository_loads_numeric_movie_fields(in_memory_repo):
+    movie = in_memory_repo.get_movie(1)
+
+    assert movie.rank == 1
+    assert movie.time == 121
+    assert movie.rating == 8.1
+    assert movie.votes == 757074
+    assert movie.revenue == 333.13
+    assert movie.metascore == 76
+
+    # Missing values are recorded as 'N/A' in the CSV file.
+    assert in_memory_repo.get_movie(430).metascore is None
+
+
+def test_repository_can_get_movies_sorted_by_rating(in_memory_repo):
+    movies = in_memory_repo.get_movies_sorted_by_rating(4)
+    assert [movie.id for movie in movies] == [55, 118, 81, 250]
+
+    movies = in_memory_repo.get_movies_sorted_by_rating(3, highest_first=False)
+    assert [movie.id for movie in movies] == [830, 43, 872]
+
+
+def test_repository_can_get_movies_sorted_by_runtime(in_memory_repo):
+    movies = in_memory_repo.get_movies_sorted_by_runtime(4)
+    assert [movie.id for movie in movies] == [794, 43, 820, 712]
+
+    movies = in_memory_repo.get_movies_sorted_by_runtime(3, longest_first=True)
+    assert [movie.id for movie in movies] == [829, 89, 966]
+
+
 def test_repository_does_not_retrieve_a_non_existent_movie(in_memory_repo):
     movie = in_memory_repo.get_movie(99999)
     assert movie is None
@@ -74,6 +163,53 @@ def test_repository_does_not_retrieve_an_movie_when_there_are_no_movies_for_a_gi
     assert len(movies) == 0
 
 
+def test_repository_retrieves_movies_by_date_in_repository_order(in_memory_repo):
+    movies = in_memory_repo.get_movies_by_date(date(2006, 1, 1))
+
+    assert len(movies) == 44
+    assert all(movie.date == date(2006, 1, 1) for movie in movies)
+    assert movies[0] is in_memory_repo.get_first_movie()
+
+
+def test_repository_retrieves_movies_by_date_including_added_movie(in_memory_repo):
+    movie = Movie(
+        date.fromisoformat('2020-03-01'), "Added", "", "", "", 1001, "", 100, "", 5, 1001
+    )
+    in_memory_repo.add_movie(movie)
+
+    assert in_memory_repo.get_movies_by_date(date(2020, 3, 1)) == [movie]
+    assert in_memory_repo.get_date_of_next_movie(in_memory_repo.get_movie(3)) == date(2017, 1, 1)
+    assert in_memory_repo.get_date_of_next_movie(in_memory_repo.get_movie(402)) == date(2020, 3, 1)
+    assert in_memory_repo.get_date_of_previous_movie(movie) == date(2017, 1, 1)
+    assert in_memory_repo.get_date_of_next_movie(movie) is None
+
+
+def test_repository_can_get_date_page(in_memory_repo):
+    movies, first_date, previous_date, next_date, last_date = in_memory_repo.get_date_page(date(2012, 1, 1))
+
+    assert movies == in_memory_repo.get_movies_by_date(date(2012, 1, 1))
+    assert first_date == date(2006, 1, 1)
+    assert previous_date == date(2011, 1, 1)
+    assert next_date == date(2013, 1, 1)
+    assert last_date == date(2017, 1, 1)
+
+
+def test_repository_date_page_defaults_to_first_date(in_memory_repo):
+    movies, first_date, previous_date, next_date, last_date = in_memory_repo.get_date_page(None)
+
+    assert movies[0] is in_memory_repo.get_first_movie()
+    assert previous_date is None
+    assert next_date == date(2007, 1, 1)
+
+
+def test_repository_date_page_for_a_date_without_movies(in_memory_repo):
+    movies, first_date, previous_date, next_date, last_date = in_memory_repo.get_date_page(date(2020, 3, 8))
+
+    assert movies == []
+    assert previous_date is None and next_date is None
+    assert first_date == date(2006, 1, 1) and last_date == date(2017, 1, 1)
+
+
 def test_repository_can_retrieve_genres(in_memory_repo):
     genres: List[Genre] = in_memory_repo.get_genres()
 
@@ -124,6 +260,21 @@ def test_repository_returns_an_empty_list_for_non_existent_ids(in_memory_repo):
     assert len(movies) == 1
 
 
+def test_repository_can_get_random_movies(in_memory_repo):
+    movies = in_memory_repo.get_random_movies(5)
+
+    assert len(movies) == 5
+    assert len({movie.id for movie in movies}) == 5
+    assert all(in_memory_repo.get_movie(movie.id) is movie for movie in movies)
+
+
+def test_repository_returns_every_movie_when_more_random_movies_are_requested_than_exist(in_memory_repo):
+    movies = in_memory_repo.get_random_movies(5000)
+
+    assert len(movies) == 1000
+    assert in_memory_repo.get_random_movies(0) == []
+
+
 def test_repository_returns_movie_ids_for_existing_genre(in_memory_repo):
     movie_ids = in_memory_repo.get_movie_ids_for_genre('Action')
 
@@ -438,6 +589,31 @@ def test_repository_returns_an_empty_list_for_non_existent_genre(in_memory_repo)
     assert len(movie_ids) == 0
 
 
+def test_repository_returns_movie_ids_for_genre_associated_after_genre_was_added(in_memory_repo):
+    genre = Genre('Motoring')
+    in_memory_repo.add_genre(genre)
+    make_genre_association(in_memory_repo.get_movie(9), genre)
+    make_genre_association(in_memory_repo.get_movie(3), genre)
+
+    assert in_memory_repo.get_movie_ids_for_genre('Motoring') == [3, 9]
+
+    make_genre_association(in_memory_repo.get_movie(5), genre)
+
+    assert in_memory_repo.get_movie_ids_for_genre('Motoring') == [3, 5, 9]
+
+
+def test_repository_returns_movie_ids_for_existing_director(in_memory_repo):
+    movie_ids = in_memory_repo.get_movie_ids_for_director('Christopher Nolan')
+
+    assert movie_ids == [37, 55, 65, 81, 125]
+
+
+def test_repository_returns_an_empty_list_for_non_existent_director(in_memory_repo):
+    movie_ids = in_memory_repo.get_movie_ids_for_director('Hello')
+
+    assert len(movie_ids) == 0
+
+
 def test_repository_returns_date_of_previous_movie(in_memory_repo):
     movie = in_memory_repo.get_movie(6)
     previous_date = in_memory_repo.get_date_of_previous_movie(movie)
@@ -459,6 +635,433 @@ def test_repository_returns_date_of_next_movie(in_memory_repo):
     assert next_date.isoformat() == '2017-01-01'
 
 
+def test_repository_returns_none_when_there_are_no_subsequent_movies(in_memory_repo):
+    movie = in_memory_repo.get_last_movie()
+    next_date = in_memory_repo.get_date_of_next_movie(movie)
+
+    assert next_date is None
+
+
+def test_repository_returns_none_when_there_are_no_earlier_movies(in_memory_repo):
+    movie = in_memory_repo.get_first_movie()
+    previous_date = in_memory_repo.get_date_of_previous_movie(movie)
+
+    assert previous_date is None
+
+
+
+
+def test_repository_can_search_movies_by_director(in_memory_repo):
+    movies = in_memory_repo.search_movies('Nolan', 10)
+
+    assert sorted(movie.id for movie in movies) == [37, 55, 65, 81, 125]
+
+
+def test_repository_search_requires_every_word_and_ignores_common_words(in_memory_repo):
+    movies = in_memory_repo.search_movies('The Dark Knight', 10)
+
+    assert [movie.id for movie in movies] == [55, 125]
+
+
+def test_repository_search_ranks_title_matches_first(in_memory_repo):
+    movies = in_memory_repo.search_movies('guardians', 10)
+
+    assert movies[0].title == 'Guardians of the Galaxy'
+    assert len(movies) == 2
+
+
+def test_repository_search_ignores_case_and_accents(in_memory_repo):
+    assert in_memory_repo.search_movies('PEÑA', 10) == in_memory_repo.search_movies('pena', 10)
+    assert len(in_memory_repo.search_movies('pena', 10)) > 0
+
+
+def test_repository_search_pages_through_matches(in_memory_repo):
+    movies = in_memory_repo.search_movies('dark', 6)
+
+    assert in_memory_repo.search_movies('dark', 3, 2) == movies[2:5]
+
+
+def test_repository_search_returns_an_empty_list_when_nothing_matches(in_memory_repo):
+    assert in_memory_repo.search_movies('xyzzy', 10) == []
+    assert in_memory_repo.search_movies('Nolan xyzzy', 10) == []
+    assert in_memory_repo.search_movies('', 10) == []
+
+
+def test_repository_search_finds_an_added_movie(in_memory_repo):
+    movie = Movie(date.fromisoformat('2020-03-15'), 'Zyzzyva Returns', 'A beetle comes home.', '', '', 1001,
+                  'Jane Doe', 100, 'John Roe', 7.0, 1001)
+    in_memory_repo.add_movie(movie)
+
+    assert in_memory_repo.search_movies('zyzzyva', 10) == [movie]
+    assert in_memory_repo.search_movies('john roe beetle', 10) == [movie]
+
+
+def test_search_index_reindexes_a_replaced_document():
+    index = SearchIndex()
+    index.add_document(1, {'title': 'Old Title'})
+    index.add_document(1, {'title': 'New Title'})
+
+    assert index.search('old', 10) == []
+    assert index.search('new title', 10) == [1]
+    assert index.number_of_documents == 1
+
+
+def test_search_index_ranks_each_term_once_across_100k_documents(monkeypatch):
+    index = SearchIndex()
+    for id in range(100000):
+        index.add_document(id, {
+            'title': f'title{id % 50000} part{id % 7}',
+            'first_para': f'story of the man{id % 13} and the woman{id % 31} in city{id % 997}',
+            'actors': f'actor{id % 4001}, actor{id % 3989}',
+            'director': f'director{id % 1009}'
+        })
+
+    queries = ['title123', 'director42', 'actor17 part3', 'man3 woman7', 'story', 'the man5 city9']
+    for query in queries:
+        assert len(index.search(query, 10)) > 0
+
+    sort_sizes = list()
+
+    def counting_sorted(iterable, **kwargs):
+        items = sorted(iterable, **kwargs)
+        sort_sizes.append(len(items))
+        return items
+
+    monkeypatch.setattr('movies.adapters.search_index.sorted', counting_sorted, raising=False)
+
+    # The terms' documents were ranked by the first searches, so searching again sorts no more than a page.
+    for query in queries:
+        assert len(index.search(query, 10)) > 0
+    assert max(sort_sizes, default=0) <= 10
+
+    # Adding a document changes every term's scores, so the next search ranks its term's documents again.
+    index.add_document(100000, {'title': 'story'})
+    assert len(index.search('story', 10)) == 10
+    assert max(sort_sizes) == 100001
+
+
+def test_repository_can_complete_titles_and_people(in_memory_repo):
+    completions = in_memory_repo.get_completions('Nol', 5)
+
+    assert completions == [
+        Completion('director', 'Christopher Nolan', None),
+        Completion('director', 'George Nolfi', None),
+        Completion('actor', 'Nick Nolte', None)
+    ]
+
+
+def test_repository_completes_from_any_word_of_a_title(in_memory_repo):
+    completions = in_memory_repo.get_completions('dark kn', 5)
+
+    assert completions == [Completion('title', 'The Dark Knight', 55), Completion('title', 'The Dark Knight Rises', 125)]
+
+
+def test_repository_ranks_completions_by_votes_and_number_of_movies(in_memory_repo):
+    completions = in_memory_repo.get_completions('chris', 2)
+
+    assert [completion.kind for completion in completions] == ['title'] * 2 + ['director'] * 2 + ['actor'] * 2
+    assert Completion('actor', 'Christian Bale', None) in completions
+    assert Completion('director', 'Christopher Nolan', None) in completions
+
+
+def test_repository_completes_a_movie_added_after_the_index_was_built(in_memory_repo):
+    in_memory_repo.get_completions('n', 5)
+
+    movie = Movie(date.fromisoformat('2020-03-15'), 'Zyzzyva Returns', '', '', '', 1001,
+                  'Jane Doe, Michael Peña', 100, 'John Roe', 7.0, 1001, votes=5)
+    in_memory_repo.add_movie(movie)
+
+    assert in_memory_repo.get_completions('zyz', 5) == [Completion('title', 'Zyzzyva Returns', 1001)]
+    assert Completion('title', 'Zyzzyva Returns', 1001) in in_memory_repo.get_completions('retu', 5)
+    assert Completion('director', 'John Roe', None) in in_memory_repo.get_completions('roe', 5)
+    assert in_memory_repo.get_completions('pena', 5) == [Completion('actor', 'Michael Peña', None)]
+
+
+def test_completion_index_keeps_cached_completions_up_to_date():
+    index = CompletionIndex()
+    index.add_movies((id, f'Movie {id}', f'Actor {id % 3}', 'Director', id) for id in range(300))
+    assert index.complete('mov', 2) == [Completion('title', 'Movie 299', 299), Completion('title', 'Movie 298', 298)]
+
+    index.add_movie(300, 'Movie Star', 'Actor 1', 'Director', 1000)
+    assert index.complete('mov', 2) == [Completion('title', 'Movie Star', 300), Completion('title', 'Movie 299', 299)]
+    assert index.complete('act', 1) == [Completion('actor', 'Actor 1', None)]
+
+    index.add_movie(300, 'Movie Star', 'Actor 1', 'Director', 0)
+    assert index.complete('mov', 1) == [Completion('title', 'Movie 299', 299)]
+
+
+def test_completion_index_writers_leave_the_array_a_reader_is_searching_unchanged():
+    index = CompletionIndex()
+    index.add_movies([(1, 'Alpha', 'Actor A', 'Director', 10), (2, 'Beta', 'Actor B', 'Director', 20)])
+    entries = index._entries
+    snapshot = list(entries)
+
+    index.add_movie(3, 'Alphabet', 'Actor C', 'Director', 30)
+    index.add_movie(1, 'Gamma', 'Actor A', 'Director', 10)
+    index.add_movies([(4, 'Delta', 'Actor D', 'Director', 40)])
+
+    assert entries == snapshot
+    assert index.complete('alpha', 5) == [Completion('title', 'Alphabet', 3)]
+
+
+def test_completion_index_ranks_a_bounded_number_of_candidates_over_100k_movies(monkeypatch):
+    index = CompletionIndex()
+    index.add_movies(
+        (id, f'title{id % 50000} part{id % 7}', f'actor{id % 4001} a{id % 13}, actor{id % 3989}',
+         f'director{id % 1009}', id % 1000)
+        for id in range(100000)
+    )
+    prefixes = [f'{word}{digits}'[:length] for word in ('title', 'actor', 'director', 'part', 'a')
+                for digits in ('1', '23', '456') for length in range(1, 10)]
+
+    ranked = list()
+
+    def counting_nsmallest(quantity, iterable):
+        items = list(iterable)
+        ranked.append(len(items))
+        return heapq.nsmallest(quantity, items)
+
+    monkeypatch.setattr('movies.adapters.completion_index.heapq', SimpleNamespace(nsmallest=counting_nsmallest))
+
+    for prefix in prefixes:
+        index.complete(prefix, 10)
+    assert max(ranked) > CACHE_THRESHOLD
+
+    # Prefixes matching more than CACHE_THRESHOLD entries are answered from the cache, so no lookup ranks more.
+    ranked.clear()
+    for prefix in prefixes:
+        index.complete(prefix, 10)
+    assert max(ranked) <= CACHE_THRESHOLD
+
+
+def test_completion_index_can_be_read_while_movies_are_added():
+    index = CompletionIndex()
+    index.add_movies((id, f'Movie {id}', f'Actor {id}', 'Director', id) for id in range(1000))
+    errors = list()
+
+    def read():
+        try:
+            for _ in range(200):
+                for completion in index.complete('m', 5) + index.complete('actor 1', 5):
+                    assert completion.text != ''
+        except Exception as exception:
+            errors.append(exception)
+
+    readers = [threading.Thread(target=read) for _ in range(4)]
+    for reader in readers:
+        reader.start()
+    for id in range(1000, 1200):
+        index.add_movie(id, f'Movie {id}', f'Actor {id}', 'Director', id)
+    for reader in readers:
+        reader.join()
+
+    assert errors == []
+    assert index.complete('movie', 1) == [Completion('title', 'Movie 1199', 1199)]
+
+
+def test_search_index_can_be_saved_to_and_loaded_from_arrays():
+    index = SearchIndex()
+    index.add_document(1, {'title': 'Red Planet', 'director': 'Jane Doe'})
+    index.add_document(2, {'title': 'Blue Planet', 'director': 'John Roe'})
+    index.add_document(3, {'title': 'Red Sky', 'director': 'John Roe'})
+
+    terms, arrays = index.to_arrays()
+    loaded = SearchIndex.from_arrays(terms, arrays)
+    assert loaded.number_of_documents == 3
+    assert loaded.search('planet', 10) == index.search('planet', 10)
+    assert loaded.search('red roe', 10) == [3]
+
+    # A loaded index can still be changed.
+    loaded.add_document(2, {'title': 'Green Planet'})
+    loaded.add_document(4, {'title': 'Red Planet Returns'})
+    assert loaded.search('blue', 10) == []
+    assert sorted(loaded.search('red planet', 10)) == [1, 4]
+
+
+def test_repository_can_add_movies_in_bulk(in_memory_repo):
+    movies = [
+        Movie(date.fromisoformat('2008-01-01'), f'Bulk {id}', 'Bulk.', '', '', id, 'Jane Doe', 90 + id % 7,
+              'Bulk Director', 5.0 + id % 5, id)
+        for id in range(1001, 1011)
+    ]
+    one_by_one = MemoryRepository()
+    in_bulk = MemoryRepository()
+    for movie in in_memory_repo.get_movies_by_id(in_memory_repo.get_movie_ids()[:50]) + movies:
+        one_by_one.add_movie(movie)
+    in_bulk.add_movies(in_memory_repo.get_movies_by_id(in_memory_repo.get_movie_ids()[:50]))
+    in_bulk.add_movies(movies)
+
+    assert in_bulk.get_number_of_movies() == 60
+    assert in_bulk.get_first_movie() is one_by_one.get_first_movie()
+    assert in_bulk.get_last_movie() is one_by_one.get_last_movie()
+    assert in_bulk.get_movies_by_date(date(2008, 1, 1)) == one_by_one.get_movies_by_date(date(2008, 1, 1))
+    assert in_bulk.get_movie_ids_for_director('Bulk Director') == list(range(1001, 1011))
+    assert in_bulk.get_movies_sorted_by_rating(5) == one_by_one.get_movies_sorted_by_rating(5)
+    assert in_bulk.get_movies_sorted_by_runtime(5) == one_by_one.get_movies_sorted_by_runtime(5)
+    assert in_bulk.search_movies('bulk', 20) == one_by_one.search_movies('bulk', 20)
+
+
+def test_repository_can_be_saved_to_and_loaded_from_a_snapshot(in_memory_repo, tmp_path):
+    path = str(tmp_path / 'movies.snapshot')
+    in_memory_repo.save_snapshot(path, 'digest')
+
+    repo = MemoryRepository()
+    repo.load_snapshot(read_snapshot(path, 'digest'))
+
+    assert repo.get_number_of_movies() == in_memory_repo.get_number_of_movies()
+    assert repo.get_first_movie() == in_memory_repo.get_first_movie()
+    assert repo.get_movies_by_date(date(2016, 1, 1)) == in_memory_repo.get_movies_by_date(date(2016, 1, 1))
+    movie = repo.get_movie(1)
+    original = in_memory_repo.get_movie(1)
+    assert (movie.rank, movie.actors, movie.time, movie.director, movie.rating, movie.votes, movie.revenue,
+            movie.metascore) == (original.rank, original.actors, original.time, original.director,
+                                 original.rating, original.votes, original.revenue, original.metascore)
+    assert repo.get_movie(26).revenue is None and repo.get_movie(26).metascore is None
+    assert [genre.genre_name for genre in movie.genres] == [genre.genre_name for genre in original.genres]
+
+    assert repo.get_genre_names() == in_memory_repo.get_genre_names()
+    assert repo.get_movie_ids_for_genre('Sci-Fi') == in_memory_repo.get_movie_ids_for_genre('Sci-Fi')
+    assert repo.get_top_rated_movies_for_genre('Sci-Fi', 4) == in_memory_repo.get_top_rated_movies_for_genre(
+        'Sci-Fi', 4)
+    assert repo.search_movies('christopher nolan', 10) == in_memory_repo.search_movies('christopher nolan', 10)
+
+    user = repo.get_user('thorke')
+    assert user.password == in_memory_repo.get_user('thorke').password
+    assert [(review.user.username, review.movie.id, review.review, review.timestamp)
+            for review in repo.get_reviews()] == [(review.user.username, review.movie.id, review.review,
+                                                   review.timestamp) for review in in_memory_repo.get_reviews()]
+
+
+def test_populate_logs_a_snapshot_it_could_not_save(tmp_path, caplog):
+    repo = MemoryRepository()
+    populate(TEST_DATA_PATH_MEMORY, repo, snapshot_path=str(tmp_path / 'missing' / 'movies.snapshot'))
+
+    assert repo.get_number_of_movies() == 1000
+    assert 'Could not save snapshot' in caplog.text
+
+
+def test_snapshots_of_other_source_data_or_formats_are_ignored(tmp_path):
+    path = str(tmp_path / 'movies.snapshot')
+    assert read_snapshot(path, 'digest') is None
+
+    write_snapshot(path, 'digest', {'ids': np.arange(5)}, {'names': ['a', 'bé', '']})
+    snapshot = read_snapshot(path, 'digest')
+    assert snapshot.array('ids').tolist() == [0, 1, 2, 3, 4]
+    assert snapshot.strings('names') == ['a', 'bé', '']
+    assert read_snapshot(path, 'other digest') is None
+
+    with open(path, 'r+b') as snapshot_file:
+        snapshot_file.seek(8)
+        snapshot_file.write((99).to_bytes(4, 'little'))
+    assert read_snapshot(path, 'digest') is None
+
+
+def test_seed_passwords_are_hashed_once_and_cached(tmp_path, monkeypatch):
+    cache_path = str(tmp_path / 'credentials.csv')
+    credentials = [('thorke', 'cLQ^C#oFXloS'), ('fmercury', 'mvNNbc1eLA$i')]
+    hashes = hash_passwords(credentials, cache_path)
+    assert all(is_password_hash(password_hash) for password_hash in hashes)
+    assert set(read_cache(cache_path)) == {'thorke', 'fmercury'}
+
+    hashed = list()
+    monkeypatch.setattr('movies.adapters.credentials.generate_password_hash', lambda password: hashed.append(
+        password) or 'pbkdf2:sha256:1$salt$00')
+    credentials.extend([('mjackson', 'Bad$password'), ('thorke', 'pbkdf2:sha256:150000$abc$0123abcd')])
+    credentials[1] = ('fmercury', 'a new password')
+    assert hash_passwords(credentials, cache_path) == [
+        hashes[0], 'pbkdf2:sha256:1$salt$00', 'pbkdf2:sha256:1$salt$00', 'pbkdf2:sha256:150000$abc$0123abcd'
+    ]
+    # Only new or changed plain passwords are hashed; hashes are taken as they are.
+    assert hashed == ['a new password', 'Bad$password']
+
+
+def test_seed_passwords_are_hashed_in_batches_and_cached_once(tmp_path, monkeypatch):
+    cache_path = str(tmp_path / 'credentials.csv')
+    writes = list()
+    monkeypatch.setattr('movies.adapters.credentials.generate_password_hash', lambda password: 'pbkdf2:sha256:1$s$0')
+    monkeypatch.setattr('movies.adapters.credentials.write_cache', lambda path, cache: writes.append(dict(cache)))
+
+    batches = [[('thorke', 'one'), ('fmercury', 'two')], [('mjackson', 'three')]]
+    hashed_batches = hash_password_batches(iter(batches), lambda item: item, cache_path)
+    assert next(hashed_batches) == (batches[0], ['pbkdf2:sha256:1$s$0'] * 2)
+    assert writes == []
+    assert list(hashed_batches) == [(batches[1], ['pbkdf2:sha256:1$s$0'])]
+    assert len(writes) == 1 and set(writes[0]) == {'thorke', 'fmercury', 'mjackson'}
+
+
+def test_seed_passwords_are_hashed_without_a_cache_that_cant_be_saved(tmp_path, monkeypatch, caplog):
+    monkeypatch.setattr('movies.adapters.credentials.generate_password_hash', lambda password: 'pbkdf2:sha256:1$s$0')
+    cache_path = str(tmp_path / 'missing' / 'credentials.csv')
+
+    assert hash_passwords([('thorke', 'one')], cache_path) == ['pbkdf2:sha256:1$s$0']
+    assert 'Could not save credentials cache' in caplog.text
+
+
+def test_repository_loads_users_a_batch_at_a_time(monkeypatch):
+    monkeypatch.setattr('movies.adapters.memory_repository.USER_BATCH_SIZE', 1)
+    repo = MemoryRepository()
+    populate(TEST_DATA_PATH_MEMORY, repo)
+
+    assert check_password_hash(repo.get_user('thorke').password, 'cLQ^C#oFXloS')
+    assert check_password_hash(repo.get_user('fmercury').password, 'mvNNbc1eLA$i')
+    assert {review.user.username for review in repo.get_reviews()} == {'thorke', 'fmercury'}
+
+
+def test_seed_passwords_are_hashed_in_parallel():
+    credentials = [(f'user{number}', f'password{number}') for number in range(20)]
+    hashes = hash_passwords(credentials, processes=2)
+    assert len(set(hashes)) == 20
+    assert all(check_password_hash(password_hash, password)
+               for (username, password), password_hash in zip(credentials, hashes))
+
+
+def test_repository_can_be_populated_from_pre_hashed_users(in_memory_repo, tmp_path):
+    data_path = tmp_path / 'data'
+    data_path.mkdir()
+    for filename in ('Data1000Movies.csv', 'comments.csv'):
+        shutil.copy(os.path.join(TEST_DATA_PATH_MEMORY, filename), data_path / filename)
+    write_hashed_users_file(os.path.join(TEST_DATA_PATH_MEMORY, 'users.csv'), str(data_path / 'users.csv'))
+
+    repo = MemoryRepository()
+    populate(str(data_path), repo)
+    assert is_password_hash(repo.get_user('thorke').password)
+    assert check_password_hash(repo.get_user('thorke').password, 'cLQ^C#oFXloS')
+    assert len(repo.get_reviews()) == len(in_memory_repo.get_reviews())
+
+
+def test_csv_files_are_read_in_chunks_of_whole_rows(tmp_path):
+    path = tmp_path / 'comments.csv'
+    path.write_text(
+        'id,author-id,movie-id,comment-text,timestamp\n'
+        + ''.join(f'{id},1,{id},"line one\nline ""{id}"", two",2020-02-28 14:31:26\n' for id in range(1, 201)),
+        encoding='utf-8'
+    )
+
+    chunks = list(chunk_boundaries(str(path), 64))
+    assert len(chunks) > 10
+    assert all(end > start for start, end in chunks)
+    assert all(chunks[position][1] == chunks[position + 1][0] for position in range(len(chunks) - 1))
+
+    in_one_chunk = list(read_records(str(path), parse_review, processes=1))
+    assert [record.id for record in in_one_chunk] == list(range(1, 201))
+    assert in_one_chunk[6].review == 'line one\nline "7", two'
+    assert list(read_records(str(path), parse_review, processes=2, chunk_bytes=64)) == in_one_chunk
+
+
+def test_movie_records_are_typed_and_validated(tmp_path):
+    records = list(read_records(os.path.join(TEST_DATA_PATH_MEMORY, 'Data1000Movies.csv'), parse_movie))
+    assert records[0].id == 1 and records[0].date == date(2014, 1, 1) and records[0].rating == 8.1
+    assert records[0].genres == ('Action', 'Adventure', 'Sci-Fi')
+    assert records[25].revenue is None and records[25].metascore is None
+
+    path = tmp_path / 'movies.csv'
+    with open(os.path.join(TEST_DATA_PATH_MEMORY, 'Data1000Movies.csv'), encoding='utf-8-sig') as infile:
+        text = ''.join(islice(infile, 3))
+    path.write_text(text + '3,Broken,Drama,,,,20XX,,,,,,,,\n' + text.split('\n', 1)[1], encoding='utf-8')
+    # The bad row is reported by its offset in the file, whichever chunk it's read in.
+    for chunk_bytes in (1 << 22, 64):
+        with pytest.raises(IngestionException, match=f'invalid row at byte {len(text.encode("utf-8"))}:'):
+            list(read_records(str(path), parse_movie, processes=1, chunk_bytes=chunk_bytes))
 
 
 def test_repository_can_add_a_genre(in_memory_repo):
@@ -468,6 +1071,21 @@ def test_repository_can_add_a_genre(in_memory_repo):
     assert genre in in_memory_repo.get_genres()
 
 
+def test_repository_can_retrieve_genre_names(in_memory_repo):
+    genre_names = in_memory_repo.get_genre_names()
+
+    assert len(genre_names) == 20
+    assert genre_names == [genre.genre_name for genre in in_memory_repo.get_genres()]
+
+
+def test_repository_changes_genres_version_when_a_genre_is_added(in_memory_repo):
+    version = in_memory_repo.get_genres_version()
+    in_memory_repo.add_genre(Genre('Motoring'))
+
+    assert in_memory_repo.get_genres_version() != version
+    assert 'Motoring' in in_memory_repo.get_genre_names()
+
+
 def test_repository_can_add_a_review(in_memory_repo):
     user = in_memory_repo.get_user('thorke')
     movie = in_memory_repo.get_movie(2)
@@ -502,4 +1120,197 @@ def test_repository_can_retrieve_reviews(in_memory_repo):
     assert len(in_memory_repo.get_reviews()) == 2
 
 
+def test_repository_can_get_top_rated_movies_for_genre(in_memory_repo):
+    movies = in_memory_repo.get_top_rated_movies_for_genre('Sci-Fi', 4)
+    assert [movie.id for movie in movies] == [81, 37, 65, 77]
+
+    # Movies with equal ratings are ordered by id, highest first.
+    movies = in_memory_repo.get_top_rated_movies_for_genre('Sci-Fi', 4, decade=2000)
+    assert [movie.id for movie in movies] == [65, 469, 141, 599]
+    movies = in_memory_repo.get_top_rated_movies_for_genre('Sci-Fi', 4, decade=2010)
+    assert [movie.id for movie in movies] == [81, 37, 77, 68]
+
+    assert in_memory_repo.get_top_rated_movies_for_genre('Sci-Fi', 4, decade=1990) == []
+    assert in_memory_repo.get_top_rated_movies_for_genre('Nonexistent', 4) == []
+
+
+def test_repository_top_rated_movies_for_genre_include_new_associations(in_memory_repo):
+    movie = Movie(date.fromisoformat('2008-01-01'), 'Best Ever', 'Very good.', '', '', 1001,
+                  'Jane Doe', 100, 'John Roe', 9.9, 1001)
+    in_memory_repo.add_movie(movie)
+    sci_fi = next(genre for genre in in_memory_repo.get_genres() if genre.genre_name == 'Sci-Fi')
+    make_genre_association(movie, sci_fi)
+
+    assert in_memory_repo.get_top_rated_movies_for_genre('Sci-Fi', 1)[0] is movie
+    assert in_memory_repo.get_top_rated_movies_for_genre('Sci-Fi', 1, decade=2000)[0] is movie
+    assert in_memory_repo.get_top_rated_movies_for_genre('Sci-Fi', 1, decade=2010)[0].id == 81
+
+
+def test_repository_can_get_most_reviewed_movies(in_memory_repo):
+    # fmercury and thorke have both reviewed movie 1, in February 2020.
+    today = datetime(2020, 3, 10, 12, 0, 0)
+    for username, movie_id in [('thorke', 3), ('fmercury', 3), ('thorke', 2), ('fmercury', 3)]:
+        in_memory_repo.add_review(
+            make_review('Seen it', in_memory_repo.get_user(username), in_memory_repo.get_movie(movie_id), today)
+        )
+
+    assert [movie.id for movie in in_memory_repo.get_most_reviewed_movies(5)] == [3, 1, 2]
+    assert [movie.id for movie in in_memory_repo.get_most_reviewed_movies(1)] == [3]
+    assert [movie.id for movie in in_memory_repo.get_most_reviewed_movies(5, since=date(2020, 3, 1))] == [3, 2]
+    assert [movie.id for movie in in_memory_repo.get_most_reviewed_movies(5, since=date(2020, 2, 28))] == [3, 1, 2]
+    assert in_memory_repo.get_most_reviewed_movies(5, since=date(2020, 3, 11)) == []
+
+
+def test_repository_can_get_faceted_movie_ids(in_memory_repo):
+    movie_ids, counts = in_memory_repo.get_faceted_movie_ids(
+        MovieFilter(genres=('Sci-Fi', 'Action'), first_year=2010, last_year=2012)
+    )
+
+    assert movie_ids == [77, 81, 196, 206, 228, 257, 258, 324, 390, 447, 451, 455, 567, 578, 674, 691]
+    assert counts['genre'] == {'Action': 16, 'Adventure': 11, 'Drama': 1, 'Horror': 1, 'Sci-Fi': 16, 'Thriller': 1}
+    assert counts['year'] == {2010: 4, 2011: 7, 2012: 5}
+    assert counts['rating'] == {5: 3, 6: 7, 7: 4, 8: 2}
+    assert counts['director']['Christopher Nolan'] == 1 and sum(counts['director'].values()) == 16
+
+
+def test_repository_can_get_faceted_movie_ids_by_director_and_rating(in_memory_repo):
+    movie_ids, counts = in_memory_repo.get_faceted_movie_ids(MovieFilter(director='Christopher Nolan'))
+    assert movie_ids == [37, 55, 65, 81, 125]
+    assert counts['rating'] == {8: 4, 9: 1}
+
+    movie_ids, counts = in_memory_repo.get_faceted_movie_ids(MovieFilter(director='Christopher Nolan', rating=9))
+    assert movie_ids == [55]
+    assert counts['director'] == {'Christopher Nolan': 1}
+
+
+def test_repository_returns_no_faceted_movies_for_a_non_existent_genre(in_memory_repo):
+    movie_ids, counts = in_memory_repo.get_faceted_movie_ids(MovieFilter(genres=('Sci-Fi', 'Nonexistent')))
+
+    assert movie_ids == []
+    assert counts == {'genre': {}, 'year': {}, 'director': {}, 'rating': {}}
+
+
+def test_repository_faceted_movie_ids_include_new_movies_and_associations(in_memory_repo):
+    movie = Movie(date.fromisoformat('2008-01-01'), 'Best Ever', 'Very good.', '', '', 1001,
+                  'Jane Doe', 100, 'John Roe', 9.9, 1001)
+    in_memory_repo.add_movie(movie)
+    assert in_memory_repo.get_faceted_movie_ids(MovieFilter(director='John Roe'))[0] == [1001]
+
+    sci_fi = next(genre for genre in in_memory_repo.get_genres() if genre.genre_name == 'Sci-Fi')
+    make_genre_association(movie, sci_fi)
+    movie_ids, counts = in_memory_repo.get_faceted_movie_ids(MovieFilter(genres=('Sci-Fi',), rating=9))
+    assert movie_ids == [1001]
+    assert counts['genre'] == {'Sci-Fi': 1}
+
+
+def test_repository_can_get_a_page_of_movie_ids_for_a_genre(in_memory_repo):
+    movie_filter = MovieFilter(genres=('Sci-Fi',))
+
+    assert in_memory_repo.get_movie_ids_page(movie_filter, 5) == MovieIdPage([1, 2, 13, 20, 25], False, True, 120)
+    assert in_memory_repo.get_movie_ids_page(movie_filter, 5, after_id=29) == (
+        MovieIdPage([33, 35, 36, 37, 49], True, True, 120)
+    )
+    assert in_memory_repo.get_movie_ids_page(movie_filter, 5, before_id=36) == (
+        MovieIdPage([13, 20, 25, 33, 35], True, True, 120)
+    )
+    assert in_memory_repo.get_movie_ids_page(movie_filter, 5, before_id=10) == MovieIdPage([1, 2], False, True, 120)
+    assert in_memory_repo.get_movie_ids_page(movie_filter, 5, after_id=949) == MovieIdPage([955, 962], True, False, 120)
+
+
+def test_repository_can_get_a_page_of_faceted_movie_ids(in_memory_repo):
+    movie_filter = MovieFilter(director='Christopher Nolan')
+
+    assert in_memory_repo.get_movie_ids_page(movie_filter, 2, after_id=55) == MovieIdPage([65, 81], True, True, 5)
+    assert in_memory_repo.get_movie_ids_page(MovieFilter(genres=('Nonexistent',)), 5) == MovieIdPage([], False, False, 0)
+
+
+def test_facet_index_matches_genre_associations_made_before_movies():
+    index = FacetIndex()
+    index.add_genre_movie('Drama', 2)
+    index.add_movie(1, 2015, 'Jane Doe', 7.5)
+    index.add_movie(2, 2016, 'Jane Doe', 6.0)
+
+    assert index.query(MovieFilter(genres=('Drama',))) == (
+        [2], {'genre': {'Drama': 1}, 'year': {2016: 1}, 'director': {'Jane Doe': 1}, 'rating': {6: 1}}
+    )
+    assert index.query(MovieFilter(first_year=2015))[0] == [1, 2]
+    assert index.query(MovieFilter(last_year=2015, director='Jane Doe'))[0] == [1]
+
+
+def add_reviews(repo, reviews):
+    for username, movie_id in reviews:
+        repo.add_review(make_review('Seen it', repo.get_user(username), repo.get_movie(movie_id)))
+
+
+def test_repository_data_version_increases_with_additions(in_memory_repo):
+    version, modified = in_memory_repo.get_data_version()
+
+    add_reviews(in_memory_repo, [('thorke', 2)])
+    assert in_memory_repo.get_data_version()[0] > version
+    assert in_memory_repo.get_data_version()[1] >= modified
+
+    version = in_memory_repo.get_data_version()[0]
+    in_memory_repo.add_genre(Genre('Motoring'))
+    assert in_memory_repo.get_data_version()[0] > version
+
+
+def test_repository_can_retrieve_co_reviewed_movies(in_memory_repo):
+    # fmercury and thorke have both reviewed movie 1.
+    add_reviews(in_memory_repo, [('thorke', 2), ('thorke', 3), ('fmercury', 3), ('fmercury', 3)])
+
+    movies = in_memory_repo.get_co_reviewed_movies(1, 5)
+
+    assert [movie.id for movie in movies] == [3, 2]
+    assert [movie.id for movie in in_memory_repo.get_co_reviewed_movies(2, 5)] == [1, 3]
+    assert [movie.id for movie in in_memory_repo.get_co_reviewed_movies(1, 1)] == [3]
+
+
+def test_repository_returns_an_empty_list_for_a_movie_without_co_reviews(in_memory_repo):
+    assert in_memory_repo.get_co_reviewed_movies(1, 5) == []
+    assert in_memory_repo.get_co_reviewed_movies(10000, 5) == []
+
+
+def test_co_review_index_keeps_the_most_co_reviewed_movies():
+    index = CoReviewIndex()
+    # Movie 0 is co-reviewed once with each of many movies, and repeatedly with movies 1 to 3.
+    for user in range(4 * COUNTERS_PER_MOVIE):
+        index.add_review(user, 0)
+        index.add_review(user, 1000 + user)
+        index.add_review(user, 1 + user % 3)
+
+    assert index.get_co_reviewed_movie_ids(0, 3) == [1, 2, 3]
+    assert index.get_co_reviewed_movie_ids(1000, 5) == [0, 1]
+
+
+def test_co_review_index_sorts_a_bounded_number_of_counters(monkeypatch):
+    sort_sizes = list()
+
+    def counting_sorted(iterable, **kwargs):
+        items = sorted(iterable, **kwargs)
+        sort_sizes.append(len(items))
+        return items
+
+    monkeypatch.setattr('movies.adapters.co_review_index.sorted', counting_sorted, raising=False)
+
+    index = CoReviewIndex()
+    number_of_movies = 1000
+    generator = random.Random(0)
+    for user in range(400000):
+        for movie_id in generator.sample(range(number_of_movies), 5):
+            index.add_review(user, movie_id)
+    assert index.number_of_interactions == 2000000
+
+    # Each movie is co-reviewed with far more movies than it keeps counters for, so they're trimmed as they grow. A
+    # review adds at most one counter for each of the reviewer's other four movies before the trim.
+    assert 2 * COUNTERS_PER_MOVIE <= max(sort_sizes) < 2 * COUNTERS_PER_MOVIE + 4
+
+    sort_sizes.clear()
+    for movie_id in range(number_of_movies):
+        assert len(index.get_co_reviewed_movie_ids(movie_id, 10)) == 10
+    assert max(sort_sizes) < 2 * COUNTERS_PER_MOVIE + 4
 
+    # The neighbours found are kept, so looking them up again sorts nothing.
+    sort_sizes.clear()
+    for movie_id in range(number_of_movies):
+        index.get_co_reviewed_movie_ids(movie_id, 10)
+    assert sort_sizes == []
@@ -1,11 +1,17 @@
 from datetime import date
 
+from movies.domain.model import Movie, Genre, make_genre_association
+from movies.adapters.facet_index import MovieFilter
+
 import pytest
 
 from movies.authentication.services import AuthenticationException
 from movies.news import services as news_services
 from movies.authentication import services as auth_services
 from movies.news.services import NonExistentMovieException
+from movies.news.recommender import MovieRecommender
+from movies.utilities import services as utilities_services
+from movies.utilities.fragment_cache import FragmentCache
 
 
 def test_can_add_user(in_memory_repo):
@@ -149,6 +155,18 @@ def test_get_movies_by_date_with_multiple_dates(in_memory_repo):
     assert next_date is None
 
 
+def test_get_date_page(in_memory_repo):
+    target_date = date.fromisoformat('2017-01-01')
+
+    movies_as_dict, first_date, prev_date, next_date, last_date = news_services.get_date_page(target_date, in_memory_repo)
+
+    assert sorted(movie['id'] for movie in movies_as_dict) == [402, 758]
+    assert first_date == date.fromisoformat('2006-01-01')
+    assert prev_date == date.fromisoformat('2016-01-01')
+    assert next_date is None
+    assert last_date == target_date
+
+
 def test_get_movies_by_date_with_non_existent_date(in_memory_repo):
     target_date = date.fromisoformat('2020-03-06')
 
@@ -170,6 +188,113 @@ def test_get_movies_by_id(in_memory_repo):
     assert set([5, 6]).issubset(movie_ids)
 
 
+def test_search_movies(in_memory_repo):
+    movies_as_dict = news_services.search_movies('The Dark Knight', 5, 0, in_memory_repo)
+
+    assert [movie['id'] for movie in movies_as_dict] == [55, 125]
+    assert movies_as_dict[0]['title'] == 'The Dark Knight'
+
+
+def test_get_completions(in_memory_repo):
+    completions = news_services.get_completions('dark kn', 5, in_memory_repo)
+
+    assert completions['titles'] == [
+        {'text': 'The Dark Knight', 'movie_id': 55}, {'text': 'The Dark Knight Rises', 'movie_id': 125}
+    ]
+    assert completions['directors'] == [] and completions['actors'] == []
+
+
+def test_get_similar_movies(in_memory_repo):
+    recommender = MovieRecommender(in_memory_repo)
+
+    movies_as_dict = news_services.get_similar_movies(55, 5, recommender)
+
+    # Christopher Nolan's other movies, led by those that also star Christian Bale.
+    assert [movie['id'] for movie in movies_as_dict] == [65, 125, 425, 37, 81]
+
+
+def test_get_similar_movies_for_a_non_existent_movie(in_memory_repo):
+    assert news_services.get_similar_movies(10000, 5, MovieRecommender(in_memory_repo)) == []
+
+
+def test_recommender_scores_several_movies_at_once(in_memory_repo):
+    recommender = MovieRecommender(in_memory_repo)
+    recommender.refresh()
+
+    similar_ids = recommender.get_similar_movie_ids([55, 1, 10000], 3)
+
+    assert similar_ids == [[65, 125, 425], [49, 86, 363], []]
+    assert similar_ids[:2] == [recommender.get_similar_movie_ids([id], 3)[0] for id in (55, 1)]
+
+
+def test_recommender_picks_up_added_movies_and_genres(in_memory_repo):
+    recommender = MovieRecommender(in_memory_repo)
+    recommender.refresh()
+    assert recommender.number_of_movies == 1000
+
+    # The new movie shares only its director with Nolan's movies.
+    movie = Movie(date.fromisoformat('2020-03-15'), 'Nolan Returns', '', '', '', 1001,
+                  'Jane Doe', 100, 'Christopher Nolan', 7.0, 1001)
+    in_memory_repo.add_movie(movie)
+    similar_ids = [movie['id'] for movie in news_services.get_similar_movies(1001, 10, recommender)]
+    assert sorted(similar_ids) == [37, 55, 65, 81, 125]
+    assert recommender.number_of_movies == 1001
+
+    # A new genre shared only with Inception makes it the most similar movie.
+    genre = Genre('Dreams')
+    make_genre_association(movie, genre)
+    make_genre_association(in_memory_repo.get_movie(81), genre)
+    in_memory_repo.add_genre(genre)
+    assert news_services.get_similar_movies(1001, 1, recommender)[0]['id'] == 81
+
+
+def test_get_co_reviewed_movies(in_memory_repo):
+    news_services.add_review(2, 'Seen it too', 'thorke', in_memory_repo)
+
+    movies_as_dict = news_services.get_co_reviewed_movies(1, 5, in_memory_repo)
+
+    assert [movie['id'] for movie in movies_as_dict] == [2]
+
+
+def test_get_faceted_movies(in_memory_repo):
+    movie_ids, facets = news_services.get_faceted_movies(MovieFilter(director='Christopher Nolan'), in_memory_repo)
+
+    assert movie_ids == [37, 55, 65, 81, 125]
+    assert facets['year'] == [(2006, 1), (2008, 1), (2010, 1), (2012, 1), (2014, 1)]
+    assert facets['rating'] == [(9, 1), (8, 4)]
+    assert facets['genre'][0] == ('Action', 3)
+    assert facets['director'] == [('Christopher Nolan', 5)]
+
+
+def test_get_movie_ids_page(in_memory_repo):
+    page = news_services.get_movie_ids_page(MovieFilter(genres=('Sci-Fi',)), 3, 2, None, in_memory_repo)
+
+    assert page.movie_ids == [13, 20, 25]
+    assert page.has_previous and page.has_next
+    assert page.total == 120
+
+
+def test_get_movie_with_selected_fields(in_memory_repo):
+    movie_as_dict = news_services.get_movie(1, in_memory_repo, ['id', 'title'])
+
+    assert movie_as_dict == {'id': 1, 'title': 'Guardians of the Galaxy'}
+    assert list(news_services.get_movie(1, in_memory_repo)) == list(news_services.MOVIE_FIELDS)
+
+
+def test_get_leaderboard_movies(in_memory_repo):
+    news_services.add_review(2, 'Seen it', 'thorke', in_memory_repo)
+
+    assert [movie['id'] for movie in news_services.get_top_rated_movies(3, in_memory_repo)] == [55, 118, 81]
+    assert news_services.get_longest_movies(1, in_memory_repo)[0]['time'] == max(
+        movie.time for movie in in_memory_repo.get_movies_by_id(range(1, 1001))
+    )
+    assert [movie['id'] for movie in news_services.get_most_reviewed_movies(5, None, in_memory_repo)] == [1, 2]
+    assert [movie['id'] for movie in news_services.get_most_reviewed_movies(5, date(2020, 3, 1), in_memory_repo)] == [2]
+
+    movies_as_dict = news_services.get_top_rated_movies_for_genre('Sci-Fi', 2, 2000, in_memory_repo)
+    assert [movie['id'] for movie in movies_as_dict] == [65, 469]
+
+
 def test_get_reviews_for_movie(in_memory_repo):
     reviews_as_dict = news_services.get_reviews_for_movie(1, in_memory_repo)
 
@@ -189,3 +314,43 @@ def test_get_reviews_for_movie_without_reviews(in_memory_repo):
     reviews_as_dict = news_services.get_reviews_for_movie(2, in_memory_repo)
     assert len(reviews_as_dict) == 0
 
+
+def test_get_random_movies(in_memory_repo):
+    movies_as_dict = utilities_services.get_random_movies(4, in_memory_repo)
+
+    assert len(movies_as_dict) == 4
+    assert len({movie['id'] for movie in movies_as_dict}) == 4
+
+
+def test_random_movie_pool_samples_once_per_batch(in_memory_repo, monkeypatch):
+    calls = []
+    get_random_movies = in_memory_repo.get_random_movies
+    monkeypatch.setattr(in_memory_repo, 'get_random_movies', lambda quantity: calls.append(quantity) or get_random_movies(quantity))
+    pool = utilities_services.RandomMoviePool(in_memory_repo, 8)
+
+    first = pool.get_random_movies(4)
+    second = pool.get_random_movies(4)
+
+    assert calls == [8]
+    assert len({movie['id'] for movie in first + second}) == 8
+
+    pool.get_random_movies(4)
+    assert calls == [8, 8]
+
+
+def test_fragment_cache_evicts_least_recently_used_fragments():
+    cache = FragmentCache(max_bytes=10)
+    cache.put('a', 'aaaa')
+    cache.put('b', 'bbbb')
+    assert cache.get('a') == 'aaaa'
+
+    # Adding 'c' takes the cache past 10 characters, so 'b', the least recently used, goes.
+    cache.put('c', 'cccc')
+    assert cache.get('b') is None
+    assert cache.get('a') == 'aaaa' and cache.get('c') == 'cccc'
+    assert cache.size == 8 and len(cache) == 2
+
+    # Fragments bigger than the whole cache aren't kept.
+    cache.put('d', 'd' * 11)
+    assert cache.get('d') is None
+    assert (cache.hits, cache.misses) == (3, 2)